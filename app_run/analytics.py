@@ -0,0 +1,129 @@
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import F, Q, Count, Sum, Max, Window
+from django.db.models.functions import Coalesce, Greatest, RowNumber
+
+from .models import Run, AthleteStats, CoachStats, Subscribe
+from .caching import USERS, ANALYTICS, invalidate
+
+
+def refresh_athlete_stats(run):
+    # Добавляет только что завершённый забег к статистике атлета одним UPDATE
+    distance, speed = run.distance or 0, run.speed or 0
+    stats, created = AthleteStats.objects.get_or_create(user_id=run.athlete_id)
+    AthleteStats.objects.filter(id=stats.id).update(
+        runs_count=F('runs_count') + 1,
+        speed_sum=F('speed_sum') + speed,
+        total_distance=F('total_distance') + distance,
+        longest_run=Greatest(Coalesce('longest_run', distance), distance),
+        avg_speed=(F('speed_sum') + speed) / (F('runs_count') + 1),
+    )
+    invalidate(USERS, ANALYTICS)
+
+
+def remove_athlete_run(run):
+    # Удалённый завершённый забег: статистика атлета пересчитывается по оставшимся забегам.
+    # Строка только обновляется — при каскадном удалении пользователя её нельзя создавать заново
+    row = Run.objects.filter(athlete_id=run.athlete_id, status=Run.Status.FINISHED).aggregate(
+        runs_count=Count('id'), speed_sum=Sum('speed'), longest_run=Max('distance'), total_distance=Sum('distance')
+    )
+    speed_sum = row['speed_sum'] or 0
+    AthleteStats.objects.filter(user_id=run.athlete_id).update(
+        runs_count=row['runs_count'],
+        speed_sum=speed_sum,
+        longest_run=row['longest_run'],
+        total_distance=row['total_distance'] or 0,
+        avg_speed=speed_sum / row['runs_count'] if row['runs_count'] else None,
+    )
+    invalidate(USERS, ANALYTICS)
+
+
+def rebuild_athlete_stats():
+    rows = (
+        Run.objects.filter(status=Run.Status.FINISHED)
+        .values('athlete_id')
+        .annotate(runs_count=Count('id'), speed_sum=Sum('speed'), longest_run=Max('distance'),
+                  total_distance=Sum('distance'))
+    )
+    stats = [
+        AthleteStats(
+            user_id=row['athlete_id'],
+            runs_count=row['runs_count'],
+            speed_sum=row['speed_sum'] or 0,
+            longest_run=row['longest_run'],
+            total_distance=row['total_distance'] or 0,
+            avg_speed=(row['speed_sum'] or 0) / row['runs_count'],
+        )
+        for row in rows
+    ]
+    with transaction.atomic():
+        AthleteStats.objects.all().delete()
+        AthleteStats.objects.bulk_create(stats, batch_size=1000)
+        invalidate(USERS, ANALYTICS)
+    return len(stats)
+
+
+def rate_coach(subscribe, rating):
+    # Новая оценка прибавляется к сумме и числу оценок тренера, повторная заменяет прежнюю
+    with transaction.atomic():
+        previous = Subscribe.objects.select_for_update().filter(id=subscribe.id).values_list('rating', flat=True).get()
+        subscribe.rating = rating
+        subscribe.save(update_fields=['rating'])
+
+        stats, created = CoachStats.objects.get_or_create(user_id=subscribe.coach_id)
+        CoachStats.objects.filter(id=stats.id).update(
+            rating_sum=F('rating_sum') + rating - (previous or 0),
+            rating_count=F('rating_count') + (1 if previous is None else 0),
+        )
+
+
+def rebuild_coach_stats():
+    rows = (
+        Subscribe.objects.filter(rating__isnull=False)
+        .values('coach_id')
+        .annotate(rating_sum=Sum('rating'), rating_count=Count('id'))
+    )
+    stats = [
+        CoachStats(user_id=row['coach_id'], rating_sum=row['rating_sum'], rating_count=row['rating_count'])
+        for row in rows
+    ]
+    with transaction.atomic():
+        CoachStats.objects.all().delete()
+        CoachStats.objects.bulk_create(stats, batch_size=1000)
+        invalidate(USERS)
+    return len(stats)
+
+
+# Показатель AthleteStats и ключи ответа с его лидером
+LEADER_FIELDS = {
+    'longest_run': ('longest_run_user', 'longest_run_value'),
+    'total_distance': ('total_run_user', 'total_run_value'),
+    'avg_speed': ('speed_avg_user', 'speed_avg_value'),
+}
+
+
+def coach_leaders(coach_id):
+    # Лидер по показателю — первая строка своего порядка: наибольшее значение, при равенстве меньший id,
+    # атлеты без значения в конце. Строки нумерует база, в Python приходят только лидеры, не больше трёх
+    ranks = {
+        f'{field}_rank': Window(RowNumber(), order_by=[
+            F(f'athlete__athlete_stats__{field}').desc(nulls_last=True), F('athlete_id').asc()
+        ])
+        for field in LEADER_FIELDS
+    }
+    rows = list(
+        Subscribe.objects.filter(coach_id=coach_id)
+        .annotate(**ranks)
+        .filter(reduce(or_, [Q(**{rank: 1}) for rank in ranks]))
+        .values('athlete_id', *ranks, *[f'athlete__athlete_stats__{field}' for field in LEADER_FIELDS])
+    )
+
+    leaders = {}
+    for field, (user_key, value_key) in LEADER_FIELDS.items():
+        for row in rows:
+            if row[f'{field}_rank'] == 1:
+                leaders[user_key] = row['athlete_id']
+                leaders[value_key] = row[f'athlete__athlete_stats__{field}']
+    return leaders
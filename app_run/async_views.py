@@ -0,0 +1,279 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework import serializers
+from rest_framework.fields import empty
+
+from .models import Run, User, Position, Subscribe, PackedTrack
+from .serializers import RunSerializer, PositionSerializer, PositionFixSerializer, PositionBatchSerializer
+from .ingest import measure_positions, check_fixes, run_aggregates, items_around, collected_items, stop_run
+from .packing import unpack_positions
+from .live import positions_message, status_message, apublish, athlete_channel, get_broker
+
+
+# Асинхронные версии приёма точек и старта/остановки забега для запуска под ASGI (project_run/asgi.py).
+# Запросы к базе идут через асинхронный ORM, поэтому медленное мобильное соединение не держит поток.
+# Проверки и ответы те же, что у PositionViewSet, StartAPIView и StopAPIView
+
+BATCH_FIELDS = PositionBatchSerializer().fields
+RUN_ERRORS = BATCH_FIELDS['run'].error_messages
+RUN_NOT_FOUND = {'detail': 'No Run matches the given query.'}
+
+
+def read_json(request):
+    try:
+        data = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def bad_json():
+    return JsonResponse({'detail': 'Тело запроса должно быть JSON-объектом'}, status=400)
+
+
+async def active_run(run_id):
+    # Как поле run в PositionBatchSerializer: забег должен существовать и быть в процессе
+    if run_id is empty:
+        return None, [RUN_ERRORS['required']]
+    if run_id is None:
+        return None, [RUN_ERRORS['null']]
+    if isinstance(run_id, bool):
+        return None, [RUN_ERRORS['incorrect_type'].format(data_type=type(run_id).__name__)]
+    try:
+        run = await Run.objects.select_related('athlete').filter(pk=run_id).afirst()
+    except (TypeError, ValueError):
+        return None, [RUN_ERRORS['incorrect_type'].format(data_type=type(run_id).__name__)]
+    if run is None:
+        return None, [RUN_ERRORS['does_not_exist'].format(pk_value=run_id)]
+    if run.status != Run.Status.IN_PROGRESS:
+        return None, ["Статус забега не 'В процессе'"]
+    return run, None
+
+
+async def save_positions(run, last_pos, fixes):
+    speeds, distances, run_distance = measure_positions(
+        run, last_pos, [(fix['latitude'], fix['longitude']) for fix in fixes], [fix['date_time'] for fix in fixes]
+    )
+    positions = [
+        Position(run=run, speed=speed, distance=distance, **fix)
+        for fix, speed, distance in zip(fixes, speeds, distances)
+    ]
+    if len(positions) == 1:
+        await positions[0].asave()
+    else:
+        await Position.objects.abulk_create(positions)
+    await Run.objects.filter(id=run.id).aupdate(**run_aggregates(positions, run_distance))
+
+    cords = [(position.latitude, position.longitude) for position in positions]
+    collected = collected_items([item async for item in items_around(cords)], cords)
+    if collected:
+        await run.athlete.collectibles.aadd(*collected)
+    await apublish(run, positions_message(run, positions))
+    return positions
+
+
+def last_position(run):
+    return Position.objects.filter(run=run).order_by('id').alast()
+
+
+
+class AsyncPositionView(View):
+
+    async def post(self, request):
+        data = read_json(request)
+        if data is None:
+            return bad_json()
+
+        serializer = PositionFixSerializer(data=data)
+        errors = {} if serializer.is_valid() else dict(serializer.errors)
+        run, run_errors = await active_run(data.get('run', empty))
+        if run_errors:
+            errors['run'] = run_errors
+        if errors:
+            return JsonResponse(errors, status=400)
+
+        positions = await save_positions(run, await last_position(run), [serializer.validated_data])
+        return JsonResponse(PositionSerializer(positions[0]).data, status=201)
+
+
+
+class AsyncPositionBatchView(View):
+
+    async def post(self, request):
+        data = read_json(request)
+        if data is None:
+            return bad_json()
+
+        errors = {}
+        run, run_errors = await active_run(data.get('run', empty))
+        if run_errors:
+            errors['run'] = run_errors
+        try:
+            fixes = BATCH_FIELDS['positions'].run_validation(data.get('positions', empty))
+        except serializers.ValidationError as error:
+            errors['positions'] = error.detail
+        if errors:
+            return JsonResponse(errors, status=400)
+
+        last_pos = await last_position(run)
+        fixes, results = check_fixes(
+            [(index, PositionFixSerializer(data=fix)) for index, fix in enumerate(fixes)],
+            last_pos.date_time if last_pos else None
+        )
+
+        positions = await save_positions(run, last_pos, fixes) if fixes else []
+        created = iter(positions)
+        for result in results:
+            if result['accepted']:
+                result['id'] = next(created).id
+
+        return JsonResponse(results, status=201 if positions else 400, safe=False)
+
+
+
+class AsyncStartView(View):
+
+    async def post(self, request, run_id):
+        run = await Run.objects.select_related('athlete').filter(id=run_id).afirst()
+        if run is None:
+            return JsonResponse(RUN_NOT_FOUND, status=404)
+        if run.status != Run.Status.INIT:
+            return HttpResponse(status=400)
+
+        run.status = Run.Status.IN_PROGRESS
+        await run.asave()
+        await apublish(run, status_message(run))
+        return JsonResponse(RunSerializer(run).data)
+
+
+
+class AsyncStopView(View):
+
+    async def post(self, request, run_id):
+        run = await Run.objects.select_related('athlete').filter(id=run_id).afirst()
+        if run is None:
+            return JsonResponse(RUN_NOT_FOUND, status=404)
+        if run.status != Run.Status.IN_PROGRESS:
+            return HttpResponse(status=400)
+
+        # Завершение забега, счётчики, челленджи и упаковка трека работают в транзакциях синхронного ORM;
+        # забег завершается один раз, поэтому это достаточно выполнить в потоке
+        if not await sync_to_async(stop_run)(run):
+            return HttpResponse(status=400)
+        await apublish(run, status_message(run))
+        return JsonResponse(RunSerializer(run).data)
+
+
+
+def last_event_id(request):
+    # Переподключившийся EventSource присылает id последнего полученного события
+    value = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    return int(value) if value and value.isdigit() else None
+
+
+def sse_event(message, data):
+    lines = []
+    if data['type'] == 'positions':
+        lines.append(f'id: {data["positions"][-1]["id"]}')
+    lines.append(f'event: {data["type"]}')
+    lines.append(f'data: {message}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def event_stream(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def run_events(run, last_id):
+    subscription = await get_broker().subscribe([athlete_channel(run.athlete_id)])
+    try:
+        # Подписка оформлена раньше чтения пропущенных точек, поэтому между ними ничего не теряется,
+        # а повторы отсекаются по id
+        if last_id is not None:
+            missed = Position.objects.filter(run=run, id__gt=last_id).order_by('id')
+            positions = [position async for position in missed]
+            if not positions:
+                # Завершённый забег мог быть упакован: строки Position удаляются в одной транзакции
+                # с созданием PackedTrack, поэтому трек читается после строк
+                track = await PackedTrack.objects.filter(run=run).afirst()
+                if track is not None:
+                    positions = [position for position in unpack_positions(track) if position.id > last_id]
+            if positions:
+                message = positions_message(run, positions)
+                yield sse_event(message, json.loads(message))
+                last_id = positions[-1].id
+
+        run = await Run.objects.aget(id=run.id)
+        if run.status == Run.Status.FINISHED:
+            message = status_message(run)
+            yield sse_event(message, json.loads(message))
+            return
+
+        while True:
+            message = await subscription.get(settings.LIVE_HEARTBEAT)
+            if message is None:
+                if subscription.overflowed:
+                    return
+                yield ': ping\n\n'
+                continue
+
+            data = json.loads(message)
+            if data['run'] != run.id:
+                continue
+            if data['type'] == 'positions' and last_id is not None:
+                if data['positions'][-1]['id'] <= last_id:
+                    continue
+                data['positions'] = [position for position in data['positions'] if position['id'] > last_id]
+                message = json.dumps(data)
+            yield sse_event(message, data)
+            if data['type'] == 'status' and data['status'] == Run.Status.FINISHED:
+                return
+    finally:
+        await subscription.close()
+
+
+async def coach_events(athlete_ids):
+    subscription = await get_broker().subscribe([athlete_channel(athlete_id) for athlete_id in athlete_ids])
+    try:
+        while True:
+            message = await subscription.get(settings.LIVE_HEARTBEAT)
+            if message is None:
+                if subscription.overflowed:
+                    return
+                yield ': ping\n\n'
+                continue
+            yield sse_event(message, json.loads(message))
+    finally:
+        await subscription.close()
+
+
+
+class LiveRunView(View):
+    # Точки забега по мере поступления; поток закрывается, когда забег завершён
+
+    async def get(self, request, run_id):
+        run = await Run.objects.filter(id=run_id).afirst()
+        if run is None:
+            return JsonResponse(RUN_NOT_FOUND, status=404)
+        return event_stream(run_events(run, last_event_id(request)))
+
+
+
+class LiveCoachView(View):
+    # Точки и смена статусов забегов всех атлетов, подписанных на тренера на момент подключения
+
+    async def get(self, request, coach_id):
+        coach = await User.objects.filter(id=coach_id, is_staff=True, is_superuser=False).afirst()
+        if coach is None:
+            return JsonResponse({'detail': 'No User matches the given query.'}, status=404)
+        subscribes = Subscribe.objects.filter(coach=coach).values_list('athlete_id', flat=True)
+        athlete_ids = [athlete_id async for athlete_id in subscribes]
+        return event_stream(coach_events(athlete_ids))
+
@@ -0,0 +1,397 @@
+import time
+import warnings
+from datetime import timedelta
+from statistics import mean, quantiles
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, reverse
+from django.utils import timezone
+
+from .models import Run, User, Position, CollectibleItem, ImportJob, Challenge
+from .challenges import CHALLENGE_RULES
+from .synthetic import Generator, username_prefix
+
+
+# Бенчмарк эндпоинтов: каждый маршрут project_run/urls.py вызывается через тестовый клиент на синтетических
+# данных нескольких размеров (app_run/synthetic.py). Для каждого сценария считаются перцентили задержки
+# и число SQL-запросов, а затем проверяются бюджеты: абсолютные пределы и рост от меньшего набора к большему.
+# Данные каждого размера создаются в транзакции и откатываются, кэш ответов сбрасывается перед каждым запросом
+
+# Клиент вне INTERNAL_IPS, чтобы debug toolbar не добавлял свою работу к замерам
+CLIENT_ADDRESS = '10.0.0.1'
+# Маршруты, для которых нет сценария, и почему
+SKIPPED_ROUTES = {
+    'live_coach': 'поток событий тренера не заканчивается сам и не измеряется одним запросом',
+    'challenges_summary-detail': 'у ChallengesSummaryViewSet нет queryset, retrieve не поддерживается',
+}
+# Набор данных размера 1; размер N умножает число атлетов, тренеров и предметов, забеги атлета не меняются
+BASE_DATASET = {'athletes': 25, 'coaches': 5, 'runs': 4, 'positions': 60, 'items': 200}
+SIZES = [1, 4, 16]
+# complexity: constant — задержка не должна расти вместе с данными больше чем в latency_growth раз,
+# linear — допускается рост пропорционально размеру. query_growth — на сколько может вырасти число запросов
+DEFAULT_BUDGET = {'p95_ms': 250, 'queries': None, 'complexity': 'constant', 'latency_growth': 3, 'query_growth': 0}
+BUDGETS = {
+    'api-root': {'queries': 0},
+    'company_details': {'queries': 0},
+    'run-list': {'queries': 2},
+    'run-list:athlete': {'queries': 3},
+    'run-create': {'queries': 2},
+    'run-detail': {'queries': 1},
+    'run-metrics': {'queries': 3},
+    'start_run': {'queries': 3},
+    # Завершение забега и подписка переносят строки атлета в деревьях счётчиков таблиц лидеров
+    'stop_run': {'queries': 17},
+    'export_run': {'queries': 3},
+    'export_athlete_runs': {'queries': 10},
+    'user-list': {'queries': 2},
+    'user-list:search': {'queries': 2},
+    'user-list:expand': {'queries': 4},
+    'user-detail:athlete': {'queries': 3},
+    'user-detail:coach': {'queries': 3},
+    'user-suggest': {'queries': 1},
+    'athlete_info': {'queries': 2},
+    'challenges-list': {'queries': 1},
+    'challenges-detail': {'queries': 1},
+    'challenges_summary-list': {'queries': 1},
+    'position-list': {'queries': 3},
+    'position-list:simplify': {'queries': 3},
+    'position-detail': {'queries': 1},
+    # Сбор предметов рядом с точкой добавляет запросы, только когда предмет нашёлся, — это зависит от данных
+    'position-create': {'queries': 7, 'query_growth': 6},
+    'position-batch': {'queries': 11, 'query_growth': 6},
+    # Список предметов без пагинации отдаёт весь каталог
+    'collectibleitem-list': {'queries': 1, 'complexity': 'linear'},
+    'collectibleitem-detail': {'queries': 1},
+    'collectibleitem-nearby': {'queries': 2},
+    'collectibleitem-viewport': {'queries': 1},
+    'upload_collectible_file': {'queries': 1},
+    'upload_collectible_job': {'queries': 1},
+    'subscribe_to_coach': {'queries': 6},
+    'rate_coach': {'queries': 7},
+    'analytics_for_coach': {'queries': 1},
+    'leaderboard': {'queries': 1},
+    'leaderboard_rank': {'queries': 3},
+    'async_positions': {'queries': 7, 'query_growth': 6},
+    'async_positions_batch': {'queries': 11, 'query_growth': 6},
+    'async_start_run': {'queries': 2},
+    'async_stop_run': {'queries': 17},
+    'live_run': {'queries': 2},
+}
+# Ниже этой разницы (мс) рост задержки считается шумом
+NOISE_MS = 2
+SQL_SERVICE_PREFIXES = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+UPLOAD_ROWS = 50
+
+
+
+class Scenario:
+    # prepare(fixtures, iteration) возвращает путь и данные запроса; объекты, которые запрос меняет,
+    # создаются там же, до замера
+    def __init__(self, name, route, prepare, method='get', status=200, content_type='application/json'):
+        self.name = name
+        self.route = route
+        self.prepare = prepare
+        self.method = method
+        self.status = status
+        self.content_type = content_type
+
+
+
+class Fixtures:
+    # Объекты набора данных, на которых выполняются запросы: тренер с наибольшим числом подписчиков,
+    # его атлет с наибольшим числом забегов и самый длинный забег этого атлета. Забеги, которые создают
+    # сценарии, принадлежат отдельному атлету runner, чтобы не менять данные читающих сценариев
+
+    def __init__(self, seed):
+        prefix = username_prefix(seed)
+        self.coach = (
+            User.objects.filter(username__startswith=prefix, is_staff=True)
+            .annotate(followers=Count('coach')).order_by('-followers', 'id').first()
+        )
+        self.athlete = (
+            User.objects.filter(athlete__coach=self.coach)
+            .annotate(finished=Count('runs', filter=Q(runs__status=Run.Status.FINISHED)))
+            .order_by('-finished', 'id').first()
+        )
+        self.run = (
+            Run.objects.filter(athlete=self.athlete, status=Run.Status.FINISHED)
+            .order_by('-positions_count', 'id').first()
+        )
+        self.position = Position.objects.filter(run=self.run).order_by('id').first()
+        self.item = CollectibleItem.objects.filter(uid__startswith=prefix).order_by('id').first()
+        self.runner = User.objects.create(username=f'{prefix}runner')
+        self.live_run = self.new_run(Run.Status.IN_PROGRESS)
+        self.challenge = Challenge.objects.order_by('id').first() or Challenge.objects.create(
+            full_name=CHALLENGE_RULES[0].full_name, athlete=self.runner
+        )
+        self.job = ImportJob.objects.create(file_name='benchmark.csv')
+        self.clock = timezone.now()
+        self.counter = 0
+
+    def next(self):
+        self.counter += 1
+        return self.counter
+
+    def new_run(self, status):
+        return Run.objects.create(athlete=self.runner, status=status, comment='benchmark')
+
+    def stopping_run(self):
+        # Забег в процессе с агрегатами самого длинного забега: остановка считает итоги по ним
+        run = self.new_run(Run.Status.IN_PROGRESS)
+        fields = ['positions_count', 'positions_distance', 'speed_sum', 'first_position_at', 'last_position_at']
+        Run.objects.filter(id=run.id).update(**{name: getattr(self.run, name) for name in fields})
+        return run
+
+    def new_athlete(self):
+        return User.objects.create(username=f'benchmark_athlete_{self.next()}')
+
+    def fix(self):
+        self.clock += timedelta(seconds=5)
+        step = self.next() * 0.0001
+        return {
+            'latitude': round(float(self.position.latitude) + step, 4),
+            'longitude': float(self.position.longitude),
+            'date_time': self.clock.isoformat(),
+        }
+
+    def upload_file(self):
+        number = self.next()
+        rows = ['name,uid,value,latitude,longitude,picture'] + [
+            f'Предмет {i},benchmark-{number}-{i},{i % 100 + 1},55.{i:04d},37.6173,https://example.com/{i}.png'
+            for i in range(UPLOAD_ROWS)
+        ]
+        return SimpleUploadedFile('items.csv', '\n'.join(rows).encode(), content_type='text/csv')
+
+
+def path(route, **kwargs):
+    return reverse(route, kwargs=kwargs)
+
+
+SCENARIOS = [
+    Scenario('api-root', 'api-root', lambda f, i: (path('api-root'), None)),
+    Scenario('company_details', 'company_details', lambda f, i: (path('company_details'), None)),
+
+    Scenario('run-list', 'run-list', lambda f, i: (path('run-list'), {'size': 50})),
+    Scenario('run-list:athlete', 'run-list', lambda f, i: (path('run-list'), {'athlete': f.athlete.id, 'size': 50})),
+    Scenario('run-create', 'run-list',
+             lambda f, i: (path('run-list'), {'athlete': f.runner.id, 'comment': 'benchmark'}),
+             method='post', status=201),
+    Scenario('run-detail', 'run-detail', lambda f, i: (path('run-detail', pk=f.run.id), None)),
+    Scenario('run-metrics', 'run-metrics', lambda f, i: (path('run-metrics', pk=f.run.id), None)),
+    Scenario('start_run', 'start_run',
+             lambda f, i: (path('start_run', run_id=f.new_run(Run.Status.INIT).id), None), method='post'),
+    Scenario('stop_run', 'stop_run',
+             lambda f, i: (path('stop_run', run_id=f.stopping_run().id), None), method='post'),
+    Scenario('export_run', 'export_run',
+             lambda f, i: (path('export_run', run_id=f.run.id, export_format='gpx'), None)),
+    Scenario('export_athlete_runs', 'export_athlete_runs',
+             lambda f, i: (path('export_athlete_runs', athlete_id=f.athlete.id, export_format='csv'), None)),
+
+    Scenario('user-list', 'user-list', lambda f, i: (path('user-list'), {'size': 50})),
+    Scenario('user-list:search', 'user-list', lambda f, i: (path('user-list'), {'search': 'иван', 'size': 50})),
+    Scenario('user-list:expand', 'user-list',
+             lambda f, i: (path('user-list'), {'expand': 'coach,athletes,items', 'size': 50})),
+    Scenario('user-detail:athlete', 'user-detail', lambda f, i: (path('user-detail', pk=f.athlete.id), None)),
+    Scenario('user-detail:coach', 'user-detail', lambda f, i: (path('user-detail', pk=f.coach.id), None)),
+    Scenario('user-suggest', 'user-suggest', lambda f, i: (path('user-suggest'), {'q': 'ив'})),
+    Scenario('athlete_info', 'athlete_info', lambda f, i: (path('athlete_info', user_id=f.athlete.id), None)),
+
+    Scenario('challenges-list', 'challenges-list', lambda f, i: (path('challenges-list'), {'athlete': f.athlete.id})),
+    Scenario('challenges-detail', 'challenges-detail',
+             lambda f, i: (path('challenges-detail', pk=f.challenge.id), None)),
+    Scenario('challenges_summary-list', 'challenges_summary-list',
+             lambda f, i: (path('challenges_summary-list'), {'athletes_size': 10})),
+
+    Scenario('position-list', 'position-list', lambda f, i: (path('position-list'), {'run': f.run.id, 'size': 100})),
+    Scenario('position-list:simplify', 'position-list',
+             lambda f, i: (path('position-list'), {'run': f.run.id, 'max_points': 20})),
+    Scenario('position-detail', 'position-detail', lambda f, i: (path('position-detail', pk=f.position.id), None)),
+    Scenario('position-create', 'position-list',
+             lambda f, i: (path('position-list'), {'run': f.live_run.id, **f.fix()}), method='post', status=201),
+    Scenario('position-batch', 'position-batch',
+             lambda f, i: (path('position-batch'), {'run': f.live_run.id, 'positions': [f.fix() for _ in range(10)]}),
+             method='post', status=201),
+
+    Scenario('collectibleitem-list', 'collectibleitem-list', lambda f, i: (path('collectibleitem-list'), None)),
+    Scenario('collectibleitem-detail', 'collectibleitem-detail',
+             lambda f, i: (path('collectibleitem-detail', pk=f.item.id), None)),
+    Scenario('collectibleitem-nearby', 'collectibleitem-nearby',
+             lambda f, i: (path('collectibleitem-nearby'),
+                           {'latitude': f.item.latitude, 'longitude': f.item.longitude, 'radius': 5000})),
+    Scenario('collectibleitem-viewport', 'collectibleitem-viewport',
+             lambda f, i: (path('collectibleitem-viewport'),
+                           {'min_lat': f.item.latitude - 1, 'max_lat': f.item.latitude + 1,
+                            'min_lon': f.item.longitude - 1, 'max_lon': f.item.longitude + 1, 'limit': 500})),
+    Scenario('upload_collectible_file', 'upload_collectible_file',
+             lambda f, i: (path('upload_collectible_file'), {'file': f.upload_file()}),
+             method='post', content_type=None),
+    Scenario('upload_collectible_job', 'upload_collectible_job',
+             lambda f, i: (path('upload_collectible_job', job_id=f.job.id), None)),
+
+    Scenario('subscribe_to_coach', 'subscribe_to_coach',
+             lambda f, i: (path('subscribe_to_coach', coach_id=f.coach.id), {'athlete': f.new_athlete().id}),
+             method='post'),
+    Scenario('rate_coach', 'rate_coach',
+             lambda f, i: (path('rate_coach', coach_id=f.coach.id), {'athlete': f.athlete.id, 'rating': i % 5 + 1}),
+             method='post'),
+    Scenario('analytics_for_coach', 'analytics_for_coach',
+             lambda f, i: (path('analytics_for_coach', coach_id=f.coach.id), None)),
+    Scenario('leaderboard', 'leaderboard', lambda f, i: (path('leaderboard', board='distance'), {'limit': 50})),
+    Scenario('leaderboard_rank', 'leaderboard_rank',
+             lambda f, i: (path('leaderboard_rank', board='distance', athlete_id=f.athlete.id), None)),
+
+    Scenario('async_positions', 'async_positions',
+             lambda f, i: (path('async_positions'), {'run': f.live_run.id, **f.fix()}), method='post', status=201),
+    Scenario('async_positions_batch', 'async_positions_batch',
+             lambda f, i: (path('async_positions_batch'),
+                           {'run': f.live_run.id, 'positions': [f.fix() for _ in range(10)]}),
+             method='post', status=201),
+    Scenario('async_start_run', 'async_start_run',
+             lambda f, i: (path('async_start_run', run_id=f.new_run(Run.Status.INIT).id), None), method='post'),
+    Scenario('async_stop_run', 'async_stop_run',
+             lambda f, i: (path('async_stop_run', run_id=f.stopping_run().id), None), method='post'),
+    Scenario('live_run', 'live_run', lambda f, i: (path('live_run', run_id=f.run.id), None)),
+]
+
+
+def route_names(patterns=None):
+    # Имена маршрутов без пространства имён: admin и debug toolbar в бенчмарк не входят
+    names = set()
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace is None:
+                names |= route_names(pattern.url_patterns)
+        elif pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+def uncovered_routes(scenarios=SCENARIOS):
+    return sorted(route_names() - {scenario.route for scenario in scenarios} - set(SKIPPED_ROUTES))
+
+
+def budget_for(name, budgets=BUDGETS):
+    return {**DEFAULT_BUDGET, **budgets.get(name, {})}
+
+
+def send(client, scenario, url, data):
+    method = getattr(client, scenario.method)
+    if scenario.method == 'get':
+        return method(url, data or {})
+    if scenario.content_type is None:
+        return method(url, data or {})
+    return method(url, data or {}, content_type=scenario.content_type)
+
+
+def measure(client, scenario, fixtures, repeat, warmup):
+    latencies, queries, statuses = [], [], []
+    for iteration in range(warmup + repeat):
+        url, data = scenario.prepare(fixtures, iteration)
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = send(client, scenario, url, data)
+            if response.streaming:
+                with warnings.catch_warnings():
+                    # Django предупреждает, что async-поток читается синхронным клиентом
+                    warnings.simplefilter('ignore')
+                    b''.join(response)
+            elapsed = time.perf_counter() - started
+        if iteration < warmup:
+            continue
+        latencies.append(elapsed * 1000)
+        statuses.append(response.status_code)
+        queries.append(sum(1 for query in captured if not query['sql'].startswith(SQL_SERVICE_PREFIXES)))
+
+    points = quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'endpoint': scenario.name,
+        'route': scenario.route,
+        'method': scenario.method.upper(),
+        'requests': len(latencies),
+        'p50_ms': round(points[49], 3),
+        'p95_ms': round(points[94], 3),
+        'p99_ms': round(points[98], 3),
+        'max_ms': round(max(latencies), 3),
+        'mean_ms': round(mean(latencies), 3),
+        'queries': max(queries),
+        'unexpected_statuses': sorted({code for code in statuses if code != scenario.status}),
+    }
+
+
+def check_budgets(results, budgets=BUDGETS):
+    violations = []
+
+    def violation(endpoint, size, metric, value, limit):
+        violations.append({'endpoint': endpoint, 'size': size, 'metric': metric, 'value': value, 'limit': limit})
+
+    by_endpoint = {}
+    for result in results:
+        budget = budget_for(result['endpoint'], budgets)
+        by_endpoint.setdefault(result['endpoint'], []).append(result)
+        if result['unexpected_statuses']:
+            violation(result['endpoint'], result['size'], 'status', result['unexpected_statuses'], [])
+        if budget['p95_ms'] is not None and result['p95_ms'] > budget['p95_ms']:
+            violation(result['endpoint'], result['size'], 'p95_ms', result['p95_ms'], budget['p95_ms'])
+        if budget['queries'] is not None and result['queries'] > budget['queries']:
+            violation(result['endpoint'], result['size'], 'queries', result['queries'], budget['queries'])
+
+    # Кривая масштабирования: самый большой набор против самого маленького
+    for endpoint, rows in by_endpoint.items():
+        if len(rows) < 2:
+            continue
+        budget = budget_for(endpoint, budgets)
+        first, last = min(rows, key=lambda row: row['size']), max(rows, key=lambda row: row['size'])
+        if last['queries'] - first['queries'] > budget['query_growth']:
+            violation(endpoint, last['size'], 'query_growth', last['queries'] - first['queries'],
+                      budget['query_growth'])
+
+        growth = budget['latency_growth']
+        if budget['complexity'] == 'linear':
+            growth *= last['size'] / first['size']
+        limit = round(first['p50_ms'] * growth + NOISE_MS, 3)
+        if last['p50_ms'] > limit:
+            violation(endpoint, last['size'], 'latency_growth', last['p50_ms'], limit)
+    return violations
+
+
+def run_benchmarks(sizes=SIZES, repeat=20, warmup=2, seed=0, budgets=BUDGETS, only=None, log=None):
+    log = log or (lambda message: None)
+    scenarios = [scenario for scenario in SCENARIOS if not only or scenario.name in only]
+    client = Client(REMOTE_ADDR=CLIENT_ADDRESS)
+    results, datasets = [], {}
+
+    for size in sizes:
+        with transaction.atomic():
+            generator = Generator(seed=seed, log=None, **{
+                name: count * size if name in ('athletes', 'coaches', 'items') else count
+                for name, count in BASE_DATASET.items()
+            })
+            datasets[size] = generator.generate()
+            fixtures = Fixtures(seed)
+            for scenario in scenarios:
+                result = {'size': size, **measure(client, scenario, fixtures, repeat, warmup)}
+                results.append(result)
+                log(result)
+            transaction.set_rollback(True)
+        cache.clear()
+
+    uncovered = uncovered_routes()
+    violations = check_budgets(results, budgets)
+    violations += [{'endpoint': route, 'size': None, 'metric': 'coverage', 'value': None, 'limit': None}
+                   for route in uncovered if not only]
+    return {
+        'seed': seed,
+        'sizes': list(sizes),
+        'repeat': repeat,
+        'database': connection.vendor,
+        'datasets': datasets,
+        'skipped_routes': SKIPPED_ROUTES,
+        'results': results,
+        'violations': violations,
+    }
@@ -0,0 +1,84 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+
+# Пространства кэша ответов. Версия пространства — время последнего изменения его данных в наносекундах:
+# она входит в ключи ответов и служит их Last-Modified, так что сброс — это просто запись новой версии
+USERS = 'users'
+CHALLENGES = 'challenges'
+COLLECTIBLE_ITEMS = 'collectible_items'
+ANALYTICS = 'analytics'
+
+
+def version_key(namespace):
+    return f'response_cache:{namespace}:version'
+
+
+def namespace_versions(namespaces):
+    keys = [version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # add не перезапишет версию, которую успел записать параллельный запрос
+        now = time.time_ns()
+        for key in missing:
+            cache.add(key, now, timeout=None)
+        versions.update(cache.get_many(missing))
+    return [versions[key] for key in keys]
+
+
+def invalidate(*namespaces):
+    # Сброс после коммита, иначе параллельный запрос успеет закэшировать ещё старые данные
+    def bump():
+        now = time.time_ns()
+        cache.set_many({version_key(namespace): now for namespace in namespaces}, timeout=None)
+    transaction.on_commit(bump)
+
+
+def response_key(endpoint, versions, request):
+    source = f'{request.get_full_path()}|{request.accepted_media_type}'
+    digest = hashlib.md5(source.encode()).hexdigest()
+    return ':'.join(['response_cache', endpoint] + [str(version) for version in versions] + [digest])
+
+
+def cached_response(endpoint, namespaces=()):
+    # Кэширует данные успешного GET-ответа на RESPONSE_CACHE_TIMEOUTS[endpoint] секунд,
+    # добавляет ETag и Last-Modified и отвечает 304 на условные запросы
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            request = next(arg for arg in args if isinstance(arg, Request))
+            timeout = settings.RESPONSE_CACHE_TIMEOUTS.get(endpoint)
+            if request.method not in ('GET', 'HEAD') or not timeout:
+                return handler(*args, **kwargs)
+
+            versions = namespace_versions(namespaces)
+            key = response_key(endpoint, versions, request)
+            entry = cache.get(key)
+            if entry is None:
+                response = handler(*args, **kwargs)
+                if not isinstance(response, Response) or response.status_code != status.HTTP_200_OK:
+                    return response
+                content = request.accepted_media_type.encode() + JSONRenderer().render(response.data)
+                entry = (response.data, f'"{hashlib.md5(content).hexdigest()}"')
+                cache.set(key, entry, timeout)
+
+            data, etag = entry
+            response = Response(data, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+            last_modified = max(versions) // 1_000_000_000 if versions else None
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            return get_conditional_response(request, etag=etag, last_modified=last_modified, response=response)
+        return wrapper
+    return decorator
@@ -0,0 +1,57 @@
+from django.db.models import Count, Sum
+
+from .models import Run, Challenge
+from .caching import CHALLENGES, invalidate
+
+
+class ChallengeRule:
+    # Пороговые условия челленджа; None означает, что условие не проверяется.
+    # finished_runs и total_distance считаются по всем завершённым забегам атлета,
+    # run_distance и max_run_time — по только что завершённому забегу
+    def __init__(self, full_name, finished_runs=None, total_distance=None, run_distance=None, max_run_time=None):
+        self.full_name = full_name
+        self.finished_runs = finished_runs
+        self.total_distance = total_distance
+        self.run_distance = run_distance
+        self.max_run_time = max_run_time
+
+    def matches(self, stats, run):
+        if self.finished_runs is not None and stats['finished_runs'] < self.finished_runs:
+            return False
+        if self.total_distance is not None and (stats['total_distance'] or 0) < self.total_distance:
+            return False
+        if self.run_distance is not None and (run.distance or 0) < self.run_distance:
+            return False
+        if self.max_run_time is not None and (run.run_time_seconds is None or run.run_time_seconds > self.max_run_time):
+            return False
+        return True
+
+
+CHALLENGE_RULES = [
+    ChallengeRule('Сделай 10 Забегов!', finished_runs=10),
+    ChallengeRule('Пробеги 50 километров!', total_distance=50),
+    ChallengeRule('2 километра за 10 минут!', run_distance=2, max_run_time=600),
+]
+
+
+def athlete_run_stats(athlete):
+    return athlete.runs.filter(status=Run.Status.FINISHED).aggregate(
+        finished_runs=Count('id'),
+        total_distance=Sum('distance'),
+    )
+
+
+def award_challenges(run, rules=CHALLENGE_RULES):
+    # Накопительные условия выполняются на каждой остановке после порога, поэтому уже полученные
+    # челленджи отсекаются до вставки, а кэш сбрасывается, только если появилось что-то новое
+    stats = athlete_run_stats(run.athlete)
+    names = [rule.full_name for rule in rules if rule.matches(stats, run)]
+    if names:
+        owned = Challenge.objects.filter(athlete=run.athlete, full_name__in=names).values_list('full_name', flat=True)
+        owned = set(owned)
+        names = [name for name in names if name not in owned]
+    awards = [Challenge(full_name=name, athlete=run.athlete) for name in names]
+    if awards:
+        Challenge.objects.bulk_create(awards, ignore_conflicts=True)
+        invalidate(CHALLENGES)
+    return awards
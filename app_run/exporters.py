@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+import zipfile
+from xml.sax.saxutils import escape
+
+from .models import PackedTrack
+from .packing import FIELDS, unpack_rows
+from .serializers import POSITION_DATETIME_FORMAT
+
+
+EXPORT_CHUNK_SIZE = 2000
+# Время точек в файлах экспорта: формат API с явным UTC
+EXPORT_DATETIME_FORMAT = POSITION_DATETIME_FORMAT + 'Z'
+
+
+def run_rows(run):
+    # Точки забега кортежами FIELDS: из PackedTrack или курсором по Position
+    track = PackedTrack.objects.filter(run=run).first()
+    if track:
+        return iter(unpack_rows(track.data))
+    return run.position.order_by('id').values_list(*FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def chunked(lines, chunk_size=EXPORT_CHUNK_SIZE):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def gpx_lines(run, rows):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<gpx version="1.1" creator="project_run" xmlns="http://www.topografix.com/GPX/1/1">\n'
+    yield f'<trk><name>{escape(f"Забег {run.id}")}</name><trkseg>\n'
+    for id, latitude, longitude, date_time, speed, distance in rows:
+        yield (f'<trkpt lat="{latitude:f}" lon="{longitude:f}">'
+               f'<time>{date_time.strftime(EXPORT_DATETIME_FORMAT)}</time></trkpt>\n')
+    yield '</trkseg></trk></gpx>\n'
+
+
+def csv_lines(run, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow(values)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    yield line(FIELDS)
+    for id, latitude, longitude, date_time, speed, distance in rows:
+        yield line([id, f'{latitude:f}', f'{longitude:f}', date_time.strftime(EXPORT_DATETIME_FORMAT), speed, distance])
+
+
+def geojson_lines(run, rows):
+    yield f'{{"type": "FeatureCollection", "properties": {{"run": {run.id}}}, "features": ['
+    separator = '\n'
+    for id, latitude, longitude, date_time, speed, distance in rows:
+        feature = {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [float(longitude), float(latitude)]},
+            'properties': {'id': id, 'date_time': date_time.strftime(EXPORT_DATETIME_FORMAT),
+                           'speed': speed, 'distance': distance},
+        }
+        yield separator + json.dumps(feature)
+        separator = ',\n'
+    yield '\n]}\n'
+
+
+# формат -> (функция строк, расширение файла, content type)
+EXPORT_FORMATS = {
+    'gpx': (gpx_lines, 'gpx', 'application/gpx+xml'),
+    'csv': (csv_lines, 'csv', 'text/csv'),
+    'geojson': (geojson_lines, 'geojson', 'application/geo+json'),
+}
+
+
+def export_run(run, export_format):
+    lines, _, _ = EXPORT_FORMATS[export_format]
+    return chunked(lines(run, run_rows(run)))
+
+
+class StreamBuffer:
+    # Файлоподобный приёмник для zipfile: копит записанное, пока генератор не заберёт
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_runs_zip(runs, export_format):
+    _, extension, _ = EXPORT_FORMATS[export_format]
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for run in runs:
+            with archive.open(f'run_{run.id}.{extension}', 'w', force_zip64=True) as entry:
+                for chunk in export_run(run, export_format):
+                    entry.write(chunk.encode())
+                    yield buffer.pop()
+            yield buffer.pop()
+    yield buffer.pop()
@@ -0,0 +1,114 @@
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .serializers import POSITION_DATETIME_FORMAT
+
+
+# Быстрые сериализаторы для list-эндпоинтов: строят тот же JSON, что и ModelSerializer из serializers.py,
+# но из словарей .values() и заранее собранных функций преобразования, без создания моделей и полей DRF
+
+
+def decimal_converter(decimal_places):
+    quant = Decimal('.1') ** decimal_places
+    return lambda value: '{:f}'.format(value.quantize(quant))
+
+
+def iso_datetime(value):
+    # Как DateTimeField с форматом ISO 8601 по умолчанию
+    value = value.astimezone(timezone.get_current_timezone()).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def datetime_converter(output_format):
+    return lambda value: value.astimezone(timezone.get_current_timezone()).strftime(output_format)
+
+
+class FastListSerializer:
+    # values — поля для queryset.values(), output — пары (имя в ответе, имя в values, функция или None)
+    values = ()
+    output = ()
+
+    def rows(self, queryset):
+        return queryset.values(*self.values)
+
+    def to_representation(self, row):
+        return {
+            name: row[source] if convert is None or row[source] is None else convert(row[source])
+            for name, source, convert in self.output
+        }
+
+    def serialize(self, rows):
+        to_representation = self.to_representation
+        return [to_representation(row) for row in rows]
+
+
+
+class FastRunSerializer(FastListSerializer):
+    values = ('id', 'created_at', 'comment', 'speed', 'distance', 'run_time_seconds', 'status', 'athlete_id',
+              'athlete__username', 'athlete__last_name', 'athlete__first_name')
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'athlete_data': {
+                'id': row['athlete_id'],
+                'username': row['athlete__username'],
+                'last_name': row['athlete__last_name'],
+                'first_name': row['athlete__first_name'],
+            },
+            'created_at': iso_datetime(row['created_at']),
+            'comment': row['comment'],
+            'speed': row['speed'],
+            'distance': row['distance'],
+            'run_time_seconds': row['run_time_seconds'],
+            'status': row['status'],
+            'athlete': row['athlete_id'],
+        }
+
+
+
+class FastPositionSerializer(FastListSerializer):
+    values = ('id', 'latitude', 'longitude', 'date_time', 'speed', 'distance')
+    output = (
+        ('id', 'id', None),
+        ('latitude', 'latitude', decimal_converter(4)),
+        ('longitude', 'longitude', decimal_converter(4)),
+        ('date_time', 'date_time', datetime_converter(POSITION_DATETIME_FORMAT)),
+        ('speed', 'speed', None),
+        ('distance', 'distance', None),
+    )
+
+
+
+class FastUserSerializer(FastListSerializer):
+    values = ('id', 'date_joined', 'username', 'last_name', 'first_name', 'is_staff', 'runs_finished', 'rating')
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'date_joined': iso_datetime(row['date_joined']),
+            'username': row['username'],
+            'last_name': row['last_name'],
+            'first_name': row['first_name'],
+            'type': 'coach' if row['is_staff'] else 'athlete',
+            'runs_finished': row['runs_finished'],
+            'rating': row['rating'],
+        }
+
+
+
+class FastCollectibleItemSerializer(FastListSerializer):
+    values = ('id', 'name', 'uid', 'latitude', 'longitude', 'picture', 'value')
+    output = (
+        ('id', 'id', None),
+        ('name', 'name', None),
+        ('uid', 'uid', None),
+        ('latitude', 'latitude', decimal_converter(4)),
+        ('longitude', 'longitude', decimal_converter(4)),
+        ('picture', 'picture', None),
+        ('value', 'value', None),
+    )
+
@@ -0,0 +1,119 @@
+from bisect import bisect_left, bisect_right
+from math import cos, radians, degrees, hypot
+
+import numpy as np
+from haversine import haversine
+from haversine.haversine import Unit, get_avg_earth_radius
+
+
+EARTH_RADIUS_M = get_avg_earth_radius(Unit.METERS)
+PICKUP_RADIUS_M = 100
+NEARBY_MAX_RADIUS_M = 50_000
+NEARBY_LIMIT = 50
+NEARBY_MAX_LIMIT = 500
+VIEWPORT_LIMIT = 1000
+VIEWPORT_MAX_LIMIT = 5000
+# Запас на то, что кратчайший путь по сфере чуть короче пути по плоской карте (на NEARBY_MAX_RADIUS_M — доли процента)
+PLANAR_MARGIN = 1e-3
+
+
+def bounding_box(latitude, longitude, radius):
+    # Прямоугольник (min_lat, max_lat, min_lon, max_lon), гарантированно содержащий круг radius метров
+    latitude, longitude = float(latitude), float(longitude)
+    delta_lat = degrees(radius / EARTH_RADIUS_M)
+    min_lat, max_lat = max(latitude - delta_lat, -90.0), min(latitude + delta_lat, 90.0)
+
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return min_lat, max_lat, -180.0, 180.0
+
+    delta_lon = degrees(radius / (EARTH_RADIUS_M * cos(radians(latitude))))
+    if delta_lon >= 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+
+    min_lon, max_lon = longitude - delta_lon, longitude + delta_lon
+    if min_lon < -180.0:
+        min_lon += 360.0
+    if max_lon > 180.0:
+        max_lon -= 360.0
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def track_bounding_box(cords, radius):
+    # Общий прямоугольник для всех точек трека; при переходе через 180-й меридиан берём всю долготу
+    boxes = [bounding_box(latitude, longitude, radius) for latitude, longitude in cords]
+    min_lat = min(box[0] for box in boxes)
+    max_lat = max(box[1] for box in boxes)
+    if any(box[2] > box[3] for box in boxes):
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, min(box[2] for box in boxes), max(box[3] for box in boxes)
+
+
+def items_near_track(items, cords, radius):
+    # Точки сортируются по широте, чтобы для каждого предмета проверять только полосу шириной 2 * radius
+    points = sorted((float(latitude), float(longitude)) for latitude, longitude in cords)
+    latitudes = [point[0] for point in points]
+    delta_lat = degrees(radius / EARTH_RADIUS_M)
+
+    found = []
+    for item in items:
+        item_position = (float(item.latitude), float(item.longitude))
+        start = bisect_left(latitudes, item_position[0] - delta_lat)
+        end = bisect_right(latitudes, item_position[0] + delta_lat)
+        if any(haversine(item_position, point, unit=Unit.METERS) < radius for point in points[start:end]):
+            found.append(item)
+    return found
+
+
+def distances_from(latitude, longitude, latitudes, longitudes):
+    # Расстояния в метрах от точки до каждой из точек массивов, по той же формуле, что и haversine
+    lat, lng = np.radians(float(latitude)), np.radians(float(longitude))
+    lats, lngs = np.radians(latitudes), np.radians(longitudes)
+    d = np.sin((lats - lat) * 0.5) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) * 0.5) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(d))
+
+
+def nearest(rows, latitude, longitude, radius, limit):
+    # rows — (id, широта, долгота); возвращает до limit пар (id, расстояние) в радиусе, ближайшие первыми
+    if not rows:
+        return []
+    distances = distances_from(
+        latitude, longitude, np.array([float(row[1]) for row in rows]), np.array([float(row[2]) for row in rows])
+    )
+    inside = np.flatnonzero(distances <= radius)
+    inside = inside[np.argsort(distances[inside], kind='stable')][:limit]
+    return [(rows[i][0], float(distances[i])) for i in inside]
+
+
+
+def planar_distance(latitude, longitude, lat, lon):
+    # Расстояние в метрах на равнопромежуточной проекции с масштабом долготы cos(latitude) — то же,
+    # что CollectibleItemQuerySet.by_planar_distance считает в базе
+    delta_lon = (float(lon) - float(longitude) + 180.0) % 360.0 - 180.0
+    delta_lat = float(lat) - float(latitude)
+    return EARTH_RADIUS_M * radians(hypot(delta_lat, delta_lon * cos(radians(float(latitude)))))
+
+
+def planar_factor(latitude, radius):
+    # Множитель k, при котором для точек прямоугольника bounding_box расстояние по haversine не меньше
+    # k * planar_distance: к полюсу градус долготы короче, чем на широте latitude
+    min_lat, max_lat, _, _ = bounding_box(latitude, longitude=0, radius=radius)
+    scale = cos(radians(float(latitude)))
+    if scale <= 0:
+        return 0.0
+    return min(1.0, min(cos(radians(min_lat)), cos(radians(max_lat))) / scale) * (1 - PLANAR_MARGIN)
+
+
+def nearest_ordered(fetch, latitude, longitude, radius, limit):
+    # fetch(size) — первые size строк (id, широта, долгота) по возрастанию planar_distance. Строк берётся
+    # вдвое больше limit и добирается, пока ещё не прочитанные заведомо не ближе limit-й найденной
+    factor = planar_factor(latitude, radius)
+    size = limit * 2
+    while True:
+        rows = fetch(size)
+        found = nearest(rows, latitude, longitude, radius, limit)
+        if len(rows) < size:
+            return found
+        edge = factor * planar_distance(latitude, longitude, rows[-1][1], rows[-1][2])
+        if (found[-1][1] if len(found) == limit else radius) < edge:
+            return found
+        size *= 4
@@ -0,0 +1,64 @@
+import csv
+import io
+
+from openpyxl import load_workbook
+
+from .models import CollectibleItem
+from .caching import COLLECTIBLE_ITEMS, USERS, invalidate
+from .serializers import CollectibleItemImportSerializer
+
+
+COLLECTIBLE_COLUMNS = ['name', 'uid', 'value', 'latitude', 'longitude', 'picture']
+IMPORT_CHUNK_SIZE = 1000
+
+
+def read_rows(file, name):
+    # Строки данных без заголовка; xlsx читается в read-only режиме, csv — построчно
+    if name.lower().endswith('.csv'):
+        reader = csv.reader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+        next(reader, None)
+        yield from reader
+        return
+
+    workbook = load_workbook(file, read_only=True)
+    try:
+        yield from workbook.active.iter_rows(min_row=2, values_only=True)
+    finally:
+        workbook.close()
+
+
+def save_chunk(items):
+    CollectibleItem.objects.bulk_create(
+        items,
+        update_conflicts=True,
+        unique_fields=['uid'],
+        update_fields=['name', 'value', 'latitude', 'longitude', 'picture'],
+    )
+    invalidate(COLLECTIBLE_ITEMS, USERS)
+    return len(items)
+
+
+def import_collectible_items(file, name, chunk_size=IMPORT_CHUNK_SIZE, on_progress=None):
+    # on_progress(processed, imported, rejected) вызывается после записи каждой пачки
+    invalid, imported, processed, chunk = [], 0, 0, {}
+
+    for processed, row in enumerate(read_rows(file, name), start=1):
+        values = list(row) + [None] * (len(COLLECTIBLE_COLUMNS) - len(row))
+        serializer = CollectibleItemImportSerializer(data=dict(zip(COLLECTIBLE_COLUMNS, values)))
+        if serializer.is_valid():
+            # Повтор uid внутри пачки заменяет предыдущую строку, как и upsert в базе
+            chunk[serializer.validated_data['uid']] = CollectibleItem(**serializer.validated_data)
+        else:
+            invalid.append(list(row))
+
+        if processed % chunk_size == 0:
+            imported += save_chunk(list(chunk.values()))
+            chunk = {}
+            if on_progress:
+                on_progress(processed, imported, len(invalid))
+
+    if chunk:
+        imported += save_chunk(list(chunk.values()))
+    if on_progress:
+        on_progress(processed, imported, len(invalid))
+    return imported, invalid
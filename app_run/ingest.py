@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .models import Run, CollectibleItem
+from .geo import PICKUP_RADIUS_M, items_near_track
+from .track import track_arrays, position_steps
+from .challenges import award_challenges
+from .analytics import refresh_athlete_stats
+from .leaderboards import record_finished_run
+from .packing import pack_run
+
+
+# Общая часть приёма точек и завершения забега для синхронных views и асинхронных async_views.
+# Здесь только вычисления и построение запросов, сами запросы выполняет вызывающий код
+
+FINISH_FIELDS = ['status', 'distance', 'speed', 'run_time_seconds']
+
+
+def measure_positions(run, last_pos, cords, times):
+    # speed и distance для новых точек, продолжая трек от last_pos, и новая дистанция забега без округления.
+    # Отсчёт идёт от run.positions_distance, а не от округлённой distance последней точки
+    if not last_pos:
+        speeds, distances, exact = position_steps(*track_arrays(cords, times))
+        return speeds.tolist(), distances.tolist(), float(exact[-1])
+
+    speeds, distances, exact = position_steps(
+        *track_arrays([(last_pos.latitude, last_pos.longitude)] + cords, [last_pos.date_time] + times),
+        start_distance=run.positions_distance
+    )
+    return speeds[1:].tolist(), distances[1:].tolist(), float(exact[-1])
+
+
+def check_fixes(fixes, last_time):
+    # Отбирает точки, время которых идёт строго после предыдущей принятой; fixes — пары (index, serializer).
+    # Возвращает принятые validated_data и результат по каждой точке
+    accepted, results = [], []
+    for index, serializer in fixes:
+        if not serializer.is_valid():
+            results.append({'index': index, 'accepted': False, 'errors': serializer.errors})
+            continue
+
+        date_time = serializer.validated_data['date_time']
+        if last_time and date_time <= last_time:
+            results.append({'index': index, 'accepted': False,
+                            'errors': {'date_time': ['Время точки должно быть позже предыдущей']}})
+            continue
+
+        accepted.append(serializer.validated_data)
+        results.append({'index': index, 'accepted': True})
+        last_time = date_time
+    return accepted, results
+
+
+def run_aggregates(positions, distance):
+    # Поля для одного UPDATE агрегатов забега после добавления positions; distance — из measure_positions
+    first_time = min(position.date_time for position in positions)
+    last_time = max(position.date_time for position in positions)
+    return {
+        'positions_count': F('positions_count') + len(positions),
+        'speed_sum': F('speed_sum') + sum(position.speed for position in positions),
+        'positions_distance': distance,
+        'first_position_at': Least(Coalesce('first_position_at', first_time), first_time),
+        'last_position_at': Greatest(Coalesce('last_position_at', last_time), last_time),
+    }
+
+
+def recounted_aggregates(rows):
+    # Агрегаты забега заново по всем его точкам — после правки или удаления точки, где приращение не посчитать.
+    # rows — кортежи (latitude, longitude, date_time, speed) в порядке id
+    if not rows:
+        return {'positions_count': 0, 'speed_sum': 0, 'positions_distance': 0,
+                'first_position_at': None, 'last_position_at': None}
+    times = [date_time for _, _, date_time, _ in rows]
+    _, _, exact = position_steps(*track_arrays([(latitude, longitude) for latitude, longitude, _, _ in rows], times))
+    return {
+        'positions_count': len(rows),
+        'speed_sum': sum(speed or 0 for *_, speed in rows),
+        'positions_distance': float(exact[-1]),
+        'first_position_at': min(times),
+        'last_position_at': max(times),
+    }
+
+
+def items_around(cords):
+    return CollectibleItem.objects.around_track(cords, PICKUP_RADIUS_M)
+
+
+def collected_items(items, cords):
+    return items_near_track(items, cords, PICKUP_RADIUS_M)
+
+
+def finish_run(run):
+    # Итоги забега по накопленным агрегатам; сохранять нужно поля FINISH_FIELDS
+    run.status = Run.Status.FINISHED
+    run.distance = run.positions_distance
+    run.speed = round(run.speed_sum / run.positions_count if run.positions_count else 0, 2)
+    if run.first_position_at and run.last_position_at:
+        run.run_time_seconds = int((run.last_position_at - run.first_position_at).total_seconds())
+
+
+def stop_run(run):
+    # Статус забега, счётчики атлета и таблицы лидеров меняются в одной транзакции. Переход in_progress -> finished
+    # делается условным UPDATE, поэтому при двух одновременных stop забег засчитывается один раз.
+    # Возвращает False, если забег уже не в процессе
+    finish_run(run)
+    with transaction.atomic():
+        stopped = Run.objects.filter(id=run.id, status=Run.Status.IN_PROGRESS).update(
+            **{name: getattr(run, name) for name in FINISH_FIELDS}
+        )
+        if stopped:
+            refresh_athlete_stats(run)
+            record_finished_run(run)
+    if not stopped:
+        return False
+
+    award_challenges(run)
+    if settings.PACK_FINISHED_TRACKS:
+        pack_run(run)
+    return True
@@ -0,0 +1,55 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ImportJob
+from .importers import import_collectible_items
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.IMPORT_WORKERS, thread_name_prefix='import')
+    return _executor
+
+
+def start_import_job(file):
+    # Файл сохраняется во временный, чтобы не держать загрузку в памяти до начала обработки
+    with NamedTemporaryFile(delete=False, suffix=Path(file.name).suffix) as tmp:
+        for chunk in file.chunks():
+            tmp.write(chunk)
+
+    job = ImportJob.objects.create(file_name=file.name)
+    transaction.on_commit(lambda: get_executor().submit(run_import_job, job.id, tmp.name))
+    return job
+
+
+def run_import_job(job_id, path):
+    jobs = ImportJob.objects.filter(id=job_id)
+    try:
+        jobs.update(status=ImportJob.Status.RUNNING)
+
+        def progress(processed, imported, rejected):
+            jobs.update(rows_processed=processed, rows_imported=imported, rows_rejected=rejected)
+
+        with open(path, 'rb') as file:
+            imported, invalid = import_collectible_items(file, jobs.get().file_name, on_progress=progress)
+
+        job = jobs.get()
+        job.status = ImportJob.Status.DONE
+        job.invalid_rows = invalid
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'invalid_rows', 'finished_at'])
+    except Exception as exc:
+        jobs.update(status=ImportJob.Status.FAILED, error=str(exc), finished_at=timezone.now())
+    finally:
+        os.remove(path)
+        connection.close()
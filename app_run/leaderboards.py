@@ -0,0 +1,307 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q, Sum, Count
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import Run, User, Subscribe, CollectibleItem, LeaderboardScore, LeaderboardCount
+
+
+# Таблицы лидеров: дистанция, число завершённых забегов, средняя скорость и ценность собранных предметов,
+# за всё время, за день и за неделю. Очки копятся в LeaderboardScore при завершении забега и сборе предметов,
+# рейтинг — число атлетов с большим score плюс один. Чтобы не считать их перебором, рядом ведётся дерево
+# счётчиков LeaderboardCount: ключ строки — score в сотых, RANK_DIGITS шестнадцатеричных цифр, и на каждом уровне
+# узел хранит число строк с таким началом ключа. Атлеты выше — сумма узлов-соседей с большей цифрой на пути
+# к ключу атлета: не больше 15 на уровень, то есть O(log n) и в общем рейтинге, и в рейтинге тренера (scope).
+# Места считаются по score, округлённому до сотых, как его показывает API: равные на экране делят место
+
+Board = LeaderboardScore.Board
+Window = LeaderboardScore.Window
+LEADERBOARD_LIMIT = 10
+LEADERBOARD_MAX_LIMIT = 100
+RANK_DIGITS = 10
+RANK_KEYS = 16 ** RANK_DIGITS
+GLOBAL_SCOPE = 0
+NODE_FIELDS = ['board', 'window', 'period', 'scope', 'level', 'prefix']
+# Узлов в одном UPDATE счётчиков
+COUNT_BATCH_SIZE = 100
+
+
+def window_period(window, day):
+    if window == Window.ALL:
+        return LeaderboardScore.ALL_PERIOD
+    if window == Window.WEEK:
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def run_day(run):
+    # Забег относится ко дню своей последней точки, а без точек — ко дню создания
+    return timezone.localdate(run.last_position_at or run.created_at)
+
+
+def rank_key(score):
+    return min(max(round(score * 100), 0), RANK_KEYS - 1)
+
+
+def key_nodes(key):
+    # (level, prefix) узлов на пути от корня к ключу
+    return [(level, key >> 4 * (RANK_DIGITS - level)) for level in range(1, RANK_DIGITS + 1)]
+
+
+def count_deltas(changes, scopes):
+    # changes — {(board, window, period): (прежний score, новый score)}, None — строки нет
+    deltas = defaultdict(int)
+    for (board, window, period), (old, new) in changes.items():
+        old_key = None if old is None else rank_key(old)
+        new_key = None if new is None else rank_key(new)
+        if old_key == new_key:
+            continue
+        for key, sign in ((old_key, -1), (new_key, 1)):
+            if key is None:
+                continue
+            for level, prefix in key_nodes(key):
+                for scope in scopes:
+                    deltas[(board, window, period, scope, level, prefix)] += sign
+    return {node: delta for node, delta in deltas.items() if delta}
+
+
+def apply_deltas(deltas):
+    # Недостающие узлы вставляются, затем один UPDATE на каждое значение приращения
+    LeaderboardCount.objects.bulk_create(
+        [LeaderboardCount(**dict(zip(NODE_FIELDS, node))) for node, delta in deltas.items() if delta > 0],
+        ignore_conflicts=True,
+        batch_size=1000,
+    )
+    groups = defaultdict(list)
+    for node, delta in deltas.items():
+        groups[delta].append(node)
+    for delta, nodes in groups.items():
+        for first in range(0, len(nodes), COUNT_BATCH_SIZE):
+            match = Q()
+            for node in nodes[first:first + COUNT_BATCH_SIZE]:
+                match |= Q(**dict(zip(NODE_FIELDS, node)))
+            LeaderboardCount.objects.filter(match).update(count=F('count') + delta)
+
+
+def athlete_scopes(user_id):
+    return [GLOBAL_SCOPE] + list(Subscribe.objects.filter(athlete_id=user_id).values_list('coach_id', flat=True))
+
+
+def entry_scores(entries):
+    return {(board, window, period): score
+            for board, window, period, score in entries.values_list('board', 'window', 'period', 'score')}
+
+
+def move_scores(user_id, old, new, scopes=None):
+    # Переносит строки атлета в деревьях счётчиков со старых score на новые
+    changes = {key: (old.get(key), new.get(key)) for key in old.keys() | new.keys()}
+    if changes:
+        apply_deltas(count_deltas(changes, athlete_scopes(user_id) if scopes is None else scopes))
+
+
+def lock_athlete(user_id):
+    # Очки одного атлета меняются по очереди: две одновременные первые записи за день иначе обе
+    # посчитали бы строку новой и добавили её в счётчики дважды
+    list(User.objects.select_for_update().filter(id=user_id).values_list('id', flat=True))
+
+
+def score_expression(board, value, count):
+    if board == Board.SPEED:
+        return (F('total') + value) / (F('count') + count)
+    if board == Board.RUNS:
+        return F('count') + count
+    return F('total') + value
+
+
+def day_periods(day):
+    return [(window, window_period(window, day)) for window in Window.values]
+
+
+def periods_filter(periods):
+    in_periods = Q()
+    for window, period in periods:
+        in_periods |= Q(window=window, period=period)
+    return in_periods
+
+
+def add_scores(user_id, day, values):
+    # values — {board: (value, count)}; одна вставка недостающих строк и один UPDATE на таблицу
+    with transaction.atomic():
+        add_rows(user_id, day_periods(day), values)
+
+
+def add_rows(user_id, periods, values):
+    entries = LeaderboardScore.objects.filter(periods_filter(periods), board__in=list(values), user_id=user_id)
+    lock_athlete(user_id)
+    old = entry_scores(entries)
+    LeaderboardScore.objects.bulk_create(
+        [LeaderboardScore(board=board, window=window, period=period, user_id=user_id)
+         for board in values for window, period in periods],
+        ignore_conflicts=True,
+    )
+    update_rows(entries, values)
+    move_scores(user_id, old, entry_scores(entries))
+
+
+def update_rows(entries, values):
+    for board, (value, count) in values.items():
+        entries.filter(board=board).update(
+            total=F('total') + value,
+            count=F('count') + count,
+            score=score_expression(board, value, count),
+        )
+
+
+def record_finished_run(run):
+    add_scores(run.athlete_id, run_day(run), {
+        Board.DISTANCE: (run.distance or 0, 1),
+        Board.RUNS: (0, 1),
+        Board.SPEED: (run.speed or 0, 1),
+    })
+
+
+def remove_finished_run(run):
+    # Обратное record_finished_run для удалённого забега. Строки, где это был единственный забег, удаляются:
+    # у них не остаётся значений, а средняя скорость делилась бы на ноль
+    values = {
+        Board.DISTANCE: (-(run.distance or 0), -1),
+        Board.RUNS: (0, -1),
+        Board.SPEED: (-(run.speed or 0), -1),
+    }
+    entries = LeaderboardScore.objects.filter(
+        periods_filter(day_periods(run_day(run))), board__in=list(values), user_id=run.athlete_id
+    )
+    with transaction.atomic():
+        lock_athlete(run.athlete_id)
+        old = entry_scores(entries)
+        entries.filter(count__lte=1).delete()
+        update_rows(entries, values)
+        move_scores(run.athlete_id, old, entry_scores(entries))
+
+
+def subscription_changed(athlete_id, coach_id, subscribed):
+    # Строки атлета входят в дерево тренера, пока атлет на него подписан
+    with transaction.atomic():
+        lock_athlete(athlete_id)
+        current = entry_scores(LeaderboardScore.objects.filter(user_id=athlete_id))
+        move_scores(athlete_id, {} if subscribed else current, current if subscribed else {}, [coach_id])
+
+
+def remove_athlete_scores(user_id):
+    # Перед удалением пользователя: его строки уходят из общего дерева (из деревьев тренеров — вместе с
+    # подписками), а если он тренер, удаляется и его собственное дерево
+    with transaction.atomic():
+        move_scores(user_id, entry_scores(LeaderboardScore.objects.filter(user_id=user_id)), {}, [GLOBAL_SCOPE])
+        LeaderboardCount.objects.filter(scope=user_id).delete()
+
+
+def record_collected(user_id, item_ids):
+    value = CollectibleItem.objects.filter(id__in=item_ids).aggregate(value=Sum('value'))['value']
+    if value:
+        add_scores(user_id, timezone.localdate(), {Board.COLLECTIBLES: (value, len(item_ids))})
+
+
+def scores(board, window, period, coach_id=None):
+    queryset = LeaderboardScore.objects.filter(board=board, window=window, period=period)
+    if coach_id is not None:
+        queryset = queryset.filter(user__athlete__coach_id=coach_id)
+    return queryset
+
+
+def top(board, window, period, limit, coach_id=None):
+    # Места с учётом равенства очков в сотых: 1, 2, 2, 4
+    rows = (
+        scores(board, window, period, coach_id)
+        .order_by('-score', 'user_id')
+        .values_list('user_id', 'user__username', 'user__first_name', 'user__last_name', 'score')[:limit]
+    )
+    result, rank, previous = [], 0, None
+    for position, (user_id, username, first_name, last_name, score) in enumerate(rows, start=1):
+        if rank_key(score) != previous:
+            rank, previous = position, rank_key(score)
+        result.append({'rank': rank, 'athlete': user_id, 'username': username,
+                       'full_name': f'{first_name} {last_name}', 'score': round(score, 2)})
+    return result
+
+
+def athlete_rank(board, window, period, user_id, coach_id=None):
+    entry = scores(board, window, period, coach_id).filter(user_id=user_id).values_list('score', flat=True).first()
+    if entry is None:
+        return {'athlete': user_id, 'rank': None, 'score': None}
+
+    # На каждом уровне — соседи узла на пути к ключу атлета с большей цифрой: prefix + 1 .. prefix | 15
+    above = Q()
+    for level, prefix in key_nodes(rank_key(entry)):
+        above |= Q(level=level, prefix__gt=prefix, prefix__lte=prefix | 15)
+    higher = LeaderboardCount.objects.filter(
+        above, board=board, window=window, period=period, scope=GLOBAL_SCOPE if coach_id is None else coach_id
+    ).aggregate(higher=Sum('count'))['higher']
+    return {'athlete': user_id, 'rank': (higher or 0) + 1, 'score': round(entry, 2)}
+
+
+def rebuild_leaderboards():
+    # Пересчёт по завершённым забегам. У связи атлета с предметом нет даты, поэтому ценность
+    # предметов восстанавливается только за всё время, а дневные и недельные значения остаются как были
+    runs = (
+        Run.objects.filter(status=Run.Status.FINISHED)
+        .annotate(day=TruncDate(Coalesce('last_position_at', 'created_at')))
+        .values('athlete_id', 'day')
+        .annotate(distance=Sum('distance'), runs=Count('id'), speed=Sum('speed'))
+        .order_by()
+    )
+    totals = {}
+    for row in runs:
+        for window in Window.values:
+            key = (row['athlete_id'], window, window_period(window, row['day']))
+            distance, count, speed = totals.get(key, (0, 0, 0))
+            totals[key] = (distance + (row['distance'] or 0), count + row['runs'], speed + (row['speed'] or 0))
+
+    entries = []
+    for (user_id, window, period), (distance, count, speed) in totals.items():
+        common = {'window': window, 'period': period, 'user_id': user_id, 'count': count}
+        entries += [
+            LeaderboardScore(board=Board.DISTANCE, total=distance, score=distance, **common),
+            LeaderboardScore(board=Board.RUNS, total=0, score=count, **common),
+            LeaderboardScore(board=Board.SPEED, total=speed, score=speed / count, **common),
+        ]
+
+    collected = (
+        CollectibleItem.athletes.through.objects.values('user_id')
+        .annotate(value=Sum('collectibleitem__value'), items=Count('id'))
+        .order_by()
+    )
+    entries += [
+        LeaderboardScore(board=Board.COLLECTIBLES, window=Window.ALL, period=LeaderboardScore.ALL_PERIOD,
+                         user_id=row['user_id'], total=row['value'] or 0, count=row['items'], score=row['value'] or 0)
+        for row in collected
+    ]
+
+    with transaction.atomic():
+        LeaderboardScore.objects.exclude(
+            Q(board=Board.COLLECTIBLES) & ~Q(window=Window.ALL)
+        ).delete()
+        LeaderboardScore.objects.bulk_create(entries, batch_size=1000)
+        rebuild_counts()
+    return len(entries)
+
+
+def rebuild_counts():
+    # Деревья счётчиков заново по всем строкам LeaderboardScore и подпискам на тренеров
+    coaches = defaultdict(list)
+    for athlete_id, coach_id in Subscribe.objects.values_list('athlete_id', 'coach_id'):
+        coaches[athlete_id].append(coach_id)
+    counts = defaultdict(int)
+    rows = LeaderboardScore.objects.values_list('board', 'window', 'period', 'user_id', 'score')
+    for board, window, period, user_id, score in rows.iterator(chunk_size=2000):
+        for level, prefix in key_nodes(rank_key(score)):
+            for scope in [GLOBAL_SCOPE] + coaches[user_id]:
+                counts[(board, window, period, scope, level, prefix)] += 1
+
+    LeaderboardCount.objects.all().delete()
+    LeaderboardCount.objects.bulk_create(
+        [LeaderboardCount(count=count, **dict(zip(NODE_FIELDS, node))) for node, count in counts.items()],
+        batch_size=1000,
+    )
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+from .fast_serializers import FastPositionSerializer
+
+
+# Живая трансляция забегов. Каждое событие (новые точки, смена статуса забега) сериализуется один раз
+# и публикуется в канал атлета, откуда брокер раздаёт его всем подписчикам: и тем, кто смотрит забег,
+# и тренерам атлета. LocalBroker работает внутри процесса, RedisBroker — между процессами через Redis pub/sub
+
+QUEUE_SIZE = 1000
+position_serializer = FastPositionSerializer()
+
+
+def athlete_channel(athlete_id):
+    return f'live:athlete:{athlete_id}'
+
+
+def positions_message(run, positions):
+    return json.dumps({
+        'type': 'positions',
+        'run': run.id,
+        'athlete': run.athlete_id,
+        'positions': [
+            position_serializer.to_representation(
+                {name: getattr(position, name) for name in position_serializer.values}
+            )
+            for position in positions
+        ],
+    })
+
+
+def status_message(run):
+    return json.dumps({'type': 'status', 'run': run.id, 'athlete': run.athlete_id, 'status': run.status})
+
+
+
+class LocalSubscription:
+
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, message):
+        # Отстающий подписчик не должен копить память: поток закрывается, клиент переподключится
+        # с Last-Event-ID и дочитает пропущенное
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout=None):
+        # Сообщение или None, если за timeout секунд ничего не пришло
+        if self.overflowed:
+            return None
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        self.broker.unsubscribe(self)
+
+
+
+class LocalBroker:
+    # Подписчики живут в event loop ASGI-приложения, а публикуют и синхронные views из других потоков,
+    # поэтому доставка идёт через call_soon_threadsafe
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscriptions = list(self.subscribers.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, message)
+            except RuntimeError:
+                # Event loop подписчика уже закрыт, подписка снимется при закрытии потока
+                pass
+
+    async def apublish(self, channel, message):
+        self.publish(channel, message)
+
+    async def subscribe(self, channels):
+        subscription = LocalSubscription(self, channels)
+        with self.lock:
+            for channel in channels:
+                self.subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscribers[channel].discard(subscription)
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+
+
+
+class RedisSubscription:
+    overflowed = False
+
+    def __init__(self, client, pubsub):
+        self.client = client
+        self.pubsub = pubsub
+
+    async def get(self, timeout=None):
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        return message['data'].decode() if message else None
+
+    async def close(self):
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+
+
+class RedisBroker:
+
+    def __init__(self, url):
+        import redis
+        import redis.asyncio
+
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+        self.async_client = None
+        self.async_redis = redis.asyncio
+
+    def publish(self, channel, message):
+        self.client.publish(channel, message)
+
+    async def apublish(self, channel, message):
+        if self.async_client is None:
+            self.async_client = self.async_redis.Redis.from_url(self.url)
+        await self.async_client.publish(channel, message)
+
+    async def subscribe(self, channels):
+        client = self.async_redis.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(*channels)
+        return RedisSubscription(client, pubsub)
+
+
+broker = None
+
+
+def get_broker():
+    global broker
+    if broker is None:
+        broker = RedisBroker(settings.LIVE_BROKER_URL) if settings.LIVE_BROKER_URL else LocalBroker()
+    return broker
+
+
+def publish(run, message):
+    get_broker().publish(athlete_channel(run.athlete_id), message)
+
+
+async def apublish(run, message):
+    await get_broker().apublish(athlete_channel(run.athlete_id), message)
@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_run.benchmarks import BUDGETS, SIZES, SCENARIOS, run_benchmarks
+from app_run.models import User
+from app_run.synthetic import username_prefix
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку и число SQL-запросов каждого эндпоинта на синтетических данных нескольких '
+            'размеров и проверяет бюджеты из app_run/benchmarks.py. Данные создаются и откатываются в транзакции')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='Множители набора данных')
+        parser.add_argument('--repeat', type=int, default=20, help='Замеров на сценарий')
+        parser.add_argument('--warmup', type=int, default=2, help='Запросов прогрева без замера')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', nargs='+', default=None, help='Имена сценариев')
+        parser.add_argument('--budgets', default=None, help='JSON-файл с бюджетами поверх встроенных')
+        parser.add_argument('--output', default=None, help='Куда записать отчёт в JSON')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=username_prefix(options['seed'])).exists():
+            raise CommandError(f'Данные с --seed {options["seed"]} уже есть, смените --seed')
+        names = {scenario.name for scenario in SCENARIOS}
+        unknown = set(options['only'] or []) - names
+        if unknown:
+            raise CommandError(f'Нет сценариев: {", ".join(sorted(unknown))}')
+
+        budgets = {name: dict(budget) for name, budget in BUDGETS.items()}
+        if options['budgets']:
+            with open(options['budgets'], encoding='utf-8') as file:
+                for name, budget in json.load(file).items():
+                    budgets.setdefault(name, {}).update(budget)
+
+        report = run_benchmarks(
+            sizes=options['sizes'], repeat=options['repeat'], warmup=options['warmup'], seed=options['seed'],
+            budgets=budgets, only=options['only'], log=self.log,
+        )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2, default=str)
+
+        violations = report['violations']
+        for item in violations:
+            self.stderr.write(f'{item["endpoint"]} (размер {item["size"]}): {item["metric"]} = {item["value"]}, '
+                              f'предел {item["limit"]}')
+        if violations:
+            raise CommandError(f'Нарушено бюджетов: {len(violations)}')
+        self.stdout.write(self.style.SUCCESS(f'Сценариев: {len(report["results"])}, бюджеты соблюдены'))
+
+    def log(self, result):
+        self.stdout.write(
+            f'{result["endpoint"]:<28} размер {result["size"]:<3} {result["method"]:<5} '
+            f'p50 {result["p50_ms"]:8.2f} мс  p95 {result["p95_ms"]:8.2f} мс  p99 {result["p99_ms"]:8.2f} мс  '
+            f'запросов {result["queries"]}'
+        )
@@ -0,0 +1,183 @@
+import asyncio
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from statistics import quantiles
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+
+from app_run.models import Run, User
+
+
+# Клиент вне INTERNAL_IPS, чтобы debug toolbar не включался ни в одном из режимов
+CLIENT_ADDRESS = '10.0.0.1'
+
+
+class SlowInput(io.BytesIO):
+    # Тело запроса, которое приходит с задержкой, как от клиента на медленной мобильной сети
+    def __init__(self, body, delay):
+        super().__init__(body)
+        self.delay = delay
+
+    def read(self, *args):
+        if self.delay:
+            time.sleep(self.delay)
+            self.delay = 0
+        return super().read(*args)
+
+
+def position_body(run_id, index):
+    moment = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=index * 5)
+    return json.dumps({
+        'run': run_id,
+        'latitude': round(55.7558 + index * 0.0001, 4),
+        'longitude': 37.6173,
+        'date_time': moment.isoformat(),
+    }).encode()
+
+
+def wsgi_request(application, path, body, delay):
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': CLIENT_ADDRESS,
+        'HTTP_HOST': 'testserver',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': SlowInput(body, delay),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(int(status[:3])))
+    for _ in response:
+        pass
+    response.close()
+    return statuses[0]
+
+
+async def asgi_request(application, path, body, delay):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': b'',
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())],
+        'client': (CLIENT_ADDRESS, 50000),
+        'server': ('testserver', 80),
+    }
+    half = len(body) // 2
+    chunks = [(0, body[:half], True), (delay, body[half:], False)]
+    statuses = []
+
+    async def receive():
+        if not chunks:
+            # Тело прочитано, дальше Django только ждёт разрыва соединения
+            await asyncio.Future()
+        pause, chunk, more_body = chunks.pop(0)
+        if pause:
+            await asyncio.sleep(pause)
+        return {'type': 'http.request', 'body': chunk, 'more_body': more_body}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    await application(scope, receive, send)
+    return statuses[0]
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест приёма точек: синхронный /api/positions/ под WSGI с пулом потоков против '
+            '/api/async/positions/ под ASGI. Каждый клиент отправляет точки в свой забег, тело каждого запроса '
+            'приходит с задержкой --delay. Тестовые данные удаляются после прогона')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=5, help='Точек на клиента')
+        parser.add_argument('--delay', type=float, default=0.05, help='Задержка тела запроса, секунды')
+        parser.add_argument('--workers', type=int, default=16, help='Потоков WSGI-сервера')
+
+    def create_runs(self, clients):
+        athlete = User.objects.create(username=f'benchmark_ingest_{time.time_ns()}')
+        runs = Run.objects.bulk_create(
+            [Run(athlete=athlete, status=Run.Status.IN_PROGRESS) for _ in range(clients)]
+        )
+        return athlete, [run.id for run in runs]
+
+    def report(self, name, started, finished, latencies, statuses):
+        errors = sum(1 for status in statuses if status != 201)
+        total = finished - started
+        p50, p95, p99 = (quantiles(latencies, n=100)[i] for i in (49, 94, 98))
+        self.stdout.write(
+            f'{name}: {len(statuses)} запросов за {total:.2f} с, {len(statuses) / total:.0f} запр/с, '
+            f'задержка p50 {p50 * 1000:.0f} мс, p95 {p95 * 1000:.0f} мс, p99 {p99 * 1000:.0f} мс, ошибок {errors}'
+        )
+
+    def run_wsgi(self, run_ids, options):
+        application = WSGIHandler()
+        latencies, statuses = [], []
+        started = time.perf_counter()
+
+        def client(run_id):
+            # Первый запрос клиент отправил в момент старта, даже если свободный поток нашёлся позже
+            sent = started
+            for index in range(options['requests']):
+                status = wsgi_request(application, '/api/positions/', position_body(run_id, index), options['delay'])
+                now = time.perf_counter()
+                latencies.append(now - sent)
+                statuses.append(status)
+                sent = now
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            list(executor.map(client, run_ids))
+        self.report('WSGI', started, time.perf_counter(), latencies, statuses)
+
+    def run_asgi(self, run_ids, options):
+        application = ASGIHandler()
+        latencies, statuses = [], []
+
+        async def client(run_id, started):
+            sent = started
+            for index in range(options['requests']):
+                body = position_body(run_id, index)
+                statuses.append(await asgi_request(application, '/api/async/positions/', body, options['delay']))
+                now = time.perf_counter()
+                latencies.append(now - sent)
+                sent = now
+
+        async def main():
+            started = time.perf_counter()
+            await asyncio.gather(*(client(run_id, started) for run_id in run_ids))
+            return started
+
+        started = asyncio.run(main())
+        self.report('ASGI', started, time.perf_counter(), latencies, statuses)
+
+    def handle(self, *args, **options):
+        athlete, run_ids = self.create_runs(options['clients'] * 2)
+        try:
+            self.run_wsgi(run_ids[:options['clients']], options)
+            self.run_asgi(run_ids[options['clients']:], options)
+        finally:
+            athlete.delete()
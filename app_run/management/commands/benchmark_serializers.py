@@ -0,0 +1,75 @@
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Avg
+from rest_framework.renderers import JSONRenderer
+
+from app_run.models import Run, User, Position
+from app_run.serializers import RunSerializer, PositionSerializer, UserSerializer
+from app_run.fast_serializers import FastRunSerializer, FastPositionSerializer, FastUserSerializer
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает стоимость строки для ModelSerializer и быстрых сериализаторов list-эндпоинтов. '
+            'Данные создаются во временной транзакции и откатываются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def fill(self, rows):
+        users = User.objects.bulk_create(
+            [User(username=f'benchmark_{i}', first_name='Имя', last_name=f'Фамилия {i}') for i in range(rows)]
+        )
+        runs = Run.objects.bulk_create(
+            [Run(athlete=users[i % len(users)], comment=f'Забег {i}', status=Run.Status.FINISHED, speed=3.25,
+                 distance=10.5, run_time_seconds=3600) for i in range(rows)]
+        )
+        moment = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        Position.objects.bulk_create(
+            [Position(run=runs[0], latitude=Decimal('55.7558') + Decimal(i % 100) / 10000,
+                      longitude=Decimal('37.6173'), date_time=moment + timedelta(seconds=i, microseconds=i),
+                      speed=2.5, distance=i / 100) for i in range(rows)],
+            batch_size=1000
+        )
+        return [user.id for user in users], runs[0].id
+
+    def best_of(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - started)
+        return min(timings), result
+
+    def compare(self, name, queryset, serializer_class, fast_serializer, repeat):
+        rows = queryset.count()
+        slow_time, slow_data = self.best_of(repeat, lambda: serializer_class(queryset.all(), many=True).data)
+        fast_time, fast_data = self.best_of(
+            repeat, lambda: fast_serializer.serialize(fast_serializer.rows(queryset.all()))
+        )
+        identical = JSONRenderer().render(slow_data) == JSONRenderer().render(fast_data)
+        self.stdout.write(
+            f'{name}: {rows} строк, ModelSerializer {slow_time / rows * 1e6:.1f} мкс/строка, '
+            f'быстрый {fast_time / rows * 1e6:.1f} мкс/строка, x{slow_time / fast_time:.1f}, '
+            f'JSON совпадает: {"да" if identical else "НЕТ"}'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user_ids, run_id = self.fill(options['rows'])
+            repeat = options['repeat']
+
+            self.compare('runs', Run.objects.filter(athlete_id__in=user_ids).select_related('athlete').order_by('id'),
+                         RunSerializer, FastRunSerializer(), repeat)
+            self.compare('positions', Position.objects.filter(run_id=run_id).order_by('id'),
+                         PositionSerializer, FastPositionSerializer(), repeat)
+            users = User.objects.filter(id__in=user_ids).annotate(
+                runs_finished=Count('runs', filter=Q(runs__status='finished')), rating=Avg('coach__rating')
+            ).order_by('id')
+            self.compare('users', users, UserSerializer, FastUserSerializer(), repeat)
+
+            transaction.set_rollback(True)
@@ -0,0 +1,75 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from haversine import haversine, Unit
+
+from app_run.track import track_arrays, measure_track, position_steps
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поточечный расчёт дистанции через haversine с векторизованным app_run.track'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10_000, 100_000])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def make_track(self, size, seed):
+        rnd = random.Random(seed)
+        latitude, longitude = 55.7558, 37.6173
+        moment = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        cords, times = [], []
+        for _ in range(size):
+            latitude += rnd.uniform(-0.0002, 0.0002)
+            longitude += rnd.uniform(-0.0002, 0.0002)
+            moment += timedelta(seconds=rnd.uniform(1, 5))
+            cords.append((Decimal(f'{latitude:.4f}'), Decimal(f'{longitude:.4f}')))
+            times.append(moment)
+        return cords, times
+
+    def loop(self, cords, times):
+        # Поточечный расчёт через haversine, как прежний StopAPIView.distance_calculation:
+        # дистанция копится без округления, до сотых округляется только значение точки
+        speeds, distances = [0], [0]
+        final_distance = 0
+        for previous, current, previous_time, current_time in zip(cords, cords[1:], times, times[1:]):
+            distance = haversine(previous, current, unit=Unit.METERS)
+            seconds = int((current_time - previous_time).total_seconds())
+            speeds.append(round(distance / seconds, 2) if seconds > 0 else 0)
+            final_distance += haversine(previous, current)
+            distances.append(round(final_distance, 2))
+        return speeds, distances
+
+    def vectorized(self, cords, times):
+        arrays = track_arrays(cords, times)
+        measure_track(*arrays)
+        speeds, distances, _ = position_steps(*arrays)
+        return speeds, distances
+
+    def best_of(self, repeat, func, *args):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func(*args)
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            cords, times = self.make_track(size, options['seed'])
+
+            loop_speeds, loop_distances = self.loop(cords, times)
+            speeds, distances = self.vectorized(cords, times)
+            mismatches = sum(
+                1 for row in zip(loop_speeds, speeds, loop_distances, distances) if row[0] != row[1] or row[2] != row[3]
+            )
+
+            loop_time = self.best_of(options['repeat'], self.loop, cords, times)
+            vector_time = self.best_of(options['repeat'], self.vectorized, cords, times)
+            self.stdout.write(
+                f'{size} точек: цикл {loop_time * 1000:.1f} мс, numpy {vector_time * 1000:.1f} мс, '
+                f'ускорение x{loop_time / vector_time:.1f}, расхождений {mismatches}'
+            )
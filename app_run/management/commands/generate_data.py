@@ -0,0 +1,40 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_run.models import User
+from app_run.synthetic import Generator, clear, username_prefix
+
+
+class Command(BaseCommand):
+    help = ('Генерирует синтетические данные для нагрузочных тестов: тренеров, атлетов, подписки, '
+            'забеги с GPS-треками, предметы на маршрутах и челленджи. '
+            'При тех же --seed, параметрах и --end данные совпадают')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--athletes', type=int, default=1000)
+        parser.add_argument('--coaches', type=int, default=50)
+        parser.add_argument('--coaches-per-athlete', type=int, default=2, help='Наибольшее число подписок атлета')
+        parser.add_argument('--runs', type=int, default=20, help='Забегов на атлета')
+        parser.add_argument('--positions', type=int, default=200, help='Среднее число точек в забеге')
+        parser.add_argument('--items', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=90, help='За сколько дней до --end распределены забеги')
+        parser.add_argument('--end', type=date.fromisoformat, default=None, help='Последний день данных, YYYY-MM-DD')
+        parser.add_argument('--batch-size', type=int, default=100_000, help='Точек в одной транзакции')
+        parser.add_argument('--clear', action='store_true', help='Удалить данные, ранее созданные с этим --seed')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.stdout.write(f'Удалено объектов: {clear(options["seed"])}')
+        elif User.objects.filter(username__startswith=username_prefix(options['seed'])).exists():
+            raise CommandError(f'Данные с --seed {options["seed"]} уже есть, добавьте --clear или смените --seed')
+
+        generator = Generator(
+            seed=options['seed'], athletes=options['athletes'], coaches=options['coaches'],
+            coaches_per_athlete=options['coaches_per_athlete'], runs=options['runs'], positions=options['positions'],
+            items=options['items'], end=options['end'], days=options['days'], batch_size=options['batch_size'],
+            log=self.stdout.write,
+        )
+        counts = generator.generate()
+        self.stdout.write(', '.join(f'{name}: {count}' for name, count in counts.items()))
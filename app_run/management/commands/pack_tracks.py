@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from app_run.models import Run
+from app_run.packing import pack_run
+
+
+class Command(BaseCommand):
+    help = 'Упаковывает точки завершённых забегов в PackedTrack и удаляет строки Position'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Сколько забегов обработать за запуск')
+
+    def handle(self, *args, **options):
+        runs = (
+            Run.objects.filter(status=Run.Status.FINISHED, packed_track__isnull=True, position__isnull=False)
+            .distinct()
+            .order_by('id')
+        )
+        if options['limit']:
+            runs = runs[:options['limit']]
+
+        packed = skipped = 0
+        # id выбираются заранее, чтобы не держать открытый курсор по Run, пока удаляются строки Position
+        for run in Run.objects.filter(id__in=list(runs.values_list('id', flat=True))).order_by('id'):
+            if pack_run(run):
+                packed += 1
+            else:
+                skipped += 1
+        self.stdout.write(f'Упаковано забегов: {packed}, пропущено: {skipped}')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_run.analytics import rebuild_athlete_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу AthleteStats с нуля по завершённым забегам'
+
+    def handle(self, *args, **options):
+        count = rebuild_athlete_stats()
+        self.stdout.write(f'Статистика пересчитана для {count} атлетов')
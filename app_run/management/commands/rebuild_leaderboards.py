@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_run.leaderboards import rebuild_leaderboards
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает таблицы лидеров по завершённым забегам и собранным предметам. '
+            'Ценность предметов за день и неделю не пересчитывается: у сбора предмета нет даты')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Строк в таблицах лидеров: {rebuild_leaderboards()}')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_run.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает таблицу слов для поиска пользователей (UserSearchToken). '
+            'На PostgreSQL поиск идёт по индексам auth_user, и команда ничего не делает')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Слов в индексе поиска: {rebuild_search_index()}')
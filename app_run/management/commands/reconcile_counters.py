@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from app_run.models import AthleteStats, CoachStats
+from app_run.analytics import rebuild_athlete_stats, rebuild_coach_stats
+
+
+class Command(BaseCommand):
+    help = ('Сверяет счётчики завершённых забегов атлетов (AthleteStats) и оценок тренеров (CoachStats) '
+            'с забегами и подписками и пересчитывает их')
+
+    def snapshot(self):
+        runs = dict(AthleteStats.objects.values_list('user_id', 'runs_count'))
+        rows = CoachStats.objects.values_list('user_id', 'rating_sum', 'rating_count')
+        ratings = {user_id: (rating_sum, rating_count) for user_id, rating_sum, rating_count in rows}
+        return runs, ratings
+
+    def mismatches(self, before, after, empty):
+        users = before.keys() | after.keys()
+        return sum(1 for user_id in users if before.get(user_id, empty) != after.get(user_id, empty))
+
+    def handle(self, *args, **options):
+        runs_before, ratings_before = self.snapshot()
+        athletes = rebuild_athlete_stats()
+        coaches = rebuild_coach_stats()
+        runs_after, ratings_after = self.snapshot()
+
+        self.stdout.write(
+            f'Атлетов: {athletes}, исправлено счётчиков забегов: {self.mismatches(runs_before, runs_after, 0)}. '
+            f'Тренеров с оценками: {coaches}, '
+            f'исправлено рейтингов: {self.mismatches(ratings_before, ratings_after, (0, 0))}'
+        )
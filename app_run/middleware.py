@@ -0,0 +1,77 @@
+import brotli
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+
+def brotli_sequence(sequence):
+    compressor = brotli.Compressor()
+    for item in sequence:
+        chunk = compressor.process(item) + compressor.flush()
+        if chunk:
+            yield chunk
+    yield compressor.finish()
+
+
+def accepted_encoding(header):
+    # Кодировка из Accept-Encoding с наибольшим q; q=0 означает «нельзя», brotli предпочтительнее при равенстве.
+    # Кодировки, названные только через *, не выбираются — ответ без сжатия клиент принимает всегда
+    weights = {}
+    for part in header.split(','):
+        coding, *params = [value.strip().lower() for value in part.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            weights[coding] = quality
+    coding = max(('br', 'gzip'), key=lambda name: weights.get(name, 0.0))
+    return coding if weights.get(coding, 0.0) > 0 else None
+
+
+
+class CompressionMiddleware(GZipMiddleware):
+    # Сжатие только ответов с треками и точками (COMPRESSED_PATH_PREFIXES): gzip — сам GZipMiddleware
+    # со случайной добавкой против BREACH, brotli — если клиент предпочитает его. В этих ответах нет
+    # секретов вроде CSRF-токена, которые BREACH мог бы подобрать. Server-Sent Events и асинхронные потоки
+    # не сжимаются, чтобы не задерживать доставку сообщений, zip-архивы — потому что уже сжаты
+    skip_content_types = ('text/event-stream', 'application/zip')
+
+    def process_response(self, request, response):
+        if not request.path.startswith(tuple(settings.COMPRESSED_PATH_PREFIXES)):
+            return response
+        if response.get('Content-Type', '').startswith(self.skip_content_types):
+            return response
+        if response.streaming and response.is_async:
+            return response
+
+        encoding = accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding == 'gzip':
+            return super().process_response(request, response)
+
+        if not response.streaming and len(response.content) < 200:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = brotli_sequence(response.streaming_content)
+            response.headers.pop('Content-Length', None)
+        else:
+            content = brotli.compress(response.content)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response.headers['Content-Length'] = str(len(content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
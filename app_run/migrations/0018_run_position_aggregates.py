@@ -0,0 +1,61 @@
+# Generated by Django 5.2 on 2026-10-18 06:11
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, Min, Max
+from haversine import haversine
+
+
+def fill_position_aggregates(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    Position = apps.get_model('app_run', 'Position')
+
+    for run in Run.objects.filter(position__isnull=False).distinct().iterator():
+        positions = Position.objects.filter(run=run)
+        agg = positions.aggregate(
+            count=Count('id'), speed_sum=Sum('speed'), first=Min('date_time'), last=Max('date_time')
+        )
+        # Дистанция — обход точек в порядке id без округления шагов, как её считал StopAPIView
+        cords = list(positions.order_by('id').values_list('latitude', 'longitude'))
+        run.positions_count = agg['count']
+        run.speed_sum = agg['speed_sum'] or 0
+        run.first_position_at = agg['first']
+        run.last_position_at = agg['last']
+        run.positions_distance = sum(haversine(a, b) for a, b in zip(cords, cords[1:]))
+        run.save(update_fields=['positions_count', 'speed_sum', 'first_position_at', 'last_position_at',
+                                'positions_distance'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0017_collectibleitem_app_run_col_latitud_6db97c_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='first_position_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='last_position_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='positions_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='positions_distance',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='speed_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_position_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 06:13
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Min
+
+
+def remove_duplicate_awards(apps, schema_editor):
+    Challenge = apps.get_model('app_run', 'Challenge')
+    keep = Challenge.objects.values('full_name', 'athlete').annotate(keep_id=Min('id')).values('keep_id')
+    Challenge.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0018_run_position_aggregates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_awards, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='challenge',
+            unique_together={('full_name', 'athlete')},
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2 on 2026-10-18 06:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum, Max
+
+
+def fill_athlete_stats(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    AthleteStats = apps.get_model('app_run', 'AthleteStats')
+
+    rows = (
+        Run.objects.filter(status='finished')
+        .values('athlete_id')
+        .annotate(runs_count=Count('id'), speed_sum=Sum('speed'), longest_run=Max('distance'),
+                  total_distance=Sum('distance'))
+    )
+    AthleteStats.objects.bulk_create([
+        AthleteStats(
+            user_id=row['athlete_id'],
+            runs_count=row['runs_count'],
+            speed_sum=row['speed_sum'] or 0,
+            longest_run=row['longest_run'],
+            total_distance=row['total_distance'] or 0,
+            avg_speed=(row['speed_sum'] or 0) / row['runs_count'],
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0019_challenge_unique_award'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AthleteStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('runs_count', models.IntegerField(default=0)),
+                ('speed_sum', models.FloatField(default=0)),
+                ('longest_run', models.FloatField(null=True)),
+                ('total_distance', models.FloatField(default=0)),
+                ('avg_speed', models.FloatField(null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='athlete_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(fill_athlete_stats, migrations.RunPython.noop),
+    ]
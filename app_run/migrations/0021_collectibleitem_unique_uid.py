@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-18 06:17
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def merge_duplicate_uids(apps, schema_editor):
+    # Оставляем последнюю загруженную запись с данным uid и переносим на неё собравших атлетов
+    CollectibleItem = apps.get_model('app_run', 'CollectibleItem')
+    Through = CollectibleItem.athletes.through
+
+    duplicates = CollectibleItem.objects.values('uid').annotate(count=Count('id'), keep_id=Max('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        stale = CollectibleItem.objects.filter(uid=duplicate['uid']).exclude(id=duplicate['keep_id'])
+        user_ids = Through.objects.filter(collectibleitem__in=stale).values_list('user_id', flat=True).distinct()
+        Through.objects.bulk_create(
+            [Through(collectibleitem_id=duplicate['keep_id'], user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True
+        )
+        stale.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0020_athletestats'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_uids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='collectibleitem',
+            name='uid',
+            field=models.CharField(max_length=150, unique=True),
+        ),
+    ]
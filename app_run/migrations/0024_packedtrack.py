@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 06:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0023_run_position_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackedTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('run', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='packed_track', to='app_run.run')),
+            ],
+        ),
+    ]
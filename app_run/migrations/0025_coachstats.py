@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-18 06:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_coach_stats(apps, schema_editor):
+    Subscribe = apps.get_model('app_run', 'Subscribe')
+    CoachStats = apps.get_model('app_run', 'CoachStats')
+
+    rows = (
+        Subscribe.objects.filter(rating__isnull=False)
+        .values('coach_id')
+        .annotate(rating_sum=Sum('rating'), rating_count=Count('id'))
+    )
+    CoachStats.objects.bulk_create([
+        CoachStats(user_id=row['coach_id'], rating_sum=row['rating_sum'], rating_count=row['rating_count'])
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0024_packedtrack'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoachStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='coach_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(fill_coach_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2 on 2026-10-18 06:40
+
+from datetime import date, timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def fill_leaderboards(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    CollectibleItem = apps.get_model('app_run', 'CollectibleItem')
+    LeaderboardScore = apps.get_model('app_run', 'LeaderboardScore')
+
+    runs = (
+        Run.objects.filter(status='finished')
+        .annotate(day=TruncDate(Coalesce('last_position_at', 'created_at')))
+        .values('athlete_id', 'day')
+        .annotate(distance=Sum('distance'), runs=Count('id'), speed=Sum('speed'))
+        .order_by()
+    )
+    totals = {}
+    for row in runs:
+        periods = [('all', date(1970, 1, 1)), ('day', row['day']),
+                   ('week', row['day'] - timedelta(days=row['day'].weekday()))]
+        for window, period in periods:
+            key = (row['athlete_id'], window, period)
+            distance, count, speed = totals.get(key, (0, 0, 0))
+            totals[key] = (distance + (row['distance'] or 0), count + row['runs'], speed + (row['speed'] or 0))
+
+    entries = []
+    for (user_id, window, period), (distance, count, speed) in totals.items():
+        common = {'window': window, 'period': period, 'user_id': user_id, 'count': count}
+        entries += [
+            LeaderboardScore(board='distance', total=distance, score=distance, **common),
+            LeaderboardScore(board='runs', total=0, score=count, **common),
+            LeaderboardScore(board='speed', total=speed, score=speed / count, **common),
+        ]
+
+    collected = (
+        CollectibleItem.athletes.through.objects.values('user_id')
+        .annotate(value=Sum('collectibleitem__value'), items=Count('id'))
+        .order_by()
+    )
+    entries += [
+        LeaderboardScore(board='collectibles', window='all', period=date(1970, 1, 1), user_id=row['user_id'],
+                         total=row['value'] or 0, count=row['items'], score=row['value'] or 0)
+        for row in collected
+    ]
+    LeaderboardScore.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0025_coachstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(choices=[('distance', 'Distance'), ('runs', 'Runs'), ('speed', 'Speed'), ('collectibles', 'Collectibles')], max_length=15)),
+                ('window', models.CharField(choices=[('all', 'All'), ('day', 'Day'), ('week', 'Week')], max_length=5)),
+                ('period', models.DateField()),
+                ('total', models.FloatField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('score', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_scores', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['board', 'window', 'period', '-score', 'user'], name='app_run_lea_board_7a0d76_idx')],
+                'unique_together': {('board', 'window', 'period', 'user')},
+            },
+        ),
+        migrations.RunPython(fill_leaderboards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2 on 2026-10-18 06:43
+
+import re
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+POSTGRES_INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS auth_user_name_fts ON auth_user "
+    "USING gin (to_tsvector('simple', first_name || ' ' || last_name))",
+    "CREATE INDEX IF NOT EXISTS auth_user_name_trgm ON auth_user "
+    "USING gin (lower(first_name || ' ' || last_name) gin_trgm_ops)",
+]
+
+
+def create_search_index(apps, schema_editor):
+    # На PostgreSQL ищут индексы на выражениях по auth_user, на остальных базах заполняется таблица слов
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in POSTGRES_INDEXES:
+            schema_editor.execute(sql)
+        return
+
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UserSearchToken = apps.get_model('app_run', 'UserSearchToken')
+    tokens = []
+    for user_id, first_name, last_name in User.objects.values_list('id', 'first_name', 'last_name').iterator():
+        words = {word[:150] for word in re.findall(r'\w+', f'{first_name} {last_name}'.casefold())}
+        tokens += [UserSearchToken(user_id=user_id, token=word) for word in words]
+    UserSearchToken.objects.bulk_create(tokens, batch_size=1000)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS auth_user_name_fts')
+        schema_editor.execute('DROP INDEX IF EXISTS auth_user_name_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0026_leaderboardscore'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=150)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('token', 'user')},
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
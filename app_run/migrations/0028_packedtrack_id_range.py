@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-18 07:03
+
+import struct
+import zlib
+
+from django.db import migrations, models
+
+
+def fill_id_range(apps, schema_editor):
+    # Заголовок формата TRK1 (app_run/packing.py) содержит id первой точки и число точек,
+    # за ним идут приращения id (int32) — их сумма даёт id последней
+    PackedTrack = apps.get_model('app_run', 'PackedTrack')
+    header = struct.Struct('<4sBIqqqqd')
+    for track in PackedTrack.objects.iterator(chunk_size=100):
+        raw = zlib.decompress(bytes(track.data))
+        _, _, count, first_id = header.unpack_from(raw)[:4]
+        steps = struct.unpack_from(f'<{count - 1}i', raw, header.size)
+        track.first_id, track.last_id = first_id, first_id + sum(steps)
+        track.save(update_fields=['first_id', 'last_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0027_usersearchtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packedtrack',
+            name='first_id',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='packedtrack',
+            name='last_id',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_id_range, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='packedtrack',
+            index=models.Index(fields=['first_id', 'last_id'], name='app_run_pac_first_i_066059_idx'),
+        ),
+    ]
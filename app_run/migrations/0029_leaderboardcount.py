@@ -0,0 +1,55 @@
+# Generated by Django 5.2 on 2026-10-18 07:19
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def fill_leaderboard_counts(apps, schema_editor):
+    # Как leaderboards.rebuild_counts: ключ — score в сотых, 10 шестнадцатеричных цифр
+    Subscribe = apps.get_model('app_run', 'Subscribe')
+    LeaderboardScore = apps.get_model('app_run', 'LeaderboardScore')
+    LeaderboardCount = apps.get_model('app_run', 'LeaderboardCount')
+
+    coaches = defaultdict(list)
+    for athlete_id, coach_id in Subscribe.objects.values_list('athlete_id', 'coach_id'):
+        coaches[athlete_id].append(coach_id)
+    counts = defaultdict(int)
+    rows = LeaderboardScore.objects.values_list('board', 'window', 'period', 'user_id', 'score')
+    for board, window, period, user_id, score in rows.iterator(chunk_size=2000):
+        key = min(max(round(score * 100), 0), 16 ** 10 - 1)
+        for level in range(1, 11):
+            for scope in [0] + coaches[user_id]:
+                counts[(board, window, period, scope, level, key >> 4 * (10 - level))] += 1
+    LeaderboardCount.objects.bulk_create([
+        LeaderboardCount(board=board, window=window, period=period, scope=scope, level=level, prefix=prefix,
+                         count=count)
+        for (board, window, period, scope, level, prefix), count in counts.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0028_packedtrack_id_range'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(choices=[('distance', 'Distance'), ('runs', 'Runs'), ('speed', 'Speed'), ('collectibles', 'Collectibles')], max_length=15)),
+                ('window', models.CharField(choices=[('all', 'All'), ('day', 'Day'), ('week', 'Week')], max_length=5)),
+                ('period', models.DateField()),
+                ('scope', models.BigIntegerField()),
+                ('level', models.SmallIntegerField()),
+                ('prefix', models.BigIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('board', 'window', 'period', 'scope', 'level', 'prefix')},
+            },
+        ),
+        migrations.RunPython(fill_leaderboard_counts, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,13 @@
+from datetime import date
+from math import cos, degrees, radians
+
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Case, FloatField, Q, When
+from django.db.models.functions import Cast
 from django.contrib.auth.models import User
+
+from .geo import bounding_box, planar_factor, track_bounding_box, EARTH_RADIUS_M
 # Create your models here.
 
 
@@ -11,6 +19,13 @@ class Run(models.Model):
     run_time_seconds = models.IntegerField(null=True)
     athlete = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='runs')
 
+    # Накопительные значения по точкам забега, обновляются при каждом добавлении Position
+    positions_count = models.IntegerField(default=0)
+    positions_distance = models.FloatField(default=0)
+    speed_sum = models.FloatField(default=0)
+    first_position_at = models.DateTimeField(null=True)
+    last_position_at = models.DateTimeField(null=True)
+
 
     class Status(models.TextChoices):
         INIT = 'init'
@@ -19,6 +34,12 @@ class Run(models.Model):
 
     status = models.CharField(max_length=15, choices=Status.choices, default=Status.INIT)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['athlete', 'status']),
+            models.Index(fields=['created_at']),
+        ]
+
 
 
 class AthleteInfo(models.Model):
@@ -28,10 +49,90 @@ class AthleteInfo(models.Model):
 
 
 
+class AthleteStats(models.Model):
+    # Материализованная статистика по завершённым забегам атлета для аналитики тренера
+    user = models.OneToOneField(to=User, on_delete=models.CASCADE, related_name='athlete_stats')
+    runs_count = models.IntegerField(default=0)
+    speed_sum = models.FloatField(default=0)
+    longest_run = models.FloatField(null=True)
+    total_distance = models.FloatField(default=0)
+    avg_speed = models.FloatField(null=True)
+
+
+
+class CoachStats(models.Model):
+    # Сумма и число выставленных тренеру оценок, рейтинг — их отношение
+    user = models.OneToOneField(to=User, on_delete=models.CASCADE, related_name='coach_stats')
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+
+
+
+class LeaderboardScore(models.Model):
+    # Очки атлета в таблице лидеров за период: window — all, day или week, period — первый день периода
+    # (для all — ALL_PERIOD). total и count — накопленные сумма и число значений, score — по чему идёт рейтинг
+    ALL_PERIOD = date(1970, 1, 1)
+
+    class Board(models.TextChoices):
+        DISTANCE = 'distance'
+        RUNS = 'runs'
+        SPEED = 'speed'
+        COLLECTIBLES = 'collectibles'
+
+    class Window(models.TextChoices):
+        ALL = 'all'
+        DAY = 'day'
+        WEEK = 'week'
+
+    board = models.CharField(max_length=15, choices=Board.choices)
+    window = models.CharField(max_length=5, choices=Window.choices)
+    period = models.DateField()
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='leaderboard_scores')
+    total = models.FloatField(default=0)
+    count = models.IntegerField(default=0)
+    score = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ['board', 'window', 'period', 'user']
+        indexes = [models.Index(fields=['board', 'window', 'period', '-score', 'user'])]
+
+
+
+class LeaderboardCount(models.Model):
+    # Узел дерева счётчиков таблицы лидеров (board, window, period): сколько строк LeaderboardScore имеют ключ —
+    # score в сотых, записанный RANK_DIGITS шестнадцатеричными цифрами, — начинающийся с prefix из level цифр.
+    # scope — 0 для общего рейтинга или id тренера для рейтинга его атлетов
+    board = models.CharField(max_length=15, choices=LeaderboardScore.Board.choices)
+    window = models.CharField(max_length=5, choices=LeaderboardScore.Window.choices)
+    period = models.DateField()
+    scope = models.BigIntegerField()
+    level = models.SmallIntegerField()
+    prefix = models.BigIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['board', 'window', 'period', 'scope', 'level', 'prefix']
+
+
+
+class UserSearchToken(models.Model):
+    # Слова имени и фамилии в нижнем регистре для поиска по префиксу диапазоном по индексу (token, user).
+    # Используется на базах без триграмм и полнотекстового поиска, на PostgreSQL таблица пустая
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=150)
+
+    class Meta:
+        unique_together = ['token', 'user']
+
+
+
 class Challenge(models.Model):
     full_name = models.CharField(max_length=50)
     athlete = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='challenge')
 
+    class Meta:
+        unique_together = ['full_name', 'athlete']
+
 
 
 class Position(models.Model):
@@ -42,17 +143,77 @@ class Position(models.Model):
     distance = models.FloatField(null=True)
     run = models.ForeignKey(to=Run, on_delete=models.CASCADE, related_name='position')
 
+    class Meta:
+        indexes = [models.Index(fields=['run', 'date_time'])]
+
+
+
+class PackedTrack(models.Model):
+    # Сжатое хранение точек завершённого забега, формат описан в app_run/packing.py
+    run = models.OneToOneField(to=Run, on_delete=models.CASCADE, related_name='packed_track')
+    count = models.IntegerField()
+    # id первой и последней точки: по ним точка находится без распаковки всех треков
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [models.Index(fields=['first_id', 'last_id'])]
+
+
+
+class CollectibleItemQuerySet(models.QuerySet):
+
+    def within_radius_box(self, latitude, longitude, radius):
+        return self.within_box(*bounding_box(latitude, longitude, radius))
+
+    def by_planar_distance(self, latitude, longitude, radius):
+        # Предметы прямоугольника вокруг круга по возрастанию квадрата planar_distance (в градусах широты):
+        # сортировка и отсечение углов прямоугольника делаются в базе, точное расстояние — geo.nearest_ordered
+        latitude, longitude = float(latitude), float(longitude)
+        box = bounding_box(latitude, longitude, radius)
+        delta_lon = Cast('longitude', FloatField()) - longitude
+        if box[2] > box[3] or box[2:] == (-180.0, 180.0):
+            # Прямоугольник через 180-й меридиан: разница долгот приводится к (-180, 180]
+            delta_lon = Case(
+                When(longitude__gt=longitude + 180, then=delta_lon - 360.0),
+                When(longitude__lt=longitude - 180, then=delta_lon + 360.0),
+                default=delta_lon,
+                output_field=FloatField(),
+            )
+        delta_lon = delta_lon * cos(radians(latitude))
+        delta_lat = Cast('latitude', FloatField()) - latitude
+        qs = self.within_box(*box).alias(planar=delta_lat * delta_lat + delta_lon * delta_lon)
+        factor = planar_factor(latitude, radius)
+        if factor > 0:
+            qs = qs.filter(planar__lte=degrees(radius / EARTH_RADIUS_M / factor) ** 2)
+        return qs.order_by('planar', 'id')
+
+    def around_track(self, cords, radius):
+        return self.within_box(*track_bounding_box(cords, radius))
+
+    def within_box(self, min_lat, max_lat, min_lon, max_lon):
+        qs = self.filter(latitude__range=(min_lat, max_lat))
+        if min_lon <= max_lon:
+            return qs.filter(longitude__range=(min_lon, max_lon))
+        return qs.filter(Q(longitude__gte=min_lon) | Q(longitude__lte=max_lon))
+
 
 
 class CollectibleItem(models.Model):
     name = models.CharField(max_length=50)
-    uid = models.CharField(max_length=150)
+    uid = models.CharField(max_length=150, unique=True)
     latitude = models.DecimalField(max_digits=8, decimal_places=4)
     longitude = models.DecimalField(max_digits=8, decimal_places=4)
     picture = models.URLField()
     value = models.IntegerField()
     athletes = models.ManyToManyField(to=User, related_name='collectibles')
 
+    objects = CollectibleItemQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['latitude', 'longitude'])]
+
 
 
 class Subscribe(models.Model):
@@ -61,4 +222,23 @@ class Subscribe(models.Model):
     rating = models.IntegerField(null=True)
 
     class Meta:
-        unique_together = ['athlete', 'coach']
\ No newline at end of file
+        unique_together = ['athlete', 'coach']
+
+
+
+class ImportJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    file_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=15, choices=Status.choices, default=Status.PENDING)
+    rows_processed = models.IntegerField(default=0)
+    rows_imported = models.IntegerField(default=0)
+    rows_rejected = models.IntegerField(default=0)
+    invalid_rows = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
@@ -0,0 +1,126 @@
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+
+from .models import Position, PackedTrack
+
+
+# Формат упакованного трека (после zlib):
+#   заголовок HEADER: магия, версия, число точек n, id, широта и долгота (мкград), время (мкс от эпохи)
+#   и distance первой точки;
+#   далее массивы little-endian: приращения id, широты, долготы (int32, n-1), приращения времени (int64, n-1),
+#   speed в сотых м/с (int32, n), приращения distance в сотых км (int32, n-1)
+MAGIC = b'TRK1'
+VERSION = 1
+HEADER = struct.Struct('<4sBIqqqqd')
+MICRO = 1_000_000
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+FIELDS = ['id', 'latitude', 'longitude', 'date_time', 'speed', 'distance']
+
+
+def to_micro(value):
+    return int(Decimal(value) * MICRO)
+
+
+def pack_rows(rows):
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    latitudes = np.array([to_micro(row[1]) for row in rows], dtype=np.int64)
+    longitudes = np.array([to_micro(row[2]) for row in rows], dtype=np.int64)
+    times = np.array([(row[3] - EPOCH) // timedelta(microseconds=1) for row in rows], dtype=np.int64)
+    speeds = np.array([round(row[4] * 100) for row in rows], dtype=np.int64)
+    distances = np.array([row[5] for row in rows], dtype=np.float64)
+    steps = np.round(np.diff(distances) * 100).astype(np.int64)
+
+    header = HEADER.pack(MAGIC, VERSION, len(rows), ids[0], latitudes[0], longitudes[0], times[0], distances[0])
+    body = b''.join([
+        np.diff(ids).astype('<i4').tobytes(),
+        np.diff(latitudes).astype('<i4').tobytes(),
+        np.diff(longitudes).astype('<i4').tobytes(),
+        np.diff(times).astype('<i8').tobytes(),
+        speeds.astype('<i4').tobytes(),
+        steps.astype('<i4').tobytes(),
+    ])
+    return zlib.compress(header + body)
+
+
+def unpack_rows(data):
+    raw = zlib.decompress(bytes(data))
+    magic, version, count, first_id, first_lat, first_lon, first_time, first_distance = HEADER.unpack_from(raw)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Неизвестный формат упакованного трека')
+
+    offset = HEADER.size
+
+    def take(dtype, size):
+        nonlocal offset
+        array = np.frombuffer(raw, dtype=dtype, count=size, offset=offset)
+        offset += array.nbytes
+        return array
+
+    def restore(first, deltas):
+        return np.cumsum(np.concatenate(([first], deltas.astype(np.int64))))
+
+    ids = restore(first_id, take('<i4', count - 1))
+    latitudes = restore(first_lat, take('<i4', count - 1))
+    longitudes = restore(first_lon, take('<i4', count - 1))
+    times = restore(first_time, take('<i8', count - 1))
+    speeds = take('<i4', count) / 100
+    distances = np.cumsum(np.concatenate(([first_distance], take('<i4', count - 1) / 100)))
+
+    quant = Decimal('0.0001')
+    return [
+        (
+            int(ids[i]),
+            (Decimal(int(latitudes[i])) / MICRO).quantize(quant),
+            (Decimal(int(longitudes[i])) / MICRO).quantize(quant),
+            EPOCH + timedelta(microseconds=int(times[i])),
+            float(speeds[i]),
+            float(distances[i]),
+        )
+        for i in range(count)
+    ]
+
+
+def row_position(run_id, row):
+    return Position(run_id=run_id, **dict(zip(FIELDS, row)))
+
+
+def unpack_positions(track):
+    return [row_position(track.run_id, row) for row in unpack_rows(track.data)]
+
+
+def packed_position(position_id):
+    # Точка упакованного забега по id или None. Распаковываются только треки, в диапазон id которых она попадает
+    tracks = PackedTrack.objects.filter(first_id__lte=position_id, last_id__gte=position_id)
+    for track in tracks:
+        for row in unpack_rows(track.data):
+            if row[0] == position_id:
+                return row_position(track.run_id, row)
+    return None
+
+
+def pack_run(run):
+    # Упаковывает точки завершённого забега и удаляет строки Position.
+    # Если трек не восстанавливается без потерь (пустые speed/distance, старые данные), он остаётся как есть
+    positions = run.position.order_by('id')
+    rows = list(positions.values_list(*FIELDS))
+    if not rows or PackedTrack.objects.filter(run=run).exists():
+        return False
+    if any(speed is None or distance is None for _, _, _, _, speed, distance in rows):
+        return False
+
+    try:
+        data = pack_rows(rows)
+        if unpack_rows(data) != rows:
+            return False
+    except (TypeError, ValueError, OverflowError):
+        return False
+
+    with transaction.atomic():
+        PackedTrack.objects.create(run=run, count=len(rows), first_id=rows[0][0], last_id=rows[-1][0], data=data)
+        positions.delete()
+    return True
@@ -0,0 +1,106 @@
+import struct
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import msgpack
+from rest_framework.renderers import BaseRenderer
+
+from .packing import EPOCH
+from .serializers import POSITION_DATETIME_FORMAT
+
+
+# Формат application/vnd.project-run.track: заголовок TRACK_HEADER, затем записи POSITION_RECORD подряд до конца тела.
+# Запись (little-endian, 40 байт): id int64, широта и долгота int32 в десятитысячных градуса,
+# время int64 в микросекундах от эпохи UTC, speed float64, distance float64 (NaN вместо null)
+TRACK_HEADER = b'PTRK\x01'
+POSITION_RECORD = struct.Struct('<qiiqdd')
+
+
+def msgpack_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def pack_position(id, latitude, longitude, date_time, speed, distance):
+    return POSITION_RECORD.pack(
+        id,
+        int(Decimal(latitude) * 10000),
+        int(Decimal(longitude) * 10000),
+        (date_time - EPOCH) // timedelta(microseconds=1),
+        float('nan') if speed is None else speed,
+        float('nan') if distance is None else distance,
+    )
+
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=msgpack_default)
+
+
+
+class PackedTrackRenderer(BaseRenderer):
+    # Кодирует сериализованный список точек; у ответов без списка (ошибки) тело — только заголовок.
+    # В двоичном теле нет места для полей страницы, поэтому ссылки на соседние страницы уходят
+    # в заголовок Link (rel="next", rel="previous"), а общее число точек — в X-Total-Count
+    media_type = 'application/vnd.project-run.track'
+    format = 'track'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if isinstance(data, dict):
+            if response is not None and 'results' in data:
+                links = [f'<{data[rel]}>; rel="{rel}"' for rel in ('next', 'previous') if data.get(rel)]
+                if links:
+                    response['Link'] = ', '.join(links)
+                if 'count' in data:
+                    response['X-Total-Count'] = str(data['count'])
+            data = data.get('results', [])
+        records = [
+            pack_position(
+                position['id'], position['latitude'], position['longitude'],
+                datetime.strptime(position['date_time'], POSITION_DATETIME_FORMAT).replace(tzinfo=timezone.utc),
+                position['speed'], position['distance'],
+            )
+            for position in data or []
+        ]
+        return TRACK_HEADER + b''.join(records)
+
+
+def stream_track(rows, chunk_size=1000):
+    # rows — кортежи (id, latitude, longitude, date_time, speed, distance)
+    yield TRACK_HEADER
+    chunk = []
+    for row in rows:
+        chunk.append(pack_position(*row))
+        if len(chunk) >= chunk_size:
+            yield b''.join(chunk)
+            chunk = []
+    if chunk:
+        yield b''.join(chunk)
+
+
+def stream_msgpack(rows, count, to_representation, chunk_size=1000):
+    # Массив из count элементов, как у MessagePackRenderer, но отдаётся частями
+    packer = msgpack.Packer(default=msgpack_default)
+    yield packer.pack_array_header(count)
+    chunk = []
+    for row in rows:
+        chunk.append(packer.pack(to_representation(row)))
+        if len(chunk) >= chunk_size:
+            yield b''.join(chunk)
+            chunk = []
+    if chunk:
+        yield b''.join(chunk)
@@ -0,0 +1,123 @@
+import re
+from functools import reduce
+from operator import or_
+
+from django.db import connection
+from django.db.models import Q, Max, Case, When, Value, F, Subquery, OuterRef, BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import User, UserSearchToken
+
+
+# Поиск пользователей по имени и фамилии. Каждое слово запроса ищется как префикс слова имени,
+# поэтому работает и подсказка по мере набора. На PostgreSQL — полнотекстовый поиск и триграммы
+# по индексам на выражениях (миграция 0027), на остальных базах — таблица слов UserSearchToken,
+# где префикс превращается в диапазон по индексу (token, user)
+
+MAX_TERMS = 5
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 20
+
+
+def words(text):
+    return re.findall(r'\w+', text.casefold())
+
+
+def search_terms(query):
+    return words(query)[:MAX_TERMS]
+
+
+def name_tokens(first_name, last_name):
+    return {token[:150] for token in words(f'{first_name} {last_name}')}
+
+
+def index_users(users):
+    # users — пары (id, first_name, last_name) или пользователи; слова пересобираются целиком
+    rows = [(user.id, user.first_name, user.last_name) if isinstance(user, User) else user for user in users]
+    if not rows or not TokenSearch.enabled():
+        return
+    UserSearchToken.objects.filter(user_id__in=[user_id for user_id, _, _ in rows]).delete()
+    UserSearchToken.objects.bulk_create([
+        UserSearchToken(user_id=user_id, token=token)
+        for user_id, first_name, last_name in rows
+        for token in name_tokens(first_name, last_name)
+    ], batch_size=1000)
+
+
+def rebuild_search_index():
+    if not TokenSearch.enabled():
+        return 0
+    UserSearchToken.objects.all().delete()
+    users = User.objects.order_by('id').values_list('id', 'first_name', 'last_name')
+    batch = []
+    for row in users.iterator(chunk_size=2000):
+        batch.append(row)
+        if len(batch) == 2000:
+            index_users(batch)
+            batch = []
+    index_users(batch)
+    return UserSearchToken.objects.count()
+
+
+
+class TokenSearch:
+    # Ранг — сумма по словам запроса: 2, если слово имени совпало целиком, 1 — если только по префиксу.
+    # В выдачу попадают пользователи, у которых нашлось каждое слово запроса
+
+    @staticmethod
+    def enabled():
+        return connection.vendor != 'postgresql'
+
+    def prefix(self, term):
+        # Все строки с префиксом term лежат в [term, следующая строка той же длины)
+        return Q(token__gte=term, token__lt=term[:-1] + chr(ord(term[-1]) + 1))
+
+    def matches(self, terms):
+        hits = {f'term_{index}': (term, self.prefix(term)) for index, term in enumerate(terms)}
+        return (
+            UserSearchToken.objects.filter(reduce(or_, (hit for _, hit in hits.values())))
+            .values('user_id')
+            .annotate(**{
+                name: Max(Case(When(token=term, then=Value(2)), When(hit, then=Value(1)), default=Value(0)))
+                for name, (term, hit) in hits.items()
+            })
+            .filter(**{f'{name}__gt': 0 for name in hits})
+            .annotate(search_rank=reduce(lambda total, name: total + F(name), list(hits)[1:], F('term_0')))
+        )
+
+    def filter(self, queryset, terms):
+        matches = self.matches(terms)
+        return queryset.filter(id__in=matches.values('user_id')).annotate(
+            search_rank=Subquery(matches.filter(user_id=OuterRef('id')).values('search_rank'),
+                                 output_field=FloatField())
+        )
+
+
+
+class PostgresSearch:
+    # Индексы из миграции построены на тех же выражениях: GIN по to_tsvector для префиксов слов
+    # и GIN gin_trgm_ops для похожих написаний. Ранг — ts_rank плюс word_similarity
+    name = f"lower({User._meta.db_table}.first_name || ' ' || {User._meta.db_table}.last_name)"
+    vector = f"to_tsvector('simple', {User._meta.db_table}.first_name || ' ' || {User._meta.db_table}.last_name)"
+
+    def filter(self, queryset, terms):
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        text = ' '.join(terms)
+        matched = RawSQL(
+            f"({self.vector} @@ to_tsquery('simple', %s) OR {self.name} %%> %s)", (tsquery, text),
+            output_field=BooleanField()
+        )
+        rank = RawSQL(
+            f"ts_rank({self.vector}, to_tsquery('simple', %s)) + word_similarity(%s, {self.name})", (tsquery, text),
+            output_field=FloatField()
+        )
+        return queryset.filter(matched).annotate(search_rank=rank)
+
+
+def search_users(queryset, query):
+    # Пользователи queryset, подходящие под query, с рангом search_rank; None, если в запросе нет слов
+    terms = search_terms(query)
+    if not terms:
+        return None
+    backend = TokenSearch() if TokenSearch.enabled() else PostgresSearch()
+    return backend.filter(queryset, terms).order_by('-search_rank', 'id')
@@ -1,6 +1,13 @@
 from rest_framework import serializers
 
-from .models import Run, User, AthleteInfo, Challenge, Position, CollectibleItem, Subscribe
+from .models import Run, User, AthleteInfo, Challenge, Position, CollectibleItem, Subscribe, ImportJob, LeaderboardScore
+from .geo import NEARBY_MAX_RADIUS_M, NEARBY_LIMIT, NEARBY_MAX_LIMIT, VIEWPORT_LIMIT, VIEWPORT_MAX_LIMIT
+from .leaderboards import LEADERBOARD_LIMIT, LEADERBOARD_MAX_LIMIT
+from .search import SUGGEST_LIMIT, SUGGEST_MAX_LIMIT
+
+
+# Время точки в ответах API; его же используют быстрые сериализаторы, рендереры и экспорт
+POSITION_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
 
 
 
@@ -17,7 +24,16 @@ class RunSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Run
-        fields = '__all__'
+        exclude = ['positions_count', 'positions_distance', 'speed_sum', 'first_position_at', 'last_position_at']
+        # Статус и итоги меняются только через start и stop, которые ведут счётчики атлета и таблицы лидеров
+        read_only_fields = ['status', 'speed', 'distance', 'run_time_seconds']
+
+    def validate(self, attrs):
+        # Запись в эти поля отклоняется с 400, а не пропускается молча
+        written = [field for field in self.Meta.read_only_fields if field in self.initial_data]
+        if written:
+            raise serializers.ValidationError({field: 'Меняется только через start и stop' for field in written})
+        return attrs
 
 
 
@@ -57,7 +73,7 @@ class PositionSerializer(serializers.ModelSerializer):
     latitude = serializers.DecimalField(max_digits=8, decimal_places=4, min_value=-90, max_value=90)
     longitude = serializers.DecimalField(max_digits=8, decimal_places=4,min_value=-180, max_value=180)
     run = serializers.PrimaryKeyRelatedField(queryset=Run.objects.all(), write_only=True)
-    date_time = serializers.DateTimeField(format='%Y-%m-%dT%H:%M:%S.%f')
+    date_time = serializers.DateTimeField(format=POSITION_DATETIME_FORMAT)
 
     class Meta:
         model = Position
@@ -74,6 +90,27 @@ class PositionSerializer(serializers.ModelSerializer):
 
 
 
+class PositionFixSerializer(PositionSerializer):
+    run = None
+
+    class Meta(PositionSerializer.Meta):
+        fields = ['latitude', 'longitude', 'date_time']
+
+
+
+class PositionBatchSerializer(serializers.Serializer):
+    run = serializers.PrimaryKeyRelatedField(queryset=Run.objects.select_related('athlete'))
+    # Элементы не проверяются здесь: неверная точка отклоняется PositionFixSerializer под своим индексом,
+    # а не вместе со всем пакетом
+    positions = serializers.ListField(child=serializers.JSONField(), allow_empty=False)
+
+    def validate_run(self, value):
+        if value.status != Run.Status.IN_PROGRESS:
+            raise serializers.ValidationError("Статус забега не 'В процессе'")
+        return value
+
+
+
 class CollectibleItemSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -82,6 +119,60 @@ class CollectibleItemSerializer(serializers.ModelSerializer):
 
 
 
+class CollectibleItemImportSerializer(CollectibleItemSerializer):
+    # Существующий uid при импорте обновляет запись, поэтому проверка уникальности не нужна
+
+    class Meta(CollectibleItemSerializer.Meta):
+        extra_kwargs = {'uid': {'validators': []}}
+
+
+
+class NearbyCollectibleItemSerializer(CollectibleItemSerializer):
+    distance = serializers.FloatField(read_only=True)
+
+    class Meta(CollectibleItemSerializer.Meta):
+        fields = CollectibleItemSerializer.Meta.fields + ['distance']
+
+
+
+class NearbyQuerySerializer(serializers.Serializer):
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    radius = serializers.FloatField(min_value=0, max_value=NEARBY_MAX_RADIUS_M)
+    limit = serializers.IntegerField(min_value=1, max_value=NEARBY_MAX_LIMIT, default=NEARBY_LIMIT)
+
+
+
+class ViewportQuerySerializer(serializers.Serializer):
+    # min_lon больше max_lon, если область пересекает 180-й меридиан
+    min_lat = serializers.FloatField(min_value=-90, max_value=90)
+    max_lat = serializers.FloatField(min_value=-90, max_value=90)
+    min_lon = serializers.FloatField(min_value=-180, max_value=180)
+    max_lon = serializers.FloatField(min_value=-180, max_value=180)
+    limit = serializers.IntegerField(min_value=1, max_value=VIEWPORT_MAX_LIMIT, default=VIEWPORT_LIMIT)
+
+    def validate(self, data):
+        if data['min_lat'] > data['max_lat']:
+            raise serializers.ValidationError({'min_lat': 'min_lat не может быть больше max_lat'})
+        return data
+
+
+
+class LeaderboardQuerySerializer(serializers.Serializer):
+    # date — любой день периода, по умолчанию сегодня; coach — рейтинг только среди атлетов тренера
+    window = serializers.ChoiceField(choices=LeaderboardScore.Window.choices, default=LeaderboardScore.Window.ALL)
+    date = serializers.DateField(required=False)
+    coach = serializers.IntegerField(min_value=1, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=LEADERBOARD_MAX_LIMIT, default=LEADERBOARD_LIMIT)
+
+
+
+class UserSuggestQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=100)
+    limit = serializers.IntegerField(min_value=1, max_value=SUGGEST_MAX_LIMIT, default=SUGGEST_LIMIT)
+
+
+
 class UserCollectiblesSerializer(UserSerializer):
     items = CollectibleItemSerializer(many=True, read_only=True, default=[], source='collectibles')
 
@@ -99,8 +190,7 @@ class AthletesSubscriptionsSerializer(UserCollectiblesSerializer):
         fields = UserCollectiblesSerializer.Meta.fields + ['coach']
 
     def get_coach(self, obj):
-        sub = Subscribe.objects.filter(athlete_id=obj.id).last()
-        return sub.coach_id if sub else None
+        return obj.last_coach_id
 
 
 
@@ -112,12 +202,44 @@ class CoachFollowersSerializer(UserCollectiblesSerializer):
         fields = UserCollectiblesSerializer.Meta.fields + ['athletes']
 
     def get_athletes(self, obj):
-        athletes = Subscribe.objects.filter(coach_id=obj.id).values_list('athlete_id', flat=True)
-        return list(athletes)
+        return [subscribe.athlete_id for subscribe in obj.follower_subscriptions]
+
+
+
+class UserExpandSerializer(UserCollectiblesSerializer):
+    # Поля coach, athletes и items выводятся только если перечислены в ?expand=
+    EXPANDABLE_FIELDS = ['items', 'coach', 'athletes']
+
+    coach = serializers.SerializerMethodField()
+    athletes = serializers.SerializerMethodField()
+
+    class Meta(UserCollectiblesSerializer.Meta):
+        model = User
+        fields = UserCollectiblesSerializer.Meta.fields + ['coach', 'athletes']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = self.context.get('expand', [])
+        for name in self.EXPANDABLE_FIELDS:
+            if name not in expand:
+                self.fields.pop(name)
+
+    def get_coach(self, obj):
+        return obj.last_coach_id
+
+    def get_athletes(self, obj):
+        return [subscribe.athlete_id for subscribe in obj.follower_subscriptions]
 
 
 
 class SubscribeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscribe
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = '__all__'
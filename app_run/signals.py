@@ -0,0 +1,86 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Run, Challenge, Subscribe, CollectibleItem
+from .caching import USERS, CHALLENGES, COLLECTIBLE_ITEMS, ANALYTICS, invalidate
+from .leaderboards import record_collected, remove_finished_run, subscription_changed, remove_athlete_scores
+from .analytics import remove_athlete_run
+from .search import index_users
+
+
+# Сброс кэша ответов при изменении данных. Массовые операции (bulk_create, update) сигналов не шлют,
+# поэтому там, где они используются, invalidate вызывается явно — как для AthleteStats в analytics.py
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, update_fields=None, **kwargs):
+    # Вход пользователя обновляет только last_login, который ни в одном ответе не участвует
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    invalidate(USERS, CHALLENGES)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    # До каскада: строки таблиц лидеров удаляются быстрым DELETE без сигналов, счётчики убираются заранее
+    remove_athlete_scores(instance.id)
+
+
+@receiver(post_save, sender=User)
+def user_name_changed(sender, instance, update_fields=None, **kwargs):
+    # Слова для поиска пересобираются, только если могли измениться имя или фамилия
+    if update_fields is None or {'first_name', 'last_name'} & set(update_fields):
+        index_users([instance])
+
+
+@receiver([post_save, post_delete], sender=Run)
+def run_changed(sender, **kwargs):
+    invalidate(USERS)
+
+
+@receiver(post_delete, sender=Run)
+def finished_run_deleted(sender, instance, **kwargs):
+    # Завершённый забег уже учтён в AthleteStats и таблицах лидеров при остановке — его вклад вычитается
+    if instance.status == Run.Status.FINISHED:
+        remove_athlete_run(instance)
+        remove_finished_run(instance)
+
+
+@receiver([post_save, post_delete], sender=Challenge)
+def challenge_changed(sender, **kwargs):
+    invalidate(CHALLENGES)
+
+
+@receiver([post_save, post_delete], sender=Subscribe)
+def subscribe_changed(sender, **kwargs):
+    invalidate(USERS, ANALYTICS)
+
+
+@receiver(post_save, sender=Subscribe)
+def subscribed(sender, instance, created, **kwargs):
+    if created:
+        subscription_changed(instance.athlete_id, instance.coach_id, True)
+
+
+@receiver(pre_delete, sender=Subscribe)
+def unsubscribing(sender, instance, **kwargs):
+    subscription_changed(instance.athlete_id, instance.coach_id, False)
+
+
+@receiver([post_save, post_delete], sender=CollectibleItem)
+def collectible_item_changed(sender, **kwargs):
+    invalidate(COLLECTIBLE_ITEMS, USERS)
+
+
+@receiver(m2m_changed, sender=CollectibleItem.athletes.through)
+def collectibles_collected(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate(USERS)
+    # pk_set в post_add содержит только реально добавленные связи, повторный сбор очков не даёт
+    if action == 'post_add' and pk_set:
+        if reverse:
+            record_collected(instance.id, pk_set)
+        else:
+            for user_id in pk_set:
+                record_collected(user_id, [instance.id])
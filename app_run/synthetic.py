@@ -0,0 +1,268 @@
+from datetime import datetime, time, timedelta, timezone
+
+import numpy as np
+from django.db import connection, transaction
+
+from .models import User, Run, Position, Subscribe, Challenge, CollectibleItem
+from .geo import EARTH_RADIUS_M
+from .track import position_steps, restart_cumsum
+from .challenges import CHALLENGE_RULES
+from .analytics import rebuild_athlete_stats, rebuild_coach_stats
+from .leaderboards import rebuild_leaderboards
+from .search import index_users
+from .caching import USERS, CHALLENGES, COLLECTIBLE_ITEMS, invalidate
+
+
+# Синтетические данные для нагрузочных тестов. Всё случайное берётся из одного генератора numpy,
+# поэтому при тех же seed, параметрах и end данные совпадают. Точки генерируются массивами сразу для пачки
+# забегов и пишутся executemany без создания объектов Position; speed, distance и агрегаты забегов
+# считаются так же, как при приёме точек через API
+
+CITIES = [(55.7558, 37.6173), (59.9386, 30.3141), (55.7963, 49.1088), (56.8389, 60.6057), (54.9833, 82.8964)]
+FIRST_NAMES = ['Иван', 'Пётр', 'Анна', 'Мария', 'Олег', 'Елена', 'Сергей', 'Ольга', 'Дмитрий', 'Наталья',
+               'Alex', 'John', 'Kate', 'Maria', 'Ivan', 'Olga', 'Sergey', 'Nina', 'Paul', 'Emma']
+LAST_NAMES = ['Иванов', 'Петров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов', 'Новиков',
+              'Морозов', 'Smith', 'Brown', 'Ivanov', 'Petrov', 'Wilson', 'Taylor', 'Clark', 'Lewis', 'Walker', 'Young']
+ITEM_NAMES = ['Флаг', 'Кубок', 'Медаль', 'Звезда', 'Монета', 'Кристалл']
+# Доля атлетов, у которых последний забег ещё идёт
+IN_PROGRESS_SHARE = 0.1
+POSITION_COLUMNS = ['latitude', 'longitude', 'date_time', 'speed', 'distance', 'run_id']
+METERS_PER_DEGREE = EARTH_RADIUS_M * np.pi / 180
+
+
+def username_prefix(seed):
+    return f'synthetic_{seed}_'
+
+
+def datetime_values(timestamps):
+    # SQLite хранит моменты строкой 'YYYY-MM-DD HH:MM:SS' в UTC — для целых секунд её можно собрать numpy
+    # сразу для всей пачки, это половина времени вставки точек. Остальные базы получают значения через ORM
+    if connection.vendor == 'sqlite':
+        text = np.datetime_as_string(timestamps.astype(np.int64).astype('datetime64[s]'), unit='s')
+        return np.char.replace(text, 'T', ' ').tolist()
+    adapt = connection.ops.adapt_datetimefield_value
+    return [adapt(datetime.fromtimestamp(moment, timezone.utc)) for moment in timestamps.tolist()]
+
+
+
+class Generator:
+
+    def __init__(self, seed=0, athletes=1000, coaches=50, coaches_per_athlete=2, runs=20, positions=200,
+                 items=5000, end=None, days=90, batch_size=100_000, log=None):
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.athletes = athletes
+        self.coaches = coaches
+        self.coaches_per_athlete = coaches_per_athlete
+        self.runs = runs
+        self.positions = positions
+        self.items = items
+        self.end = datetime.combine(end or datetime.now(timezone.utc).date(), time(), tzinfo=timezone.utc)
+        self.days = days
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.counts = {'users': 0, 'subscribes': 0, 'runs': 0, 'positions': 0, 'collectible_items': 0,
+                       'collected': 0, 'challenges': 0}
+
+    def make_users(self, count, is_staff, first_index):
+        prefix = username_prefix(self.seed)
+        first_names = self.rng.integers(len(FIRST_NAMES), size=count)
+        last_names = self.rng.integers(len(LAST_NAMES), size=count)
+        joined = self.rng.uniform(self.days, self.days + 365, size=count)
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}{first_index + index}', password='!', is_staff=is_staff,
+                 first_name=FIRST_NAMES[first_name], last_name=LAST_NAMES[last_name],
+                 date_joined=self.end - timedelta(days=float(days)))
+            for index, (first_name, last_name, days) in enumerate(zip(first_names, last_names, joined))
+        ], batch_size=5000)
+        index_users(users)
+        self.counts['users'] += len(users)
+        return users
+
+    def make_subscribes(self, athletes, coaches):
+        if not coaches:
+            return
+        subscribes = []
+        for athlete in athletes:
+            count = self.rng.integers(self.coaches_per_athlete + 1)
+            for coach_index in self.rng.choice(len(coaches), size=min(count, len(coaches)), replace=False):
+                rating = int(self.rng.integers(1, 6)) if self.rng.random() < 0.6 else None
+                subscribes.append(Subscribe(athlete=athlete, coach=coaches[coach_index], rating=rating))
+        Subscribe.objects.bulk_create(subscribes, batch_size=5000)
+        self.counts['subscribes'] += len(subscribes)
+
+    def plan_runs(self, athletes):
+        # Забеги без точек: у каждого атлета свой город, старт и продолжительность — случайные
+        runs, homes = [], []
+        for athlete in athletes:
+            home = CITIES[self.rng.integers(len(CITIES))]
+            starts = np.sort(self.rng.uniform(0, self.days * 86400, size=self.runs))
+            in_progress = self.rng.random() < IN_PROGRESS_SHARE
+            for index, offset in enumerate(starts):
+                status = Run.Status.IN_PROGRESS if in_progress and index == self.runs - 1 else Run.Status.FINISHED
+                # Целые секунды, чтобы интервалы между точками были ровно теми, что сгенерированы
+                created_at = self.end - timedelta(days=self.days) + timedelta(seconds=int(offset))
+                runs.append(Run(athlete=athlete, status=status, comment='', created_at=created_at))
+                homes.append(home)
+        return runs, homes
+
+    def tracks(self, runs, homes):
+        # Случайное блуждание: курс плавно меняется, темп у каждого забега свой, точка раз в 3-10 секунд
+        lengths = np.maximum(self.rng.integers(self.positions // 2, self.positions * 3 // 2 + 1, size=len(runs)), 1)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        total = int(lengths.sum())
+        run_index = np.repeat(np.arange(len(runs)), lengths)
+
+        origin = np.array(homes) + self.rng.normal(0, 0.02, size=(len(runs), 2))
+        pace = self.rng.normal(3.0, 0.5, size=len(runs)).clip(1.5, 6)
+        seconds = self.rng.integers(3, 11, size=total).astype(float)
+        seconds[starts] = 0
+        turns = self.rng.normal(0, 0.3, size=total)
+        turns[starts] = self.rng.uniform(0, 2 * np.pi, size=len(runs))
+        heading = restart_cumsum(turns, starts)
+        step = pace[run_index] * seconds * self.rng.normal(1, 0.1, size=total).clip(0.5, 1.5)
+
+        north = restart_cumsum(step * np.cos(heading), starts) / METERS_PER_DEGREE
+        east = restart_cumsum(step * np.sin(heading), starts) / METERS_PER_DEGREE
+        latitudes = np.round(origin[run_index, 0] + north, 4)
+        longitudes = np.round(origin[run_index, 1] + east / np.cos(np.radians(origin[run_index, 0])), 4)
+        created = np.array([run.created_at.timestamp() for run in runs])
+        timestamps = created[run_index] + restart_cumsum(seconds, starts)
+        return run_index, starts, latitudes, longitudes, timestamps
+
+    def finish_runs(self, runs, starts, speeds, exact, timestamps):
+        ends = np.append(starts[1:], len(speeds)) - 1
+        speed_sums = np.add.reduceat(speeds, starts)
+        for run, first, last, speed_sum in zip(runs, starts, ends, speed_sums):
+            run.positions_count = int(last - first + 1)
+            run.positions_distance = float(exact[last])
+            run.speed_sum = float(speed_sum)
+            run.first_position_at = datetime.fromtimestamp(timestamps[first], timezone.utc)
+            run.last_position_at = datetime.fromtimestamp(timestamps[last], timezone.utc)
+            if run.status == Run.Status.FINISHED:
+                # Те же итоги, что считает ingest.finish_run
+                run.distance = run.positions_distance
+                run.speed = round(run.speed_sum / run.positions_count, 2)
+                run.run_time_seconds = int((run.last_position_at - run.first_position_at).total_seconds())
+
+    def insert_runs(self, runs):
+        # bulk_create заполняет auto_now_add текущим временем, поэтому даты в прошлом
+        # возвращаются вторым запросом, не трогая поле модели
+        created = [run.created_at for run in runs]
+        runs = Run.objects.bulk_create(runs, batch_size=5000)
+        for run, created_at in zip(runs, created):
+            run.created_at = created_at
+        Run.objects.bulk_update(runs, ['created_at'], batch_size=1000)
+        return runs
+
+    def insert_positions(self, runs, run_index, latitudes, longitudes, timestamps, speeds, distances):
+        run_ids = np.array([run.id for run in runs])[run_index].tolist()
+        moments = datetime_values(timestamps)
+        rows = zip(latitudes.tolist(), longitudes.tolist(), moments, speeds.tolist(), distances.tolist(), run_ids)
+
+        table = connection.ops.quote_name(Position._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(column) for column in POSITION_COLUMNS)
+        placeholders = ', '.join(['%s'] * len(POSITION_COLUMNS))
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', list(rows))
+        self.counts['positions'] += len(moments)
+
+    def place_items(self, count, runs, run_index, latitudes, longitudes):
+        # Предметы лежат на маршрутах, завершившие забег атлеты собирают их примерно в половине случаев
+        if not count:
+            return
+        picked = self.rng.choice(len(latitudes), size=count, replace=False)
+        first_id = self.counts['collectible_items']
+        items = CollectibleItem.objects.bulk_create([
+            CollectibleItem(
+                name=ITEM_NAMES[self.rng.integers(len(ITEM_NAMES))],
+                uid=f'{username_prefix(self.seed)}{first_id + index}',
+                latitude=round(float(latitudes[point]), 4),
+                longitude=round(float(longitudes[point]), 4),
+                picture=f'https://example.com/items/{self.seed}/{first_id + index}.png',
+                value=int(self.rng.integers(1, 101)),
+            )
+            for index, point in enumerate(picked)
+        ], batch_size=5000)
+
+        links = {
+            (item.id, runs[run_index[point]].athlete_id)
+            for item, point in zip(items, picked)
+            if runs[run_index[point]].status == Run.Status.FINISHED and self.rng.random() < 0.5
+        }
+        through = CollectibleItem.athletes.through
+        through.objects.bulk_create(
+            [through(collectibleitem_id=item_id, user_id=user_id) for item_id, user_id in links], batch_size=5000
+        )
+        self.counts['collectible_items'] += len(items)
+        self.counts['collected'] += len(links)
+
+    def award_challenges(self, runs):
+        # Челленджи по тем же правилам, что и при завершении забега, по итогам всех забегов атлета
+        challenges = {}
+        stats = {}
+        for run in runs:
+            if run.status != Run.Status.FINISHED:
+                continue
+            athlete_stats = stats.setdefault(run.athlete_id, {'finished_runs': 0, 'total_distance': 0})
+            athlete_stats['finished_runs'] += 1
+            athlete_stats['total_distance'] += run.distance
+            for rule in CHALLENGE_RULES:
+                if rule.matches(athlete_stats, run):
+                    challenges[(rule.full_name, run.athlete_id)] = Challenge(full_name=rule.full_name,
+                                                                            athlete_id=run.athlete_id)
+        Challenge.objects.bulk_create(challenges.values(), batch_size=5000, ignore_conflicts=True)
+        self.counts['challenges'] += len(challenges)
+
+    def generate_runs(self, athletes):
+        # Атлеты обрабатываются пачками так, чтобы в пачке было около batch_size точек
+        per_batch = max(1, self.batch_size // max(1, self.runs * self.positions))
+        total_positions = self.athletes * self.runs * self.positions
+        placed = 0
+        for first in range(0, len(athletes), per_batch):
+            with transaction.atomic():
+                runs, homes = self.plan_runs(athletes[first:first + per_batch])
+                if not runs:
+                    continue
+                run_index, starts, latitudes, longitudes, timestamps = self.tracks(runs, homes)
+                # Те же speed и distance, что при приёме точек, сразу для всех забегов пачки
+                speeds, distances, exact = position_steps(latitudes, longitudes, timestamps, starts=starts)
+                self.finish_runs(runs, starts, speeds, exact, timestamps)
+                runs = self.insert_runs(runs)
+                self.insert_positions(runs, run_index, latitudes, longitudes, timestamps, speeds, distances)
+
+                # Предметы распределяются по пачкам пропорционально уже созданным точкам
+                target = round(self.items * min(1, self.counts['positions'] / max(1, total_positions)))
+                if first + per_batch >= len(athletes):
+                    target = self.items
+                count = max(0, min(target - placed, len(latitudes)))
+                self.place_items(count, runs, run_index, latitudes, longitudes)
+                placed += count
+                self.award_challenges(runs)
+            self.counts['runs'] += len(runs)
+            self.log(f'Атлетов {min(first + per_batch, len(athletes))}/{len(athletes)}, '
+                     f'забегов {self.counts["runs"]}, точек {self.counts["positions"]}')
+
+    def generate(self):
+        with transaction.atomic():
+            coaches = self.make_users(self.coaches, True, 0)
+            athletes = self.make_users(self.athletes, False, self.coaches)
+            self.make_subscribes(athletes, coaches)
+        self.generate_runs(athletes)
+
+        # Производные таблицы пересчитываются целиком, как это делают команды rebuild_*
+        rebuild_athlete_stats()
+        rebuild_coach_stats()
+        rebuild_leaderboards()
+        invalidate(USERS, CHALLENGES, COLLECTIBLE_ITEMS)
+        return self.counts
+
+
+def clear(seed):
+    # Точки удаляются одним DELETE (у Position нет сигналов), остальное — каскадом от пользователей
+    prefix = username_prefix(seed)
+    users = User.objects.filter(username__startswith=prefix)
+    Position.objects.filter(run__athlete__in=users).delete()
+    CollectibleItem.objects.filter(uid__startswith=prefix).delete()
+    deleted, _ = users.delete()
+    return deleted
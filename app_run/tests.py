@@ -1,3 +1,1442 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import random
+import re
+import zipfile
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
+from xml.etree import ElementTree
 
-# Create your tests here.
+import brotli
+import msgpack
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Avg, Sum, Min, Max, Count
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from haversine import haversine, Unit
+from openpyxl import Workbook, load_workbook
+
+from .benchmarks import run_benchmarks, uncovered_routes
+from .synthetic import Generator
+from .models import (
+    Run, User, Position, Challenge, CollectibleItem, PackedTrack, AthleteStats, LeaderboardScore, LeaderboardCount,
+    Subscribe, UserSearchToken, CoachStats
+)
+from .leaderboards import Board, Window, add_scores, athlete_rank, top, scores, rebuild_counts
+from .ingest import stop_run
+from .analytics import coach_leaders
+from .search import TokenSearch, index_users, search_users
+from .track import track_arrays, measure_track
+from .geo import NEARBY_MAX_RADIUS_M
+from .importers import import_collectible_items
+from .packing import EPOCH, pack_run, pack_rows
+from .renderers import TRACK_HEADER, POSITION_RECORD
+from .exporters import EXPORT_DATETIME_FORMAT
+from .fast_serializers import FastListSerializer
+from .live import LocalBroker
+
+
+START = datetime(2024, 5, 1, 8, 0, tzinfo=timezone.utc)
+
+
+def fix(index, latitude=55.7558, longitude=37.6173):
+    return {'latitude': round(latitude + index * 0.001, 4), 'longitude': longitude,
+            'date_time': (START + timedelta(seconds=index * 10)).isoformat()}
+
+
+
+class EndpointBudgetTests(TestCase):
+    # Задержку на общем CI проверяет команда benchmark_endpoints, здесь — только запросы и статусы
+
+    def test_every_route_has_scenario(self):
+        self.assertEqual(uncovered_routes(), [])
+
+    def test_endpoints_within_budgets(self):
+        report = run_benchmarks(sizes=[1, 4], repeat=3, warmup=1)
+        violations = [item for item in report['violations'] if item['metric'] in ('status', 'queries', 'query_growth')]
+        self.assertEqual(violations, [])
+
+
+
+class GeneratorTests(TestCase):
+
+    def test_runs_keep_planned_created_at(self):
+        Generator(seed=7, athletes=2, coaches=1, runs=3, positions=4, items=2, end=date(2024, 6, 1), days=10).generate()
+
+        created = list(Run.objects.values_list('created_at', flat=True))
+        self.assertEqual(len(created), 6)
+        first, last = datetime(2024, 5, 22, tzinfo=timezone.utc), datetime(2024, 6, 1, tzinfo=timezone.utc)
+        self.assertTrue(all(first <= moment < last for moment in created))
+        # Поле модели не меняется: обычные забеги по-прежнему получают текущее время
+        self.assertTrue(Run._meta.get_field('created_at').auto_now_add)
+        before = datetime.now(timezone.utc)
+        run = Run.objects.create(athlete=User.objects.create(username='athlete'))
+        self.assertGreaterEqual(run.created_at, before)
+
+    def test_distances_match_track(self):
+        Generator(seed=3, athletes=2, coaches=0, runs=2, positions=40, items=0, end=date(2024, 6, 1)).generate()
+        for run in Run.objects.filter(status=Run.Status.FINISHED):
+            positions = list(run.position.order_by('id'))
+            self.assertAlmostEqual(run.distance, walk_distance(positions), delta=1e-6)
+            self.assertEqual(positions[-1].distance, round(run.distance, 2))
+
+
+
+def walk_distance(positions):
+    # Дистанция, как её считал прежний StopAPIView: haversine по соседним точкам в порядке id
+    cords = [(position.latitude, position.longitude) for position in positions]
+    return sum(haversine(a, b) for a, b in zip(cords, cords[1:]))
+
+
+
+class MigrationTestCase(TransactionTestCase):
+    # Откатывает app_run до migrate_from, а в конце возвращает схему к последней миграции
+    migrate_from = None
+    migrate_to = None
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('app_run', target)])
+        executor.loader.build_graph()
+        return executor.loader.project_state([('app_run', target)]).apps
+
+    def setUp(self):
+        self.old_apps = self.migrate(self.migrate_from)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+
+
+class RunAggregatesTests(TestCase):
+    # Накопленные на Run агрегаты должны давать то же, что прежние Avg, Min/Max и обход точек при остановке
+
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.fixes = [fix(index, longitude=37.6173 + (index % 3) * 0.0007) for index in range(12)]
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type='application/json')
+
+    def assert_matches_positions(self, run):
+        run.refresh_from_db()
+        positions = list(run.position.order_by('id'))
+        expected = run.position.aggregate(
+            count=Count('id'), speed_sum=Sum('speed'), first=Min('date_time'), last=Max('date_time'), avg=Avg('speed')
+        )
+        self.assertEqual(run.positions_count, expected['count'])
+        self.assertAlmostEqual(run.speed_sum, expected['speed_sum'])
+        self.assertEqual(run.first_position_at, expected['first'])
+        self.assertEqual(run.last_position_at, expected['last'])
+        # Дистанция копится без округления, до сотых округляется только distance точки
+        self.assertAlmostEqual(run.positions_distance, walk_distance(positions), delta=1e-9)
+        self.assertEqual(positions[-1].distance, round(run.positions_distance, 2))
+
+        self.assertTrue(stop_run(run))
+        run.refresh_from_db()
+        self.assertEqual(run.speed, round(expected['avg'], 2))
+        self.assertEqual(run.run_time_seconds, int((expected['last'] - expected['first']).total_seconds()))
+        self.assertAlmostEqual(run.distance, walk_distance(positions), delta=1e-9)
+
+    def test_single_positions(self):
+        run = Run.objects.create(athlete=self.athlete, status=Run.Status.IN_PROGRESS)
+        for data in self.fixes:
+            self.assertEqual(self.post(reverse('position-list'), {'run': run.id, **data}).status_code, 201)
+        self.assert_matches_positions(run)
+
+    def test_batches(self):
+        run = Run.objects.create(athlete=self.athlete, status=Run.Status.IN_PROGRESS)
+        batches = [(reverse('position-batch'), self.fixes[:5]), (reverse('async_positions_batch'), self.fixes[5:])]
+        for url, fixes in batches:
+            self.assertEqual(self.post(url, {'run': run.id, 'positions': fixes}).status_code, 201)
+        self.assert_matches_positions(run)
+
+    def test_short_steps_do_not_accumulate_rounding(self):
+        # Шаг 0.0001° долготы на широте 55.7 — около 6.3 м: округлённым до сотых км он считался бы за 10 м
+        run = Run.objects.create(athlete=self.athlete, status=Run.Status.IN_PROGRESS)
+        fixes = [{'latitude': 55.7, 'longitude': round(37.6 + index * 0.0001, 4),
+                  'date_time': (START + timedelta(seconds=index)).isoformat()} for index in range(200)]
+        for first in range(0, len(fixes), 50):
+            self.post(reverse('position-batch'), {'run': run.id, 'positions': fixes[first:first + 50]})
+        run.refresh_from_db()
+        self.assertTrue(stop_run(run))
+        run.refresh_from_db()
+        expected = haversine((55.7, 37.6), (55.7, 37.6199))
+        self.assertAlmostEqual(run.distance, expected, delta=1e-6)
+        self.assertAlmostEqual(expected, 1.247, delta=0.001)
+        self.assertEqual(run.position.order_by('id').last().distance, round(expected, 2))
+
+    def test_update_and_delete_recount_aggregates(self):
+        run = Run.objects.create(athlete=self.athlete, status=Run.Status.IN_PROGRESS)
+        other = Run.objects.create(athlete=self.athlete, status=Run.Status.IN_PROGRESS)
+        self.post(reverse('position-batch'), {'run': run.id, 'positions': self.fixes})
+        positions = list(run.position.order_by('id'))
+
+        self.client.delete(reverse('position-detail', args=[positions[-1].id]))
+        run.refresh_from_db()
+        self.assertEqual(run.positions_count, len(positions) - 1)
+        self.assertAlmostEqual(run.positions_distance, walk_distance(positions[:-1]), delta=1e-9)
+        self.assertEqual(run.last_position_at, positions[-2].date_time)
+
+        moved = positions[0]
+        response = self.client.patch(reverse('position-detail', args=[moved.id]), {'run': other.id},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        run.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((run.positions_count, other.positions_count), (len(positions) - 2, 1))
+        self.assertAlmostEqual(run.speed_sum, sum(position.speed for position in positions[1:-1]))
+        self.assertAlmostEqual(run.positions_distance, walk_distance(positions[1:-1]), delta=1e-9)
+        self.assertEqual((other.positions_distance, other.first_position_at), (0, moved.date_time))
+
+
+
+class PositionAggregatesMigrationTests(MigrationTestCase):
+    migrate_from = '0017_collectibleitem_app_run_col_latitud_6db97c_idx'
+    migrate_to = '0018_run_position_aggregates'
+
+    def test_backfill(self):
+        OldUser = self.old_apps.get_model('auth', 'User')
+        OldRun = self.old_apps.get_model('app_run', 'Run')
+        OldPosition = self.old_apps.get_model('app_run', 'Position')
+        athlete = OldUser.objects.create(username='athlete')
+        run = OldRun.objects.create(athlete=athlete, status='in_progress')
+        empty = OldRun.objects.create(athlete=athlete, status='init')
+        OldPosition.objects.bulk_create([
+            OldPosition(run=run, latitude=55.75, longitude=37.61, date_time=START + timedelta(seconds=20),
+                        speed=2.5, distance=0.05),
+            OldPosition(run=run, latitude=55.74, longitude=37.61, date_time=START, speed=0, distance=0),
+            OldPosition(run=run, latitude=55.76, longitude=37.61, date_time=START + timedelta(seconds=40),
+                        speed=3.5, distance=0.11),
+        ])
+
+        new_apps = self.migrate(self.migrate_to)
+        NewRun = new_apps.get_model('app_run', 'Run')
+        run = NewRun.objects.get(id=run.id)
+        self.assertEqual(run.positions_count, 3)
+        self.assertEqual(run.speed_sum, 6)
+        self.assertEqual(run.first_position_at, START)
+        self.assertEqual(run.last_position_at, START + timedelta(seconds=40))
+        # Обход в порядке id без округления шагов
+        expected = haversine((55.75, 37.61), (55.74, 37.61)) + haversine((55.74, 37.61), (55.76, 37.61))
+        self.assertAlmostEqual(run.positions_distance, expected, delta=1e-9)
+
+        empty = NewRun.objects.get(id=empty.id)
+        self.assertEqual((empty.positions_count, empty.speed_sum, empty.first_position_at), (0, 0, None))
+
+
+
+class MeasureTrackTests(SimpleTestCase):
+    # Векторизованный measure_track против поточечного обхода через haversine
+
+    def setUp(self):
+        # Шаги разной длины и остановка: точки 6 и 7 совпадают
+        self.cords = [(55.75 + index * 0.0015 + (index % 4) * 0.0002, 37.61 + (index % 3) * 0.0004)
+                      for index in range(14)]
+        self.cords[7] = self.cords[6]
+        self.times = [START + timedelta(seconds=index * 30 + (index % 2) * 5) for index in range(14)]
+
+    def loop(self, moving_speed, split_distance):
+        segments, speeds, moving_time, splits = [], [], 0, []
+        total, mark, previous_split = 0, split_distance, 0
+        for (a, b), (start, end) in zip(zip(self.cords, self.cords[1:]), zip(self.times, self.times[1:])):
+            distance = haversine(a, b, unit=Unit.METERS)
+            seconds = (end - start).total_seconds()
+            speed = distance / seconds
+            segments.append(distance)
+            speeds.append(speed)
+            if speed >= moving_speed:
+                moving_time += seconds
+            while distance and total + distance >= mark:
+                crossed = (start - self.times[0]).total_seconds() + seconds * (mark - total) / distance
+                splits.append(crossed - previous_split)
+                previous_split, mark = crossed, mark + split_distance
+            total += distance
+        return segments, speeds, moving_time, splits
+
+    def test_matches_haversine_loop(self):
+        metrics = measure_track(*track_arrays(self.cords, self.times), moving_speed=0.5, split_distance=500)
+        segments, speeds, moving_time, splits = self.loop(0.5, 500)
+
+        self.assertEqual(len(metrics.segment_distances), len(segments))
+        for actual, expected in zip(metrics.segment_distances, segments):
+            self.assertAlmostEqual(actual, expected, delta=0.01)
+        self.assertAlmostEqual(metrics.cumulative_distance[-1], sum(segments), delta=0.1)
+        for actual, expected in zip(metrics.speeds, speeds):
+            self.assertAlmostEqual(actual, expected, places=3)
+        self.assertEqual(metrics.moving_time, moving_time)
+        self.assertEqual(len(metrics.splits), len(splits))
+        self.assertGreater(len(splits), 2)
+        for actual, expected in zip(metrics.splits, splits):
+            self.assertAlmostEqual(actual, expected, places=2)
+
+    def test_short_tracks(self):
+        empty = measure_track(*track_arrays([], []))
+        self.assertEqual((len(empty.segment_distances), len(empty.splits), empty.moving_time), (0, 0, 0))
+
+        single = measure_track(*track_arrays(self.cords[:1], self.times[:1]))
+        self.assertEqual(list(single.cumulative_distance), [0])
+        self.assertEqual((len(single.splits), single.moving_time), (0, 0))
+
+
+
+class RunMetricsTests(TestCase):
+
+    def test_metrics(self):
+        athlete = User.objects.create(username='athlete')
+        run = Run.objects.create(athlete=athlete, status=Run.Status.FINISHED)
+        response = self.client.get(reverse('run-metrics', args=[run.id]))
+        self.assertEqual(response.json(), {'run': run.id, 'moving_time_seconds': 0, 'splits': []})
+
+        # 0.01 градуса широты — около 1112 м, за 400 с
+        Position.objects.bulk_create([
+            Position(run=run, latitude=55.75, longitude=37.61, date_time=START, speed=0, distance=0),
+            Position(run=run, latitude=55.76, longitude=37.61, date_time=START + timedelta(seconds=400),
+                     speed=2.78, distance=1.11),
+        ])
+        data = self.client.get(reverse('run-metrics', args=[run.id])).json()
+        self.assertEqual(data['moving_time_seconds'], 400)
+        self.assertEqual([split['km'] for split in data['splits']], [1])
+        self.assertAlmostEqual(data['splits'][0]['seconds'], 400 * 1000 / 1111.95, delta=0.2)
+
+
+
+class SimplifiedTrackTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=athlete, status=Run.Status.FINISHED)
+        # Угол: 20 шагов по 111 м на север, затем 19 шагов по 100 м на восток
+        self.positions = make_track(self.run, 40)
+        for index, position in enumerate(self.positions[21:], start=1):
+            Position.objects.filter(id=position.id).update(latitude=self.positions[20].latitude,
+                                                           longitude=Decimal('37.61') + Decimal('0.0016') * index)
+
+    def simplified(self, **params):
+        response = self.client.get(reverse('position-list'), {'run': self.run.id, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_tolerance(self):
+        found = self.simplified(simplify=50)
+        self.assertEqual([position['id'] for position in found],
+                         [self.positions[index].id for index in (0, 20, 39)])
+        full = self.client.get(reverse('position-list'), {'run': self.run.id}).json()
+        self.assertEqual(found[1], full[20])
+
+    def test_max_points(self):
+        for max_points in (2, 3, 10, 100):
+            found = [position['id'] for position in self.simplified(max_points=max_points)]
+            self.assertLessEqual(len(found), max_points)
+            self.assertEqual((found[0], found[-1]), (self.positions[0].id, self.positions[-1].id))
+        self.assertIn(self.positions[20].id, [position['id'] for position in self.simplified(max_points=3)])
+        self.assertEqual(len(self.simplified(max_points=40)), 40)
+
+    def test_finished_run_cached(self):
+        first = self.simplified(simplify=50)
+        Position.objects.filter(run=self.run).update(longitude=Decimal('37.61'))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.simplified(simplify=50), first)
+
+        # Трек забега в процессе ещё меняется и считается заново
+        Run.objects.filter(id=self.run.id).update(status=Run.Status.IN_PROGRESS)
+        self.assertEqual(len(self.simplified(simplify=50)), 2)
+
+    def test_invalid_parameters(self):
+        for params in ({'simplify': 'x'}, {'simplify': -1}, {'max_points': 1}, {'max_points': 'x'}):
+            response = self.client.get(reverse('position-list'), {'run': self.run.id, **params})
+            self.assertEqual(response.status_code, 400)
+
+
+
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.coach = User.objects.create(username='coach', is_staff=True)
+        self.athlete = User.objects.create(username='athlete')
+        self.url = reverse('user-list')
+
+    def runs_finished(self, response):
+        return {user['id']: user['runs_finished'] for user in response.json()}[self.athlete.id]
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertIn('Last-Modified', response)
+
+        # Повтор и условные запросы обслуживаются из кэша без обращений к базе
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).content, response.content)
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+                             304)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+        # ETag зависит от формата ответа
+        api = self.client.get(self.url, {'format': 'api'})
+        self.assertNotEqual(api['ETag'], response['ETag'])
+
+    def test_write_invalidates_after_commit(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.runs_finished(response), 0)
+
+        run = Run.objects.create(athlete=self.athlete, status=Run.Status.IN_PROGRESS)
+        with self.captureOnCommitCallbacks() as callbacks:
+            stop_run(run)
+        # До коммита ответ ещё прежний: сброс откладывается, чтобы не закэшировать незакоммиченное
+        self.assertEqual(self.client.get(self.url).content, response.content)
+        for callback in callbacks:
+            callback()
+
+        fresh = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(self.runs_finished(fresh), 1)
+        self.assertNotEqual(fresh['ETag'], response['ETag'])
+
+    def test_namespaces(self):
+        analytics_url = reverse('analytics_for_coach', args=[self.coach.id])
+        items_url = reverse('collectibleitem-list')
+        self.assertEqual(self.client.get(analytics_url).json(), {})
+        self.assertEqual(self.client.get(items_url).json(), [])
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscribe.objects.create(athlete=self.athlete, coach=self.coach)
+        self.assertEqual(self.client.get(analytics_url).json()['total_run_user'], self.athlete.id)
+        self.assertEqual(self.client.get(items_url).json(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CollectibleItem.objects.create(name='Монета', uid='coin', value=1, latitude=1, longitude=1,
+                                           picture='https://example.com/coin.png')
+        self.assertEqual(len(self.client.get(items_url).json()), 1)
+        # Предметы входят в профили пользователей, их список тоже перечитывается из базы
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(self.url)
+        self.assertTrue(captured.captured_queries)
+
+    def test_only_successful_reads_cached(self):
+        missing = reverse('user-detail', args=[self.athlete.id + 100])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+        self.assertNotIn('ETag', self.client.get(missing))
+        with self.settings(RESPONSE_CACHE_TIMEOUTS={}):
+            self.assertNotIn('ETag', self.client.get(self.url))
+
+
+
+class AwardChallengesTests(TestCase):
+
+    def test_cumulative_rule_awarded_once(self):
+        athlete = User.objects.create(username='athlete')
+        with mock.patch('app_run.challenges.invalidate') as invalidate:
+            awarded = []
+            for _ in range(12):
+                run = Run.objects.create(athlete=athlete, status=Run.Status.IN_PROGRESS)
+                stop_run(run)
+                awarded.append(invalidate.call_count)
+
+        self.assertEqual(list(Challenge.objects.filter(athlete=athlete).values_list('full_name', flat=True)),
+                         ['Сделай 10 Забегов!'])
+        # Кэш челленджей сбрасывается на десятой остановке и больше не трогается
+        self.assertEqual(awarded, [0] * 9 + [1, 1, 1])
+
+
+
+class CoachLeadersTests(TestCase):
+
+    def test_leaders_ordered_in_database(self):
+        coach = User.objects.create(username='coach', is_staff=True)
+        athletes = [User.objects.create(username=f'athlete{index}') for index in range(4)]
+        stats = [(5.0, 12.0, None), (7.0, 12.0, 3.5), (7.0, 9.0, 2.0)]
+        for athlete, (longest_run, total_distance, avg_speed) in zip(athletes, stats):
+            AthleteStats.objects.create(user=athlete, longest_run=longest_run, total_distance=total_distance,
+                                        avg_speed=avg_speed)
+        for athlete in athletes:
+            Subscribe.objects.create(athlete=athlete, coach=coach)
+        outsider = User.objects.create(username='outsider')
+        AthleteStats.objects.create(user=outsider, longest_run=99, total_distance=99, avg_speed=99)
+
+        with self.assertNumQueries(1):
+            leaders = coach_leaders(coach.id)
+        # При равенстве побеждает меньший id, атлет без статистики не обгоняет никого
+        self.assertEqual(leaders, {
+            'longest_run_user': athletes[1].id, 'longest_run_value': 7.0,
+            'total_run_user': athletes[0].id, 'total_run_value': 12.0,
+            'speed_avg_user': athletes[1].id, 'speed_avg_value': 3.5,
+        })
+
+    def test_without_values_and_without_athletes(self):
+        coach = User.objects.create(username='coach', is_staff=True)
+        self.assertEqual(coach_leaders(coach.id), {})
+        athletes = [User.objects.create(username=f'athlete{index}') for index in range(2)]
+        for athlete in reversed(athletes):
+            Subscribe.objects.create(athlete=athlete, coach=coach)
+        self.assertEqual(coach_leaders(coach.id), {
+            'longest_run_user': athletes[0].id, 'longest_run_value': None,
+            'total_run_user': athletes[0].id, 'total_run_value': None,
+            'speed_avg_user': athletes[0].id, 'speed_avg_value': None,
+        })
+
+
+
+class DeleteFinishedRunTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='athlete')
+        self.runs = []
+        for distance in (3.0, 5.0):
+            run = Run.objects.create(athlete=self.athlete, status=Run.Status.IN_PROGRESS, positions_count=2,
+                                     speed_sum=distance, positions_distance=distance)
+            stop_run(run)
+            self.runs.append(run)
+
+    def runs_finished(self):
+        return self.client.get(reverse('user-detail', args=[self.athlete.id])).json()['runs_finished']
+
+    def test_delete_reverses_counters(self):
+        self.assertEqual(self.runs_finished(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('run-detail', args=[self.runs[1].id]))
+
+        self.assertEqual(self.runs_finished(), 1)
+        stats = AthleteStats.objects.get(user=self.athlete)
+        self.assertEqual((stats.runs_count, stats.total_distance, stats.longest_run, stats.avg_speed), (1, 3, 3, 1.5))
+        scores = LeaderboardScore.objects.filter(user=self.athlete, window=LeaderboardScore.Window.ALL)
+        self.assertEqual(dict(scores.values_list('board', 'count')), {'distance': 1, 'runs': 1, 'speed': 1})
+        self.assertEqual(scores.get(board=LeaderboardScore.Board.DISTANCE).score, 3)
+
+        # Удаление последнего забега убирает строки рейтинга, а не оставляет нули с делением на ноль
+        self.runs[0].delete()
+        self.assertFalse(LeaderboardScore.objects.filter(user=self.athlete).exists())
+        self.assertEqual(AthleteStats.objects.get(user=self.athlete).runs_count, 0)
+
+    def test_deleting_athlete_does_not_recreate_rows(self):
+        self.athlete.delete()
+        self.assertFalse(AthleteStats.objects.exists())
+        self.assertFalse(LeaderboardScore.objects.exists())
+
+    def test_status_is_read_only(self):
+        run = Run.objects.create(athlete=self.athlete, status=Run.Status.INIT)
+        stats = list(AthleteStats.objects.values_list())
+        scores = list(LeaderboardScore.objects.values_list())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(reverse('run-detail', args=[run.id]), {'status': 'finished', 'distance': 99},
+                                         content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'status', 'distance'})
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.distance), (Run.Status.INIT, None))
+        self.assertEqual(self.runs_finished(), 2)
+        self.assertEqual(list(AthleteStats.objects.values_list()), stats)
+        self.assertEqual(list(LeaderboardScore.objects.values_list()), scores)
+
+        response = self.client.patch(reverse('run-detail', args=[run.id]), {'comment': 'утро'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], Run.Status.INIT)
+
+
+
+class UserSearchTests(TestCase):
+    NAMES = [('Иван', 'Петров'), ('Иванна', 'Сидорова'), ('Пётр', 'Иванов'), ('Анна', 'Петрова')]
+
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create(username=f'user{index}', first_name=first_name, last_name=last_name)
+                      for index, (first_name, last_name) in enumerate(self.NAMES)]
+
+    def found(self, query):
+        return [user.id for user in search_users(User.objects.all(), query)]
+
+    def ids(self, *indexes):
+        return [self.users[index].id for index in indexes]
+
+    @skipUnless(TokenSearch.enabled(), 'таблица слов ведётся только не на PostgreSQL')
+    def test_tokens_match_prefixes_of_every_term(self):
+        self.assertEqual(self.found('ИВ'), self.ids(0, 1, 2))
+        self.assertEqual(self.found('ив пет'), self.ids(0))
+        self.assertEqual(self.found('пет ан'), self.ids(3))
+        self.assertEqual(self.found('иван сидор'), self.ids(1))
+        self.assertEqual(self.found('олег'), [])
+        self.assertIsNone(search_users(User.objects.all(), ' ,. '))
+
+    @skipUnless(TokenSearch.enabled(), 'таблица слов ведётся только не на PostgreSQL')
+    def test_whole_words_ranked_first(self):
+        # «иван» целиком у Ивана Петрова (2), у остальных — только префикс (1), при равенстве — по id
+        self.assertEqual(self.found('иван'), self.ids(0, 1, 2))
+        self.assertEqual([user.search_rank for user in search_users(User.objects.all(), 'иван')], [2, 1, 1])
+        self.assertEqual(self.found('петров'), self.ids(0, 3))
+        self.assertEqual(self.found('петрова'), self.ids(3))
+
+    @skipUnless(TokenSearch.enabled(), 'таблица слов ведётся только не на PostgreSQL')
+    def test_rename_reindexes(self):
+        user = self.users[0]
+        user.first_name = 'Олег'
+        user.save(update_fields=['first_name'])
+        self.assertEqual(self.found('олег'), self.ids(0))
+        self.assertEqual(self.found('иван'), self.ids(1, 2))
+
+        # Сохранение без имени и фамилии слова не трогает
+        with mock.patch('app_run.signals.index_users') as index:
+            user.save(update_fields=['email'])
+        index.assert_not_called()
+
+        # bulk_create сигналов не шлёт, такие пользователи индексируются явно
+        created = User.objects.bulk_create([User(username='bulk', first_name='Ивлин', last_name='Во')])
+        self.assertEqual(self.found('ивл'), [])
+        index_users([(created[0].id, 'Ивлин', 'Во')])
+        self.assertEqual(self.found('ивл'), [created[0].id])
+        self.assertEqual(UserSearchToken.objects.filter(user=created[0]).count(), 2)
+
+    def test_suggest(self):
+        response = self.client.get(reverse('user-suggest'), {'q': 'ив пет'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{'id': self.users[0].id, 'full_name': 'Иван Петров', 'type': 'athlete'}])
+
+    @skipUnless(connection.vendor == 'postgresql', 'полнотекстовый поиск и триграммы есть только на PostgreSQL')
+    def test_postgres_search(self):
+        self.assertFalse(TokenSearch.enabled())
+        self.assertEqual(self.found('ив пет'), self.ids(0))
+        self.assertEqual(self.found('иван')[0], self.users[0].id)
+        self.assertEqual(set(self.found('ИВ')), set(self.ids(0, 1, 2)))
+
+
+
+class LeaderboardRankTests(TestCase):
+    board, window, period = Board.DISTANCE, Window.ALL, LeaderboardScore.ALL_PERIOD
+
+    def setUp(self):
+        self.coach = User.objects.create(username='coach', is_staff=True)
+        self.athletes = [User.objects.create(username=f'athlete{index}') for index in range(5)]
+
+    def score(self, athlete, value):
+        add_scores(athlete.id, START.date(), {self.board: (value, 1)})
+
+    def ranks(self, coach_id=None):
+        return [athlete_rank(self.board, self.window, self.period, athlete.id, coach_id)['rank']
+                for athlete in self.athletes]
+
+    def brute_ranks(self, coach_id=None):
+        # Место по определению: атлеты с большим score в сотых плюс один
+        rows = scores(self.board, self.window, self.period, coach_id)
+        keys = {user_id: round(score * 100) for user_id, score in rows.values_list('user_id', 'score')}
+        return [sum(1 for key in keys.values() if key > keys[athlete.id]) + 1 if athlete.id in keys else None
+                for athlete in self.athletes]
+
+    def test_ties(self):
+        # 3.001 и 3.004 показываются как 3.0 и делят место
+        for athlete, value in zip(self.athletes, [5, 3.001, 3.004, 1, 0]):
+            self.score(athlete, value)
+        self.assertEqual(self.ranks(), [1, 2, 2, 4, 5])
+        self.assertEqual([row['rank'] for row in top(self.board, self.window, self.period, 10)], [1, 2, 2, 4, 5])
+
+        response = self.client.get(reverse('leaderboard_rank', args=[self.board, self.athletes[2].id]))
+        self.assertEqual((response.json()['rank'], response.json()['score']), (2, 3.0))
+
+        # Догнавший до сотых делит место
+        self.score(self.athletes[3], 2.001)
+        self.assertEqual(self.ranks(), [1, 2, 2, 2, 5])
+
+    def test_coach_filter(self):
+        for athlete, value in zip(self.athletes, [9, 7, 5, 3, 1]):
+            self.score(athlete, value)
+        Subscribe.objects.create(athlete=self.athletes[1], coach=self.coach)
+        Subscribe.objects.create(athlete=self.athletes[3], coach=self.coach)
+        self.assertEqual(self.ranks(self.coach.id), [None, 1, None, 2, None])
+
+        # Очки после подписки попадают и в рейтинг тренера
+        self.score(self.athletes[3], 10)
+        self.assertEqual(self.ranks(self.coach.id), [None, 2, None, 1, None])
+        self.assertEqual(self.ranks(), [2, 3, 4, 1, 5])
+
+        Subscribe.objects.filter(athlete=self.athletes[3]).delete()
+        self.assertEqual(self.ranks(self.coach.id), [None, 1, None, None, None])
+        response = self.client.get(reverse('leaderboard_rank', args=[self.board, self.athletes[1].id]),
+                                   {'coach': self.coach.id})
+        self.assertEqual(response.json()['rank'], 1)
+
+    def test_matches_counting(self):
+        Subscribe.objects.create(athlete=self.athletes[0], coach=self.coach)
+        Subscribe.objects.create(athlete=self.athletes[4], coach=self.coach)
+        values = [0.004, 1234567.891, 15.5, 15.5, 0.5, 0.499, 16 ** 10, 2.75, 1234567.891, 3]
+        for index, value in enumerate(values):
+            self.score(self.athletes[index % 5], value)
+            self.assertEqual(self.ranks(), self.brute_ranks())
+            self.assertEqual(self.ranks(self.coach.id), self.brute_ranks(self.coach.id))
+
+        incremental = set(LeaderboardCount.objects.filter(count__gt=0).values_list(
+            'board', 'window', 'period', 'scope', 'level', 'prefix', 'count'
+        ))
+        rebuild_counts()
+        self.assertEqual(set(LeaderboardCount.objects.values_list(
+            'board', 'window', 'period', 'scope', 'level', 'prefix', 'count'
+        )), incremental)
+
+    def test_deleted_athlete_leaves_counts(self):
+        Subscribe.objects.create(athlete=self.athletes[0], coach=self.coach)
+        Subscribe.objects.create(athlete=self.athletes[1], coach=self.coach)
+        for athlete, value in zip(self.athletes, [9, 7, 5, 3, 1]):
+            self.score(athlete, value)
+        self.athletes.pop(0).delete()
+        self.assertEqual(self.ranks(), [1, 2, 3, 4])
+        self.assertEqual(self.ranks(self.coach.id), [1, None, None, None])
+
+        self.coach.delete()
+        self.assertFalse(LeaderboardCount.objects.exclude(scope=0).exists())
+
+
+
+class LeaderboardCountMigrationTests(MigrationTestCase):
+    migrate_from = '0028_packedtrack_id_range'
+    migrate_to = '0029_leaderboardcount'
+
+    def test_backfill(self):
+        OldUser = self.old_apps.get_model('auth', 'User')
+        OldSubscribe = self.old_apps.get_model('app_run', 'Subscribe')
+        OldScore = self.old_apps.get_model('app_run', 'LeaderboardScore')
+        coach = OldUser.objects.create(username='coach', is_staff=True)
+        athletes = [OldUser.objects.create(username=f'athlete{index}') for index in range(3)]
+        OldSubscribe.objects.create(athlete=athletes[2], coach=coach)
+        for athlete, score in zip(athletes, [4.2, 8.5, 1.1]):
+            OldScore.objects.create(board='distance', window='all', period=LeaderboardScore.ALL_PERIOD,
+                                    user=athlete, total=score, count=1, score=score)
+
+        self.migrate(self.migrate_to)
+        ranks = [athlete_rank(Board.DISTANCE, Window.ALL, LeaderboardScore.ALL_PERIOD, athlete.id)['rank']
+                 for athlete in athletes]
+        self.assertEqual(ranks, [2, 1, 3])
+        rank = athlete_rank(Board.DISTANCE, Window.ALL, LeaderboardScore.ALL_PERIOD, athletes[2].id, coach.id)
+        self.assertEqual(rank['rank'], 1)
+
+
+
+class DuplicateUidMigrationTests(MigrationTestCase):
+    migrate_from = '0020_athletestats'
+    migrate_to = '0021_collectibleitem_unique_uid'
+
+    def test_duplicates_merged_into_newest(self):
+        OldUser = self.old_apps.get_model('auth', 'User')
+        OldItem = self.old_apps.get_model('app_run', 'CollectibleItem')
+        first, second, third = [OldUser.objects.create(username=f'athlete_{index}') for index in range(3)]
+
+        def item(uid, name):
+            return OldItem.objects.create(name=name, uid=uid, latitude=55.75, longitude=37.61,
+                                          picture='https://example.com/1.png', value=10)
+
+        oldest, middle, newest = item('coin', 'старая'), item('coin', 'средняя'), item('coin', 'новая')
+        other = item('gem', 'другая')
+        oldest.athletes.add(first, second)
+        middle.athletes.add(second)
+        newest.athletes.add(third)
+        other.athletes.add(first)
+
+        new_apps = self.migrate(self.migrate_to)
+        NewItem = new_apps.get_model('app_run', 'CollectibleItem')
+        coins = NewItem.objects.filter(uid='coin')
+        self.assertEqual([(coin.id, coin.name) for coin in coins], [(newest.id, 'новая')])
+        self.assertEqual(sorted(coins[0].athletes.values_list('id', flat=True)), [first.id, second.id, third.id])
+        self.assertEqual(list(NewItem.objects.get(uid='gem').athletes.values_list('id', flat=True)), [first.id])
+
+
+
+class ImportCollectibleItemsTests(TestCase):
+    HEADER = ['name', 'uid', 'value', 'latitude', 'longitude', 'picture']
+    ROWS = [
+        ['Монета', 'coin', '10', '55.7558', '37.6173', 'https://example.com/coin.png'],
+        ['Кристалл', 'gem', '25', '55.7600', '37.6200', 'https://example.com/gem.png'],
+        ['Без координат', 'broken', '5', '', '37.6200', 'https://example.com/broken.png'],
+        ['Монета дороже', 'coin', '15', '55.7558', '37.6173', 'https://example.com/coin.png'],
+    ]
+
+    def csv_file(self, rows):
+        lines = [','.join(self.HEADER)] + [','.join(row) for row in rows]
+        return SimpleUploadedFile('items.csv', '\n'.join(lines).encode(), content_type='text/csv')
+
+    def xlsx_file(self, rows):
+        workbook = Workbook()
+        workbook.active.append(self.HEADER)
+        for row in rows:
+            workbook.active.append(row)
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        return SimpleUploadedFile('items.xlsx', buffer.getvalue())
+
+    def assert_imported(self):
+        self.assertEqual(list(CollectibleItem.objects.order_by('uid').values_list('uid', 'name', 'value')),
+                         [('coin', 'Монета дороже', 15), ('gem', 'Кристалл', 25)])
+
+    def test_csv_upload(self):
+        response = self.client.post(reverse('upload_collectible_file'), {'file': self.csv_file(self.ROWS)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [self.ROWS[2]])
+        self.assert_imported()
+
+    def test_xlsx_read_only(self):
+        with mock.patch('app_run.importers.load_workbook', wraps=load_workbook) as load:
+            imported, invalid = import_collectible_items(self.xlsx_file(self.ROWS), 'items.xlsx')
+        self.assertEqual(load.call_args.kwargs, {'read_only': True})
+        self.assertEqual(imported, 2)
+        self.assertEqual(invalid, [['Без координат', 'broken', '5', None, '37.6200', 'https://example.com/broken.png']])
+        self.assert_imported()
+
+    def test_upsert_keeps_collectors(self):
+        athlete = User.objects.create(username='athlete')
+        item = CollectibleItem.objects.create(name='Монета', uid='coin', value=1, latitude=Decimal('1'),
+                                              longitude=Decimal('1'), picture='https://example.com/old.png')
+        item.athletes.add(athlete)
+
+        progress = []
+        imported, invalid = import_collectible_items(
+            self.csv_file(self.ROWS), 'items.csv', chunk_size=2, on_progress=lambda *args: progress.append(args)
+        )
+        self.assertEqual((imported, len(invalid)), (3, 1))
+        self.assertEqual(progress, [(2, 2, 0), (4, 3, 1), (4, 3, 1)])
+        self.assert_imported()
+        coin = CollectibleItem.objects.get(uid='coin')
+        self.assertEqual((coin.id, coin.latitude, coin.picture),
+                         (item.id, Decimal('55.7558'), 'https://example.com/coin.png'))
+        self.assertEqual(list(coin.athletes.all()), [athlete])
+
+
+    def upload_async(self, file):
+        # Пул потоков подменяется исполнением на месте: задача ставится после коммита и выполняется сразу
+        with mock.patch('app_run.jobs.get_executor') as executor, self.captureOnCommitCallbacks(execute=True):
+            executor.return_value.submit.side_effect = lambda function, *args: function(*args)
+            response = self.client.post(reverse('upload_collectible_file') + '?mode=async', {'file': file})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'pending')
+        return self.client.get(reverse('upload_collectible_job', args=[response.json()['id']])).json()
+
+    def test_async_job(self):
+        job = self.upload_async(self.csv_file(self.ROWS))
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual((job['rows_processed'], job['rows_imported'], job['rows_rejected']), (4, 2, 1))
+        self.assertEqual(job['invalid_rows'], [self.ROWS[2]])
+        self.assertIsNotNone(job['finished_at'])
+        self.assert_imported()
+
+    def test_async_job_failure(self):
+        job = self.upload_async(SimpleUploadedFile('items.xlsx', b'not a workbook'))
+        self.assertEqual(job['status'], 'failed')
+        self.assertTrue(job['error'])
+        self.assertFalse(CollectibleItem.objects.exists())
+        self.assertEqual(self.client.get(reverse('upload_collectible_job', args=[job['id'] + 1])).status_code, 404)
+
+
+
+class NearbyCollectibleItemsTests(TestCase):
+
+    def create_items(self, latitude, longitude, count, spread):
+        rng = random.Random(count)
+        CollectibleItem.objects.bulk_create([
+            CollectibleItem(name=f'item {index}', uid=f'{latitude} {longitude} {index}', value=1,
+                            latitude=round(latitude + rng.uniform(-spread, spread), 4),
+                            longitude=round((longitude + rng.uniform(-2 * spread, 2 * spread) + 180) % 360 - 180, 4),
+                            picture='https://example.com/item.png')
+            for index in range(count)
+        ])
+
+    def expected(self, latitude, longitude, radius, limit):
+        found = sorted(
+            (haversine((latitude, longitude), (float(item.latitude), float(item.longitude)), unit=Unit.METERS), item.id)
+            for item in CollectibleItem.objects.all()
+        )
+        return [(item_id, round(distance, 1)) for distance, item_id in found if distance <= radius][:limit]
+
+    def nearby(self, latitude, longitude, radius, limit):
+        response = self.client.get(reverse('collectibleitem-nearby'),
+                                   {'latitude': latitude, 'longitude': longitude, 'radius': radius, 'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        return [(item['id'], item['distance']) for item in response.json()]
+
+    def test_nearest_first_within_radius(self):
+        self.create_items(55.7558, 37.6173, 300, 0.3)
+        with self.assertNumQueries(2):
+            found = self.nearby(55.7558, 37.6173, 20_000, 10)
+        self.assertEqual(len(found), 10)
+        self.assertEqual(found, self.expected(55.7558, 37.6173, 20_000, 10))
+        self.assertEqual(self.nearby(55.7558, 37.6173, 20_000, 500), self.expected(55.7558, 37.6173, 20_000, 500))
+
+    def test_across_antimeridian_and_high_latitude(self):
+        self.create_items(65.0, 179.95, 200, 0.2)
+        self.assertEqual(self.nearby(65.0, 179.95, 15_000, 20), self.expected(65.0, 179.95, 15_000, 20))
+        self.assertEqual(self.nearby(65.0, -179.99, 50_000, 500), self.expected(65.0, -179.99, 50_000, 500))
+
+    def test_radius_capped(self):
+        response = self.client.get(reverse('collectibleitem-nearby'),
+                                   {'latitude': 55.7558, 'longitude': 37.6173, 'radius': NEARBY_MAX_RADIUS_M + 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('radius', response.json())
+
+
+
+def make_track(run, count, start=0):
+    # distance накапливается шагами в сотые километра, как при приёме точек
+    distance = sum([0.11] * start)
+    positions = []
+    for index in range(start, start + count):
+        positions.append(Position(run=run, latitude=round(55.75 + index * 0.001, 4), longitude=37.61,
+                                  date_time=START + timedelta(seconds=index * 10, microseconds=index * 1500),
+                                  speed=round(index * 0.37, 2), distance=distance))
+        distance += 0.11
+    Position.objects.bulk_create(positions)
+    return positions
+
+
+
+class PackedReadsTests(TestCase):
+    # Точки упакованного забега читаются по id и в списке своего забега; общий список — только таблица Position
+
+    def setUp(self):
+        athlete = User.objects.create(username='athlete')
+        self.packed = Run.objects.create(athlete=athlete, status=Run.Status.FINISHED)
+        self.live = Run.objects.create(athlete=athlete, status=Run.Status.IN_PROGRESS)
+        for index in range(6):
+            make_track(self.packed, 2, start=index * 2)
+            make_track(self.live, 1, start=index)
+        self.packed_ids = list(self.packed.position.order_by('id').values_list('id', flat=True))
+
+    def get(self, url, data=None, **extra):
+        response = self.client.get(url, data or {}, **extra)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response) if response.streaming else response.json()
+
+    def snapshot(self):
+        run = {'run': self.packed.id}
+        return {
+            'detail': self.get(reverse('position-detail', args=[self.packed_ids[3]])),
+            'run': self.get(reverse('position-list'), run),
+            'page': self.get(reverse('position-list'), {**run, 'size': 5, 'page': 2}),
+            'msgpack': self.get(reverse('position-list'), {**run, 'format': 'msgpack'}),
+            'track': self.get(reverse('position-list'), {**run, 'format': 'track'}),
+        }
+
+    def test_reads_unchanged_after_packing(self):
+        before = self.snapshot()
+        self.assertTrue(pack_run(self.packed))
+        self.assertFalse(Position.objects.filter(run=self.packed).exists())
+        after = self.snapshot()
+        for key in before:
+            self.assertEqual(after[key], before[key], key)
+        self.assertEqual(before['page']['count'], 12)
+
+    def test_unfiltered_list_reads_rows_only(self):
+        self.assertTrue(pack_run(self.packed))
+        live_ids = list(self.live.position.order_by('id').values_list('id', flat=True))
+        with self.assertNumQueries(2):
+            page = self.get(reverse('position-list'), {'size': 4, 'page': 2})
+        self.assertEqual(page['count'], len(live_ids))
+        self.assertEqual([position['id'] for position in page['results']], live_ids[4:])
+        self.assertEqual([position['id'] for position in self.get(reverse('position-list'))], live_ids)
+
+    def test_writes_to_packed_position_rejected(self):
+        self.assertTrue(pack_run(self.packed))
+        url = reverse('position-detail', args=[self.packed_ids[0]])
+        self.assertEqual(self.client.delete(url).status_code, 409)
+        self.assertEqual(self.client.patch(url, {'speed': 1}, content_type='application/json').status_code, 409)
+        self.assertEqual(PackedTrack.objects.get(run=self.packed).count, 12)
+        missing = max(self.packed_ids + list(Position.objects.values_list('id', flat=True))) + 1
+        self.assertEqual(self.client.get(reverse('position-detail', args=[missing])).status_code, 404)
+
+    async def test_live_replay_from_packed_track(self):
+        await sync_to_async(pack_run)(self.packed)
+        response = await self.async_client.get(reverse('live_run', args=[self.packed.id]),
+                                               headers={'Last-Event-ID': str(self.packed_ids[8])})
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = [line[len('data: '):] for line in content.splitlines() if line.startswith('data: ')]
+        positions, finished = json.loads(events[0]), json.loads(events[1])
+        self.assertEqual([position['id'] for position in positions['positions']], self.packed_ids[9:])
+        self.assertEqual(finished['status'], Run.Status.FINISHED)
+
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.runs = [Run.objects.create(athlete=self.athlete, status=Run.Status.FINISHED) for _ in range(2)]
+        make_track(self.runs[0], 7)
+        make_track(self.runs[1], 3, start=7)
+        self.positions = self.client.get(reverse('position-list'), {'run': self.runs[0].id}).json()
+
+    def export(self, export_format, run=None):
+        response = self.client.get(reverse('export_run', args=[(run or self.runs[0]).id, export_format]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_gpx(self):
+        namespace = {'gpx': 'http://www.topografix.com/GPX/1/1'}
+        root = ElementTree.fromstring(self.export('gpx'))
+        points = root.findall('gpx:trk/gpx:trkseg/gpx:trkpt', namespace)
+        self.assertEqual(
+            [(point.get('lat'), point.get('lon'), point.find('gpx:time', namespace).text) for point in points],
+            [(position['latitude'], position['longitude'], position['date_time'] + 'Z') for position in self.positions]
+        )
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('csv').decode())))
+        self.assertEqual([{**row, 'date_time': row['date_time'][:-1]} for row in rows],
+                         [{name: str(value) for name, value in position.items()} for position in self.positions])
+
+    def test_geojson(self):
+        features = json.loads(self.export('geojson'))['features']
+        self.assertEqual(
+            [(feature['properties']['id'], feature['geometry']['coordinates'], feature['properties']['date_time'],
+              feature['properties']['speed'], feature['properties']['distance']) for feature in features],
+            [(position['id'], [float(position['longitude']), float(position['latitude'])],
+              position['date_time'] + 'Z', position['speed'], position['distance']) for position in self.positions]
+        )
+
+    def test_athlete_zip(self):
+        with mock.patch('app_run.exporters.EXPORT_CHUNK_SIZE', 2):
+            response = self.client.get(reverse('export_athlete_runs', args=[self.athlete.id, 'csv']))
+            chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 2)
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), [f'run_{run.id}.csv' for run in self.runs])
+            for run in self.runs:
+                self.assertEqual(archive.read(f'run_{run.id}.csv'), self.export('csv', run))
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get(reverse('export_run', args=[self.runs[0].id, 'kml'])).status_code, 400)
+        url = reverse('export_athlete_runs', args=[self.athlete.id, 'kml'])
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+
+
+class PackRunTests(TestCase):
+
+    def setUp(self):
+        athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=athlete, status=Run.Status.FINISHED)
+
+    def reads(self, position_id):
+        reads = {
+            'list': self.client.get(reverse('position-list'), {'run': self.run.id}).json(),
+            'detail': self.client.get(reverse('position-detail', args=[position_id])).json(),
+        }
+        for export_format in ('gpx', 'csv', 'geojson'):
+            response = self.client.get(reverse('export_run', args=[self.run.id, export_format]))
+            reads[export_format] = b''.join(response)
+        return reads
+
+    def assert_refused(self):
+        count = self.run.position.count()
+        self.assertFalse(pack_run(self.run))
+        self.assertEqual(self.run.position.count(), count)
+        self.assertFalse(PackedTrack.objects.filter(run=self.run).exists())
+
+    def test_round_trip(self):
+        position_id = make_track(self.run, 25)[7].id
+        before = self.reads(position_id)
+        self.assertTrue(pack_run(self.run))
+        self.assertEqual(PackedTrack.objects.get(run=self.run).count, 25)
+        self.assertFalse(self.run.position.exists())
+        self.assertEqual(self.reads(position_id), before)
+        self.assertEqual(len(before['list']), 25)
+        # Повторная упаковка ничего не делает
+        self.assertFalse(pack_run(self.run))
+
+    def test_null_speed_refused(self):
+        positions = make_track(self.run, 5)
+        Position.objects.filter(id=positions[2].id).update(speed=None)
+        self.assert_refused()
+
+    def test_null_distance_refused(self):
+        positions = make_track(self.run, 5)
+        Position.objects.filter(id=positions[3].id).update(distance=None)
+        self.assert_refused()
+
+    def test_id_gap_above_int32_refused(self):
+        positions = make_track(self.run, 3)
+        Position.objects.filter(id=positions[2].id).update(id=positions[1].id + 2 ** 31 + 5)
+        self.assert_refused()
+
+
+
+class PagedTrackFormatTests(TestCase):
+
+    def setUp(self):
+        athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=athlete, status=Run.Status.FINISHED)
+        self.ids = [position.id for position in make_track(self.run, 25)]
+
+    def records(self, response):
+        self.assertEqual(response.content[:len(TRACK_HEADER)], TRACK_HEADER)
+        body = response.content[len(TRACK_HEADER):]
+        return [record[0] for record in POSITION_RECORD.iter_unpack(body)]
+
+    def follow(self, url, data=None):
+        ids, links = [], []
+        response = self.client.get(url, data)
+        while True:
+            ids += self.records(response)
+            links.append(response.get('Link'))
+            next_link = re.search(r'<([^>]+)>; rel="next"', response.get('Link', ''))
+            if not next_link:
+                return ids, links, response
+            response = self.client.get(next_link.group(1))
+
+    def test_page_numbers(self):
+        ids, links, last = self.follow(reverse('position-list'), {'run': self.run.id, 'format': 'track', 'size': 10})
+        self.assertEqual(ids, self.ids)
+        self.assertEqual(len(links), 3)
+        self.assertNotIn('rel="previous"', links[0])
+        self.assertIn('rel="previous"', links[2])
+        self.assertEqual(last['X-Total-Count'], '25')
+
+    def test_cursor(self):
+        ids, links, last = self.follow(reverse('position-list'),
+                                       {'run': self.run.id, 'format': 'track', 'size': 10, 'pagination': 'cursor'})
+        self.assertEqual(ids, self.ids)
+        self.assertNotIn('X-Total-Count', last)
+
+
+
+class StreamedTrackTests(TestCase):
+    # Весь трек без пагинации в msgpack и двоичном формате отдаётся потоком — из таблицы и из PackedTrack
+
+    def setUp(self):
+        athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=athlete, status=Run.Status.FINISHED)
+        make_track(self.run, 30)
+
+    def get(self, **params):
+        response = self.client.get(reverse('position-list'), {'run': self.run.id, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assert_streams(self, positions):
+        response = self.get(format='msgpack')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(b''.join(response.streaming_content)), positions)
+
+        response = self.get(format='track')
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content)
+        self.assertEqual(body[:len(TRACK_HEADER)], TRACK_HEADER)
+        records = list(POSITION_RECORD.iter_unpack(body[len(TRACK_HEADER):]))
+        self.assertEqual(
+            [(id, latitude, longitude, EPOCH + timedelta(microseconds=moment), speed, distance)
+             for id, latitude, longitude, moment, speed, distance in records],
+            [(position['id'], round(float(position['latitude']) * 10000), round(float(position['longitude']) * 10000),
+              datetime.strptime(position['date_time'] + 'Z', EXPORT_DATETIME_FORMAT).replace(tzinfo=timezone.utc),
+              position['speed'], position['distance']) for position in positions]
+        )
+
+    def test_rows_and_packed_track(self):
+        positions = self.get().json()
+        self.assertEqual(len(positions), 30)
+        self.assert_streams(positions)
+        self.assertTrue(pack_run(self.run))
+        self.assert_streams(positions)
+
+    def test_paginated_not_streamed(self):
+        response = self.get(format='msgpack', size=10, page=3)
+        self.assertFalse(response.streaming)
+        page = msgpack.unpackb(response.content)
+        self.assertEqual((page['count'], page['next']), (30, None))
+        self.assertEqual(page['results'], self.get().json()[20:])
+
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='athlete')
+        other = User.objects.create(username='other')
+        self.runs = []
+        for index in range(7):
+            run = Run.objects.create(athlete=self.athlete if index % 3 else other, status=Run.Status.FINISHED)
+            Run.objects.filter(id=run.id).update(created_at=START + timedelta(minutes=(index * 5) % 7))
+            self.runs.append(run.id)
+
+    def follow(self, url, data):
+        ids = []
+        response = self.client.get(url, data)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [item['id'] for item in response.json()['results']]
+            if not response.json()['next']:
+                return ids
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(response.json()['next'])
+            # Следующая страница — условие по ключу последней строки, без OFFSET
+            self.assertFalse(any('OFFSET' in query['sql'] for query in captured.captured_queries))
+
+    def test_runs_newest_first(self):
+        expected = list(Run.objects.order_by('-created_at').values_list('id', flat=True))
+        url = reverse('run-list')
+        self.assertEqual(self.follow(url, {'pagination': 'cursor', 'size': 3}), expected)
+        oldest_first = self.follow(url, {'pagination': 'cursor', 'size': 2, 'ordering': 'created_at'})
+        self.assertEqual(oldest_first, expected[::-1])
+
+    def test_runs_filtered(self):
+        expected = list(Run.objects.filter(athlete=self.athlete).order_by('-created_at').values_list('id', flat=True))
+        found = self.follow(reverse('run-list'), {'pagination': 'cursor', 'size': 2, 'athlete': self.athlete.id})
+        self.assertEqual(found, expected)
+
+    def test_positions_by_time(self):
+        run = Run.objects.get(id=self.runs[1])
+        positions = make_track(run, 9)
+        Position.objects.filter(id=positions[0].id).update(date_time=START + timedelta(hours=1))
+        expected = [position.id for position in positions[1:] + positions[:1]]
+        self.assertEqual(self.follow(reverse('position-list'), {'run': run.id, 'pagination': 'cursor', 'size': 4}),
+                         expected)
+
+    def test_indexes(self):
+        with connection.cursor() as cursor:
+            run_indexes = connection.introspection.get_constraints(cursor, Run._meta.db_table).values()
+            position_indexes = connection.introspection.get_constraints(cursor, Position._meta.db_table).values()
+        self.assertIn(['athlete_id', 'status'], [index['columns'] for index in run_indexes if index['index']])
+        self.assertIn(['created_at'], [index['columns'] for index in run_indexes if index['index']])
+        self.assertIn(['run_id', 'date_time'], [index['columns'] for index in position_indexes if index['index']])
+
+
+
+class FastListSerializerTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        coach = User.objects.create(username='coach', first_name='Тренер', is_staff=True)
+        CoachStats.objects.create(user=coach, rating_sum=9, rating_count=2)
+        athlete = User.objects.create(username='athlete', first_name='Анна', last_name='Ли')
+        AthleteStats.objects.create(user=athlete, runs_count=1)
+        User.objects.create(username='new')
+        self.run = Run.objects.create(athlete=athlete, comment='утро', status=Run.Status.FINISHED, speed=3.14,
+                                      distance=1.2345, run_time_seconds=600)
+        Run.objects.create(athlete=coach, status=Run.Status.INIT)
+        make_track(self.run, 5)
+        Position.objects.create(run=self.run, latitude=Decimal('-0.5'), longitude=Decimal('179.9999'),
+                                date_time=START + timedelta(minutes=5), speed=0, distance=0)
+
+    def responses(self, url, params):
+        bodies = []
+        for fast in (False, True):
+            cache.clear()
+            with self.settings(FAST_LIST_SERIALIZERS=fast), mock.patch.object(
+                FastListSerializer, 'rows', autospec=True, side_effect=FastListSerializer.rows
+            ) as rows:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(rows.called, fast)
+            bodies.append(response.content)
+        return bodies
+
+    def test_identical_json(self):
+        cases = [
+            ('run-list', {}), ('run-list', {'size': 1, 'page': 2}), ('run-list', {'pagination': 'cursor', 'size': 1}),
+            ('position-list', {}), ('position-list', {'run': self.run.id, 'size': 4}),
+            ('user-list', {}), ('user-list', {'type': 'coach'}), ('user-list', {'size': 2}),
+        ]
+        for name, params in cases:
+            with self.subTest(name=name, params=params):
+                slow, fast = self.responses(reverse(name), params)
+                self.assertEqual(fast, slow)
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('benchmark_serializers', rows=30, repeat=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split(':')[0] for line in lines], ['runs', 'positions', 'users'])
+        self.assertTrue(all(line.endswith('JSON совпадает: да') for line in lines))
+        self.assertEqual(User.objects.count(), 3)
+
+
+
+class CompressionTests(TestCase):
+
+    def setUp(self):
+        athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=athlete, status=Run.Status.FINISHED)
+        make_track(self.run, 25)
+        self.url = reverse('position-list') + f'?run={self.run.id}'
+
+    def get(self, url, accept_encoding):
+        return self.client.get(url, HTTP_ACCEPT_ENCODING=accept_encoding)
+
+    def test_encodings(self):
+        plain = self.get(self.url, '')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        compressed = self.get(self.url, 'gzip')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(compressed.content)), plain.json())
+
+        compressed = self.get(self.url, 'gzip, br')
+        self.assertEqual(compressed['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(brotli.decompress(compressed.content)), plain.json())
+        self.assertEqual(self.get(self.url, 'br;q=0.5, gzip')['Content-Encoding'], 'gzip')
+
+    def test_refused_encoding(self):
+        for accept_encoding in ('gzip;q=0', 'gzip;q=0, br;q=0', 'identity'):
+            response = self.get(self.url, accept_encoding)
+            self.assertNotIn('Content-Encoding', response)
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertEqual(response.json()[0]['id'], self.run.position.order_by('id').first().id)
+        self.assertEqual(self.get(self.url, 'gzip;q=0, br')['Content-Encoding'], 'br')
+
+    def test_other_pages_not_compressed(self):
+        response = self.get(reverse('admin:login'), 'gzip, br')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response)
+
+
+
+class PackedTrackRangeMigrationTests(MigrationTestCase):
+    migrate_from = '0027_usersearchtoken'
+    migrate_to = '0028_packedtrack_id_range'
+
+    def test_backfill(self):
+        OldUser = self.old_apps.get_model('auth', 'User')
+        OldRun = self.old_apps.get_model('app_run', 'Run')
+        OldTrack = self.old_apps.get_model('app_run', 'PackedTrack')
+        run = OldRun.objects.create(athlete=OldUser.objects.create(username='athlete'), status='finished')
+        rows = [(position_id, Decimal('55.7500'), Decimal('37.6100'), START + timedelta(seconds=position_id), 1.5, 0.0)
+                for position_id in (7, 9, 40, 41)]
+        track = OldTrack.objects.create(run=run, count=len(rows), data=pack_rows(rows))
+
+        NewTrack = self.migrate(self.migrate_to).get_model('app_run', 'PackedTrack')
+        track = NewTrack.objects.get(id=track.id)
+        self.assertEqual((track.first_id, track.last_id), (7, 41))
+
+
+
+@override_settings(LIVE_HEARTBEAT=0.05, LIVE_BROKER_URL=None)
+class LiveStreamTests(TestCase):
+
+    def setUp(self):
+        self.broker = LocalBroker()
+        patcher = mock.patch('app_run.live.broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.coach = User.objects.create(username='coach', is_staff=True)
+        self.athlete = User.objects.create(username='athlete')
+        other = User.objects.create(username='other')
+        Subscribe.objects.create(athlete=self.athlete, coach=self.coach)
+        self.run = Run.objects.create(athlete=self.athlete, status=Run.Status.IN_PROGRESS)
+        self.other_run = Run.objects.create(athlete=other, status=Run.Status.IN_PROGRESS)
+
+    async def stream(self, url):
+        response = await self.async_client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        return aiter(response.streaming_content)
+
+    async def next_event(self, stream):
+        return (await anext(stream)).decode()
+
+    async def disconnect(self, stream):
+        # Как ASGI-обработчик при разрыве соединения: ожидание следующего события отменяется
+        waiting = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+
+    def parse(self, event):
+        self.assertTrue(event.endswith('\n\n'))
+        fields = dict(line.split(': ', 1) for line in event.rstrip('\n').split('\n'))
+        return fields, json.loads(fields['data'])
+
+    async def test_run_stream(self):
+        stream = await self.stream(reverse('live_run', args=[self.run.id]))
+        # Пока событий нет, поток держится комментариями
+        self.assertEqual(await self.next_event(stream), ': ping\n\n')
+
+        await sync_to_async(self.client.post)(reverse('position-list'), {'run': self.other_run.id, **fix(0)})
+        await sync_to_async(self.client.post)(reverse('position-list'), {'run': self.run.id, **fix(0)})
+        response = await self.async_client.post(reverse('async_positions_batch'),
+                                                {'run': self.run.id, 'positions': [fix(1), fix(2)]},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        ids = [position.id async for position in Position.objects.filter(run=self.run).order_by('id')]
+
+        fields, data = self.parse(await self.next_event(stream))
+        self.assertEqual((fields['id'], fields['event']), (str(ids[0]), 'positions'))
+        self.assertEqual((data['run'], data['athlete']), (self.run.id, self.athlete.id))
+        self.assertEqual(list(data['positions'][0]), ['id', 'latitude', 'longitude', 'date_time', 'speed', 'distance'])
+        fields, data = self.parse(await self.next_event(stream))
+        self.assertEqual(fields['id'], str(ids[2]))
+        self.assertEqual([position['id'] for position in data['positions']], ids[1:])
+
+        await self.async_client.post(reverse('async_stop_run', args=[self.run.id]))
+        fields, data = self.parse(await self.next_event(stream))
+        self.assertEqual((fields['event'], data['status']), ('status', Run.Status.FINISHED))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+        self.assertEqual(self.broker.subscribers, {})
+
+    async def test_reconnect_replays_missed(self):
+        stream = await self.stream(reverse('live_run', args=[self.run.id]))
+        await self.next_event(stream)
+        await sync_to_async(self.client.post)(reverse('position-list'), {'run': self.run.id, **fix(0)})
+        first, _ = self.parse(await self.next_event(stream))
+        await self.disconnect(stream)
+        self.assertEqual(self.broker.subscribers, {})
+
+        await sync_to_async(self.client.post)(reverse('position-list'), {'run': self.run.id, **fix(1)})
+        response = await self.async_client.get(reverse('live_run', args=[self.run.id]),
+                                               headers={'Last-Event-ID': first['id']})
+        stream = aiter(response.streaming_content)
+        _, data = self.parse(await self.next_event(stream))
+        self.assertEqual([position['id'] for position in data['positions']], [int(first['id']) + 1])
+        await self.disconnect(stream)
+
+    async def test_coach_stream(self):
+        stream = await self.stream(reverse('live_coach', args=[self.coach.id]))
+        self.assertEqual(await self.next_event(stream), ': ping\n\n')
+
+        await self.async_client.post(reverse('async_stop_run', args=[self.other_run.id]))
+        await self.async_client.post(reverse('async_stop_run', args=[self.run.id]))
+        fields, data = self.parse(await self.next_event(stream))
+        self.assertEqual((fields['event'], data['run'], data['status']), ('status', self.run.id, Run.Status.FINISHED))
+        self.assertEqual(await self.next_event(stream), ': ping\n\n')
+
+        await self.disconnect(stream)
+        self.assertEqual(self.broker.subscribers, {})
+        response = await self.async_client.get(reverse('live_coach', args=[self.athlete.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+
+class PositionBatchTests(TestCase):
+
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=self.athlete, status=Run.Status.IN_PROGRESS)
+
+    def test_invalid_element_rejected_at_its_index(self):
+        positions = [fix(0), fix(1), fix(2), fix(3), 'garbage']
+        for url in (reverse('position-batch'), reverse('async_positions_batch')):
+            Position.objects.all().delete()
+            response = self.client.post(url, {'run': self.run.id, 'positions': positions},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 201)
+            results = response.json()
+            self.assertEqual([result['accepted'] for result in results], [True, True, True, True, False])
+            self.assertEqual(results[4]['index'], 4)
+            self.assertIn('non_field_errors', results[4]['errors'])
+            self.assertEqual(Position.objects.filter(run=self.run).count(), 4)
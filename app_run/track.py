@@ -0,0 +1,124 @@
+from collections import namedtuple
+
+import numpy as np
+from haversine.haversine import Unit, get_avg_earth_radius
+
+from .geo import EARTH_RADIUS_M
+
+
+EARTH_RADIUS_KM = get_avg_earth_radius(Unit.KILOMETERS)
+# Ниже этой скорости (м/с) отрезок считается остановкой и не входит в moving_time
+MOVING_SPEED = 0.5
+SPLIT_DISTANCE_M = 1000
+
+TrackMetrics = namedtuple(
+    'TrackMetrics', ['segment_distances', 'cumulative_distance', 'speeds', 'moving_time', 'splits']
+)
+
+
+def track_arrays(cords, times):
+    latitudes = np.array([float(latitude) for latitude, _ in cords])
+    longitudes = np.array([float(longitude) for _, longitude in cords])
+    timestamps = np.array([time.timestamp() for time in times])
+    return latitudes, longitudes, timestamps
+
+
+def central_angles(latitudes, longitudes):
+    # То же ядро, что и в пакете haversine, но сразу для всех соседних пар точек
+    lat, lng = np.radians(latitudes), np.radians(longitudes)
+    d = np.sin(np.diff(lat) * 0.5) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lng) * 0.5) ** 2
+    return 2 * np.arcsin(np.sqrt(d))
+
+
+def measure_track(latitudes, longitudes, timestamps, moving_speed=MOVING_SPEED, split_distance=SPLIT_DISTANCE_M):
+    if not len(timestamps):
+        empty = np.zeros(0)
+        return TrackMetrics(empty, empty, empty, 0.0, empty)
+
+    segment_distances = EARTH_RADIUS_M * central_angles(latitudes, longitudes)
+    cumulative_distance = np.concatenate(([0.0], np.cumsum(segment_distances)))
+
+    durations = np.diff(timestamps)
+    speeds = np.zeros_like(segment_distances)
+    np.divide(segment_distances, durations, out=speeds, where=durations > 0)
+    moving_time = float(durations[speeds >= moving_speed].sum())
+
+    # Время каждого полного отрезка split_distance, по линейной интерполяции момента его прохождения
+    marks = np.arange(split_distance, cumulative_distance[-1] + 1e-9, split_distance)
+    elapsed = np.interp(marks, cumulative_distance, timestamps - timestamps[0])
+    splits = np.diff(elapsed, prepend=0.0)
+
+    return TrackMetrics(segment_distances, cumulative_distance, speeds, moving_time, splits)
+
+
+def restart_cumsum(values, starts):
+    # Накопленная сумма, которая начинается заново с каждого индекса из starts
+    total = np.cumsum(values)
+    offsets = np.repeat(total[starts] - values[starts], np.diff(np.append(starts, len(values))))
+    return total - offsets
+
+
+def position_steps(latitudes, longitudes, timestamps, start_distance=0, starts=None):
+    # speed и distance для всех точек в формате Position: м/с по целым секундам и накопленные км до сотых.
+    # У первой точки трека speed 0 и distance start_distance; starts — индексы первых точек, если в массивах
+    # подряд лежат несколько треков. Третьим значением — накопленная дистанция без округления: до сотых
+    # округляется только то, что пишется в Position, иначе ошибка шагов копится в дистанции забега
+    starts = np.array([0]) if starts is None else starts
+    angles = np.concatenate(([0.0], central_angles(latitudes, longitudes)))
+    seconds = np.concatenate(([0.0], np.trunc(np.diff(timestamps))))
+    angles[starts] = 0
+    seconds[starts] = 0
+
+    speeds = np.zeros_like(angles)
+    np.divide(EARTH_RADIUS_M * angles, seconds, out=speeds, where=seconds > 0)
+    distances = start_distance + restart_cumsum(EARTH_RADIUS_KM * angles, starts)
+    return np.round(speeds, 2), np.round(distances, 2), distances
+
+
+def project(latitudes, longitudes):
+    # Равнопромежуточная проекция в метрах относительно средней широты трека — для упрощения этого достаточно
+    lat, lng = np.radians(latitudes), np.radians(longitudes)
+    return EARTH_RADIUS_M * lng * np.cos(lat.mean()), EARTH_RADIUS_M * lat
+
+
+def douglas_peucker(x, y, tolerance):
+    # Индексы точек, оставшихся после упрощения с допуском tolerance (в единицах x/y)
+    keep = np.zeros(len(x), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(x) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        norm = np.hypot(dx, dy)
+        distances = np.abs(dx * py - dy * px) / norm if norm else np.hypot(px, py)
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            middle = start + 1 + index
+            keep[middle] = True
+            stack.extend([(start, middle), (middle, end)])
+    return np.flatnonzero(keep)
+
+
+def simplify_track(latitudes, longitudes, tolerance=None, max_points=None, iterations=30):
+    # tolerance в метрах; при max_points подбирается наименьший допуск, дающий не больше max_points точек
+    if len(latitudes) < 3:
+        return np.arange(len(latitudes))
+    x, y = project(latitudes, longitudes)
+    if tolerance is not None:
+        return douglas_peucker(x, y, tolerance)
+
+    if len(latitudes) <= max_points:
+        return np.arange(len(latitudes))
+    low, high = 0.0, float(np.hypot(np.ptp(x), np.ptp(y)))
+    best = douglas_peucker(x, y, high)
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        indexes = douglas_peucker(x, y, middle)
+        if len(indexes) <= max_points:
+            high, best = middle, indexes
+        else:
+            low = middle
+    return best
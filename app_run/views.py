@@ -1,28 +1,60 @@
+from itertools import groupby
+from operator import itemgetter
+
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, action
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework import viewsets, status
 from rest_framework.views import APIView
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+from rest_framework.settings import api_settings
+from rest_framework.exceptions import NotFound, APIException
 
-from django.db.models import Count, Q, Sum, Min, Max, Avg
+from django.db import transaction
+from django.db.models import Q, F, Min, Window, OuterRef, Subquery, Prefetch, QuerySet, FloatField
+from django.db.models.functions import RowNumber, Coalesce, Cast, NullIf
 from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse, Http404
+from django.utils import timezone
 
 from django_filters.rest_framework import DjangoFilterBackend
 
+import numpy as np
+
 from .serializers import (
     RunSerializer, UserSerializer, AthleteInfoSerializer, ChallengeSerializer, PositionSerializer,
-    CollectibleItemSerializer, SubscribeSerializer, AthletesSubscriptionsSerializer, CoachFollowersSerializer
+    CollectibleItemSerializer, SubscribeSerializer, AthletesSubscriptionsSerializer, CoachFollowersSerializer,
+    PositionFixSerializer, PositionBatchSerializer, UserExpandSerializer, ImportJobSerializer,
+    NearbyCollectibleItemSerializer, NearbyQuerySerializer, ViewportQuerySerializer, LeaderboardQuerySerializer,
+    UserSuggestQuerySerializer
 )
-from .models import Run, User, AthleteInfo, Challenge, Position, CollectibleItem, Subscribe
+from .models import Run, User, AthleteInfo, Challenge, Position, CollectibleItem, Subscribe, ImportJob, PackedTrack
 
-from haversine import haversine, Unit
-from openpyxl import load_workbook
+from .track import simplify_track, track_arrays, measure_track
+from .geo import nearest_ordered
+from .analytics import coach_leaders, rate_coach
+from .ingest import (
+    measure_positions, check_fixes, run_aggregates, recounted_aggregates, items_around, collected_items, stop_run
+)
+from .importers import import_collectible_items
+from .jobs import start_import_job
+from .packing import unpack_positions, unpack_rows, packed_position
+from .fast_serializers import (
+    FastRunSerializer, FastPositionSerializer, FastUserSerializer, FastCollectibleItemSerializer
+)
+from .renderers import MessagePackRenderer, PackedTrackRenderer, stream_track, stream_msgpack
+from .exporters import EXPORT_FORMATS, export_run, export_runs_zip, run_rows
+from .caching import USERS, CHALLENGES, COLLECTIBLE_ITEMS, ANALYTICS, cached_response
+from .live import positions_message, status_message, publish
+from .leaderboards import Board, window_period, top, athlete_rank
+from .search import search_users
 
 
 
 @api_view(['GET'])
+@cached_response('company_details')
 def company_details(request):
     details = {'company_name': settings.COMPANY_NAME,
                'slogan': settings.SLOGAN,
@@ -36,48 +68,186 @@ class BasePagination(PageNumberPagination):
 
 
 
-class RunViewSet(viewsets.ModelViewSet):
+class KeysetPagination(CursorPagination):
+    page_size = 100
+    page_size_query_param = 'size'
+
+
+
+class KeysetSwitchPagination(BasePagination):
+    # Номера страниц по умолчанию; ?cursor=... или ?pagination=cursor переключает на keyset по ordering
+    ordering = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        keyset_requested = 'cursor' in request.query_params or request.query_params.get('pagination') == 'cursor'
+        # Списки (например, распакованный трек) keyset-пагинацию не поддерживают и делятся на страницы по номерам
+        if keyset_requested and isinstance(queryset, QuerySet):
+            self.keyset = KeysetPagination()
+            self.keyset.ordering = self.ordering
+            page = self.keyset.paginate_queryset(queryset, request, view)
+            self.display_page_controls = self.keyset.display_page_controls
+            return page
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.keyset:
+            return self.keyset.to_html()
+        return super().to_html()
+
+
+
+class RunPagination(KeysetSwitchPagination):
+    ordering = '-created_at'
+
+
+
+class PositionPagination(KeysetSwitchPagination):
+    ordering = 'date_time'
+
+
+
+class FastListMixin:
+    # При FAST_LIST_SERIALIZERS list отдаётся через fast_list_serializer, JSON при этом не меняется
+    fast_list_serializer = None
+
+    def use_fast_list(self):
+        return settings.FAST_LIST_SERIALIZERS and self.fast_list_serializer is not None
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_list():
+            return super().list(request, *args, **kwargs)
+
+        serializer = self.fast_list_serializer
+        rows = serializer.rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(rows))
+
+
+
+class UserSearchFilter(SearchFilter):
+    # ?search= через индексы app_run/search.py вместо icontains по всей таблице; без ?ordering выдача по рангу
+
+    def filter_queryset(self, request, queryset, view):
+        found = search_users(queryset, request.query_params.get(self.search_param, ''))
+        return queryset if found is None else found
+
+
+
+class RunViewSet(FastListMixin, viewsets.ModelViewSet):
     queryset = Run.objects.all().select_related('athlete')
     serializer_class = RunSerializer
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = ['status', 'athlete']
     ordering_fields = ['created_at']
-    pagination_class = BasePagination
-
-
-
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = User.objects.annotate(runs_finished=Count('runs', filter=Q(runs__status='finished')), rating=Avg('coach__rating'))
+    pagination_class = RunPagination
+    fast_list_serializer = FastRunSerializer()
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [MessagePackRenderer]
+
+    @action(detail=True, methods=['get'])
+    def metrics(self, request, pk=None):
+        # Время в движении и время каждого полного километра по всем точкам забега
+        run = self.get_object()
+        rows = list(run_rows(run))
+        metrics = measure_track(*track_arrays([(row[1], row[2]) for row in rows], [row[3] for row in rows]))
+        return Response({
+            'run': run.id,
+            'moving_time_seconds': round(metrics.moving_time),
+            'splits': [{'km': index, 'seconds': round(float(seconds), 1)}
+                       for index, seconds in enumerate(metrics.splits, start=1)],
+        })
+
+
+
+class UserViewSet(FastListMixin, viewsets.ReadOnlyModelViewSet):
+    # Счётчики берутся из AthleteStats и CoachStats (связи один к одному), поэтому список — простой проход по users
+    queryset = User.objects.annotate(
+        runs_finished=Coalesce('athlete_stats__runs_count', 0),
+        rating=Cast('coach_stats__rating_sum', FloatField()) / NullIf('coach_stats__rating_count', 0),
+    )
     serializer_class = UserSerializer
-    filter_backends = [SearchFilter, OrderingFilter]
+    filter_backends = [UserSearchFilter, OrderingFilter]
     search_fields = ['first_name', 'last_name']
     ordering_fields = ['date_joined']
     pagination_class = BasePagination
+    fast_list_serializer = FastUserSerializer()
 
-    def get_queryset(self):
-        qs = self.queryset
+    def use_fast_list(self):
+        return super().use_fast_list() and not self.get_expand()
+
+    def get_expand(self):
+        if self.action == 'retrieve':
+            return UserExpandSerializer.EXPANDABLE_FIELDS
+        expand = self.request.query_params.get('expand', '').split(',')
+        return [name for name in UserExpandSerializer.EXPANDABLE_FIELDS if name in expand]
+
+    def filter_type(self, qs):
         type = self.request.query_params.get('type', None)
         if type == 'coach':
-            qs = qs.filter(is_staff=True, is_superuser=False)
+            return qs.filter(is_staff=True, is_superuser=False)
         elif type == 'athlete':
-            qs = qs.filter(is_staff=False, is_superuser=False)
-        else:
-            qs = qs.filter(is_superuser=False)
+            return qs.filter(is_staff=False, is_superuser=False)
+        return qs.filter(is_superuser=False)
+
+    def get_queryset(self):
+        qs = self.filter_type(self.queryset)
+
+        expand = self.get_expand()
+        if 'coach' in expand:
+            last_coach = Subscribe.objects.filter(athlete_id=OuterRef('id')).order_by('-id').values('coach_id')[:1]
+            qs = qs.annotate(last_coach_id=Subquery(last_coach))
+        if 'athletes' in expand:
+            followers = Subscribe.objects.order_by('id').only('id', 'coach_id', 'athlete_id')
+            qs = qs.prefetch_related(Prefetch('coach', queryset=followers, to_attr='follower_subscriptions'))
+        if 'items' in expand:
+            qs = qs.prefetch_related('collectibles')
         return qs
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = self.get_expand()
+        return context
+
     def get_serializer_class(self):
         if self.action == 'list':
-            return UserSerializer
-        elif self.action == 'retrieve':
-            user = self.get_object()
-
-            if user.is_staff:
-                return CoachFollowersSerializer
-            else:
-                return AthletesSubscriptionsSerializer
-
+            return UserExpandSerializer if self.get_expand() else UserSerializer
         return super().get_serializer_class()
 
+    @cached_response('users', [USERS])
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response('users', [USERS])
+    def retrieve(self, request, *args, **kwargs):
+        user = self.get_object()
+        serializer_class = CoachFollowersSerializer if user.is_staff else AthletesSubscriptionsSerializer
+        serializer = serializer_class(user, context=self.get_serializer_context())
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    @cached_response('users_suggest', [USERS])
+    def suggest(self, request):
+        # Подсказки при наборе имени: только id, имя и тип, без счётчиков и их join-ов
+        query = UserSuggestQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        found = search_users(self.filter_type(User.objects.all()), query.validated_data['q'])
+        if found is None:
+            return Response([])
+
+        rows = found.values('id', 'first_name', 'last_name', 'is_staff')[:query.validated_data['limit']]
+        return Response([
+            {'id': row['id'], 'full_name': f'{row["first_name"]} {row["last_name"]}',
+             'type': 'coach' if row['is_staff'] else 'athlete'}
+            for row in rows
+        ])
+
 
 
 class StartAPIView(APIView):
@@ -88,6 +258,7 @@ class StartAPIView(APIView):
         if run.status == Run.Status.INIT:
             run.status = Run.Status.IN_PROGRESS
             run.save()
+            publish(run, status_message(run))
             serializer = self.serializer_class(run)
             return Response(data=serializer.data, status=status.HTTP_200_OK)
         else:
@@ -98,63 +269,44 @@ class StartAPIView(APIView):
 class StopAPIView(APIView):
     serializer_class = RunSerializer
 
-    def check_challenge_ten_runs(self, athlete):
-        finished = athlete.runs.filter(status=Run.Status.FINISHED).count()
-        if finished == 10:
-            self.assign_challenge(athlete, full_name='Сделай 10 Забегов!')
-
-    def check_challenge_fifty_km(self, athlete):
-        total_km = athlete.runs.filter(status=Run.Status.FINISHED).aggregate(total=Sum('distance'))['total']
-        if total_km and total_km >= 50:
-            self.assign_challenge(athlete, full_name='Пробеги 50 километров!')
-
-    def chech_chellenge_twokm_tenmin(self, run):
-        if run.distance >= 2 and run.run_time_seconds <= 600:
-            athlete = run.athlete
-            self.assign_challenge(athlete, full_name='2 километра за 10 минут!')
-
-    def assign_challenge(self, athlete, full_name):
-        Challenge.objects.create(full_name=full_name, athlete=athlete)
-
-    def distance_calculation(self, run):
-        queryset = run.position.all()
-        stack = []
-        distance = 0
-        for positions in queryset:
-            current_position = (positions.latitude, positions.longitude)
-            if stack:
-                distance += haversine(stack[-1], current_position)
-            stack.append(current_position)
-        return distance
-
-    def run_time(self, run):
-        agg_positions = run.position.all().aggregate(
-            first_created_pos=Min('date_time'),
-            last_created_pos=Max('date_time')
-        )
-        first_pos, last_pos = agg_positions['first_created_pos'], agg_positions['last_created_pos']
-        if first_pos and last_pos:
-            run.run_time_seconds = int((last_pos - first_pos).total_seconds())
-            run.save()
-
     def post(self, request, run_id):
-        run = get_object_or_404(Run.objects.select_related('athlete').prefetch_related('position'), id=run_id)
-        if run.status == Run.Status.IN_PROGRESS:
-            run.status = Run.Status.FINISHED
-            run.distance = self.distance_calculation(run)
-            avg_speed = run.position.all().aggregate(avg_speed=Avg('speed'))['avg_speed']
-            run.speed = round(avg_speed if avg_speed else 0, 2)
-            run.save()
-            self.check_challenge_ten_runs(run.athlete)
-            self.check_challenge_fifty_km(run.athlete)
-            self.run_time(run)
-            self.chech_chellenge_twokm_tenmin(run)
+        run = get_object_or_404(Run.objects.select_related('athlete'), id=run_id)
+        if run.status == Run.Status.IN_PROGRESS and stop_run(run):
+            publish(run, status_message(run))
             serializer = self.serializer_class(run)
             return Response(data=serializer.data, status=status.HTTP_200_OK)
         else:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
+class RunExportAPIView(APIView):
+
+    def get(self, request, run_id, export_format):
+        run = get_object_or_404(Run, id=run_id)
+        if export_format not in EXPORT_FORMATS:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        _, extension, content_type = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(export_run(run, export_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="run_{run.id}.{extension}"'
+        return response
+
+
+
+class AthleteExportAPIView(APIView):
+
+    def get(self, request, athlete_id, export_format):
+        athlete = get_object_or_404(User, id=athlete_id)
+        if export_format not in EXPORT_FORMATS:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        runs = athlete.runs.order_by('id')
+        response = StreamingHttpResponse(export_runs_zip(runs, export_format), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="athlete_{athlete.id}_runs.zip"'
+        return response
+
+
+
 class AthleteInfoAPIView(APIView):
     serializer_class = AthleteInfoSerializer
 
@@ -189,50 +341,204 @@ class ChallengesViewSet(viewsets.ReadOnlyModelViewSet):
             qs = qs.filter(athlete=athlete_id)
         return qs
 
+    @cached_response('challenges', [CHALLENGES])
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response('challenges', [CHALLENGES])
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+
+class PackedPositionConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Точка входит в упакованный трек завершённого забега и не изменяется'
 
 
-class PositionViewSet(viewsets.ModelViewSet):
-    queryset = Position.objects.all().select_related('run')
-    serializer_class = PositionSerializer
 
-    def check_item(self, item, position_instance):
-        current_position = (position_instance.latitude, position_instance.longitude)
-        item_position = (item.latitude, item.longitude)
-        distance = haversine(item_position, current_position, unit=Unit.METERS)
-        return distance < 100
+class PositionViewSet(FastListMixin, viewsets.ModelViewSet):
+    queryset = Position.objects.all().select_related('run').order_by('id')
+    serializer_class = PositionSerializer
+    pagination_class = PositionPagination
+    fast_list_serializer = FastPositionSerializer()
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [MessagePackRenderer, PackedTrackRenderer]
 
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if self.action == 'list':
+            return renderers
+        return [renderer for renderer in renderers if not isinstance(renderer, PackedTrackRenderer)]
 
     def get_queryset(self):
-        qs = self.queryset
+        # super() копирует self.queryset: вычисленный однажды атрибут класса отдавал бы старый список
+        qs = super().get_queryset()
         run_id = self.request.query_params.get('run', None)
         if run_id:
             return qs.filter(run=run_id)
         return qs
 
+    def get_object(self):
+        # Точки упакованных забегов хранятся в PackedTrack: чтение восстанавливает точку из трека
+        try:
+            return super().get_object()
+        except Http404:
+            position_id = str(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+            position = packed_position(int(position_id)) if position_id.isdigit() else None
+            if position is None:
+                raise
+            if self.action != 'retrieve':
+                raise PackedPositionConflict()
+            return position
+
+    def run_positions(self, run_id):
+        track = PackedTrack.objects.filter(run_id=run_id).first()
+        if track:
+            return unpack_positions(track)
+        return list(self.get_queryset())
+
+    def simplified(self, run_id, tolerance, max_points):
+        # Для завершённого забега результат не меняется, поэтому считается один раз и кэшируется
+        finished = Run.objects.filter(id=run_id, status=Run.Status.FINISHED).exists()
+        key = f'simplified_track:{run_id}:{tolerance}:{max_points}'
+        data = cache.get(key) if finished else None
+        if data is None:
+            positions = self.run_positions(run_id)
+            if positions:
+                latitudes = np.array([float(position.latitude) for position in positions])
+                longitudes = np.array([float(position.longitude) for position in positions])
+                positions = [positions[i] for i in simplify_track(latitudes, longitudes, tolerance, max_points)]
+            data = self.get_serializer(positions, many=True).data
+            if finished:
+                cache.set(key, data, settings.SIMPLIFIED_TRACK_CACHE_TIMEOUT)
+        return data
+
+    def stream(self, rows, count):
+        # Весь трек без пагинации отдаётся потоком, не собирая ответ в памяти; count — функция,
+        # число точек нужно только для заголовка массива MessagePack
+        renderer = self.request.accepted_renderer
+        if isinstance(renderer, PackedTrackRenderer):
+            content = stream_track(rows)
+        else:
+            serializer = self.fast_list_serializer
+            content = stream_msgpack(
+                rows, count(), lambda row: serializer.to_representation(dict(zip(serializer.values, row)))
+            )
+        return StreamingHttpResponse(content, content_type=renderer.media_type)
+
+    def list(self, request, *args, **kwargs):
+        run_id = request.query_params.get('run', None)
+        run_id = run_id if run_id and run_id.isdigit() else None
+
+        if run_id and ('simplify' in request.query_params or 'max_points' in request.query_params):
+            try:
+                tolerance = float(request.query_params['simplify']) if 'simplify' in request.query_params else None
+                max_points = int(request.query_params['max_points']) if tolerance is None else None
+            except ValueError:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            if (tolerance is not None and tolerance < 0) or (max_points is not None and max_points < 2):
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            return Response(self.simplified(run_id, tolerance, max_points))
+
+        # Упакованный трек читается только для списка одного забега: общий список — это таблица Position,
+        # иначе каждая его страница распаковывала бы все треки
+        track = PackedTrack.objects.filter(run_id=run_id).first() if run_id else None
+
+        paginated = any(param in request.query_params for param in ('size', 'cursor', 'pagination'))
+        if request.accepted_renderer.format in ('track', 'msgpack') and not paginated:
+            if track is not None:
+                return self.stream(unpack_rows(track.data), lambda: track.count)
+            queryset = self.filter_queryset(self.get_queryset())
+            rows = queryset.values_list(*FastPositionSerializer.values).iterator(chunk_size=2000)
+            return self.stream(rows, queryset.count)
+
+        if track is None:
+            return super().list(request, *args, **kwargs)
+
+        # Точки упакованного забега восстанавливаются из PackedTrack и отдаются в том же виде
+        positions = unpack_positions(track)
+        page = self.paginate_queryset(positions)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(positions, many=True).data)
+
+    def update_run_aggregates(self, run, positions, distance):
+        Run.objects.filter(id=run.id).update(**run_aggregates(positions, distance))
+
+    def recount_run_aggregates(self, run_id):
+        rows = Position.objects.filter(run_id=run_id).order_by('id').values_list(
+            'latitude', 'longitude', 'date_time', 'speed'
+        )
+        Run.objects.filter(id=run_id).update(**recounted_aggregates(list(rows)))
+
+    def perform_update(self, serializer):
+        # Точка могла сдвинуться или перейти в другой забег — агрегаты обоих забегов пересчитываются
+        previous_run_id = serializer.instance.run_id
+        with transaction.atomic():
+            position = serializer.save()
+            for run_id in {previous_run_id, position.run_id}:
+                self.recount_run_aggregates(run_id)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            self.recount_run_aggregates(instance.run_id)
+
+    def collect_items(self, athlete, cords):
+        collected = collected_items(items_around(cords), cords)
+        if collected:
+            athlete.collectibles.add(*collected)
+
     def perform_create(self, serializer):
         qs = self.queryset.filter(run__id=serializer.validated_data['run'].id)
         last_pos = qs.last()
 
-        speed, final_distance = 0, 0
+        current_cords = (serializer.validated_data['latitude'], serializer.validated_data['longitude'])
+        speeds, distances, run_distance = measure_positions(
+            serializer.validated_data['run'], last_pos, [current_cords], [serializer.validated_data['date_time']]
+        )
+
+        position_instance = serializer.save(speed=speeds[0], distance=distances[0])
+        self.update_run_aggregates(position_instance.run, [position_instance], run_distance)
+        self.collect_items(position_instance.run.athlete, [current_cords])
+        publish(position_instance.run, positions_message(position_instance.run, [position_instance]))
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        batch_serializer = PositionBatchSerializer(data=request.data)
+        batch_serializer.is_valid(raise_exception=True)
+        run = batch_serializer.validated_data['run']
+
+        last_pos = self.queryset.filter(run=run).last()
+        last_time = last_pos.date_time if last_pos else None
 
-        if last_pos:
-            last_cords = (last_pos.latitude, last_pos.longitude)
-            last_pos_time = last_pos.date_time
+        fixes, results = check_fixes(
+            [(index, PositionFixSerializer(data=fix))
+             for index, fix in enumerate(batch_serializer.validated_data['positions'])],
+            last_time
+        )
+
+        positions = []
+        if fixes:
+            cords, times = [(fix['latitude'], fix['longitude']) for fix in fixes], [fix['date_time'] for fix in fixes]
+            speeds, distances, run_distance = measure_positions(run, last_pos, cords, times)
+            positions = [
+                Position(run=run, speed=speed, distance=distance, **fix)
+                for fix, speed, distance in zip(fixes, speeds, distances)
+            ]
 
-            current_cords = (serializer.validated_data['latitude'], serializer.validated_data['longitude'])
-            current_pos_time = (serializer.validated_data['date_time'])
+        if positions:
+            Position.objects.bulk_create(positions)
+            self.update_run_aggregates(run, positions, run_distance)
+            self.collect_items(run.athlete, [(position.latitude, position.longitude) for position in positions])
+            publish(run, positions_message(run, positions))
 
-            distance = haversine(last_cords, current_cords, unit=Unit.METERS)
-            time = int((current_pos_time - last_pos_time).total_seconds())
-            speed = round(distance / time, 2)
-            final_distance = (last_pos.distance or 0) + round(haversine(last_cords, current_cords), 2)
+        created = iter(positions)
+        for result in results:
+            if result['accepted']:
+                result['id'] = next(created).id
 
-        position_instance = serializer.save(speed=speed, distance=final_distance)
-        athlete = position_instance.run.athlete
-        items = CollectibleItem.objects.all()
-        for item in items:
-            if self.check_item(item, position_instance):
-                item.athletes.add(athlete)
+        return Response(data=results, status=status.HTTP_201_CREATED if positions else status.HTTP_400_BAD_REQUEST)
 
 
 
@@ -240,6 +546,46 @@ class CollectibleItemViewSet(viewsets.ModelViewSet):
     queryset = CollectibleItem.objects.all()
     serializer_class = CollectibleItemSerializer
 
+    @cached_response('collectible_items', [COLLECTIBLE_ITEMS])
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response('collectible_items', [COLLECTIBLE_ITEMS])
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        # Кандидаты из прямоугольника вокруг круга (индекс по широте и долготе) база сортирует по расстоянию
+        # на плоскости и отдаёт первыми; полные записи читаются лишь для отобранных ближайших
+        query = NearbyQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        latitude, longitude, radius, limit = (
+            query.validated_data[name] for name in ('latitude', 'longitude', 'radius', 'limit')
+        )
+
+        candidates = self.queryset.by_planar_distance(latitude, longitude, radius).values_list(
+            'id', 'latitude', 'longitude'
+        )
+        found = nearest_ordered(lambda size: list(candidates[:size]), latitude, longitude, radius, limit)
+        items = self.queryset.in_bulk([item_id for item_id, _ in found])
+        for item_id, distance in found:
+            items[item_id].distance = round(distance, 1)
+
+        serializer = NearbyCollectibleItemSerializer([items[item_id] for item_id, _ in found], many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def viewport(self, request):
+        query = ViewportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        box = [query.validated_data[name] for name in ('min_lat', 'max_lat', 'min_lon', 'max_lon')]
+
+        # На карте бывают тысячи точек, поэтому ответ строится из .values(), JSON тот же, что у list
+        serializer = FastCollectibleItemSerializer()
+        items = self.queryset.within_box(*box).order_by('id')[:query.validated_data['limit']]
+        return Response(serializer.serialize(serializer.rows(items)))
+
 
 
 class CollectibleItemAPIView(APIView):
@@ -251,28 +597,25 @@ class CollectibleItemAPIView(APIView):
         if not file:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        workbook = load_workbook(file)
-        sheet = workbook.active
-        invalid = []
-
-        for row in sheet.iter_rows(min_row=2, values_only=True):
-            data = {
-                'name': row[0],
-                'uid': row[1],
-                'value': row[2],
-                'latitude': row[3],
-                'longitude': row[4],
-                'picture': row[5],
-            }
-            serializer = self.serializer_class(data=data)
-            if serializer.is_valid():
-                serializer.save()
-            else:
-                invalid.append(list(row))
+        if request.query_params.get('mode') == 'async':
+            job = start_import_job(file)
+            return Response(data=ImportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        imported, invalid = import_collectible_items(file, file.name)
         return Response(data=invalid)
 
 
 
+class ImportJobAPIView(APIView):
+    serializer_class = ImportJobSerializer
+
+    def get(self, request, job_id):
+        job = get_object_or_404(ImportJob, id=job_id)
+        serializer = self.serializer_class(job)
+        return Response(data=serializer.data, status=status.HTTP_200_OK)
+
+
+
 class SubscribeAPIView(APIView):
     serializer_class = SubscribeSerializer
 
@@ -301,22 +644,44 @@ class SubscribeAPIView(APIView):
 
 
 class ChallengesSummaryViewSet(viewsets.ReadOnlyModelViewSet):
-    def list(self, request, *args, **kwargs):
-        queryset = Challenge.objects.all().select_related('athlete')
-
-        result = {}
-        for challenge in queryset:
-            athlete = challenge.athlete
-            challenge_name = challenge.full_name
-            athlete_info = {
-                'id': athlete.id,
-                'full_name': f'{athlete.first_name} {athlete.last_name}',
-                'username': athlete.username
+
+    def summarize(self, athletes_size=None, athletes_page=1):
+        # Челленджи идут в порядке первого присвоения, атлеты внутри — по id записи, как и раньше
+        queryset = Challenge.objects.annotate(
+            first_id=Window(Min('id'), partition_by=F('full_name')),
+            row_number=Window(RowNumber(), partition_by=F('full_name'), order_by=F('id').asc()),
+        ).order_by('first_id', 'id')
+
+        if athletes_size:
+            offset = (athletes_page - 1) * athletes_size
+            queryset = queryset.filter(row_number__gt=offset, row_number__lte=offset + athletes_size)
+
+        rows = queryset.values_list(
+            'full_name', 'athlete_id', 'athlete__first_name', 'athlete__last_name', 'athlete__username'
+        ).iterator(chunk_size=2000)
+
+        return [
+            {
+                'name_to_display': challenge_name,
+                'athletes': [
+                    {'id': athlete_id, 'full_name': f'{first_name} {last_name}', 'username': username}
+                    for _, athlete_id, first_name, last_name, username in group
+                ]
             }
-            result.setdefault(challenge_name, {'name_to_display': challenge_name, 'athletes':[]})
-            result[challenge_name]['athletes'].append(athlete_info)
+            for challenge_name, group in groupby(rows, key=itemgetter(0))
+        ]
+
+    @cached_response('challenges_summary', [CHALLENGES])
+    def list(self, request, *args, **kwargs):
+        try:
+            athletes_size = int(request.query_params.get('athletes_size', 0))
+            athletes_page = int(request.query_params.get('athletes_page', 1))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if athletes_size < 0 or athletes_page < 1:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        return Response(list(result.values()))
+        return Response(self.summarize(athletes_size, athletes_page))
 
 
 
@@ -340,8 +705,7 @@ class RateCoachAPIView(APIView):
         subscribe = subscribes.filter(athlete=athlete, coach=coach).first()
 
         if subscribe and isinstance(rating, int) and 0 < rating <= 5:
-            subscribe.rating = rating
-            subscribe.save()
+            rate_coach(subscribe, rating)
             return Response(status=status.HTTP_200_OK)
         else:
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -349,39 +713,40 @@ class RateCoachAPIView(APIView):
 
 class AnalyticsAPIView(APIView):
 
+    @cached_response('analytics', [ANALYTICS])
     def get(self, request, coach_id):
-        athletes = (
-            User.objects.filter(athlete__coach_id=coach_id)
-            .annotate(
-                longest_run=Max('runs__distance'),
-                total_distance=Sum('runs__distance'),
-                avg_speed=Avg('runs__speed')
-            )
-        )
+        return Response(data=coach_leaders(coach_id), status=status.HTTP_200_OK)
+
 
-        max_values = athletes.aggregate(
-            longest_run_value=Max('longest_run'),
-            total_run_value=Max('total_distance'),
-            speed_avg_value=Max('avg_speed')
-        )
 
-        longest = athletes.filter(longest_run=max_values['longest_run_value']).first()
+class LeaderboardAPIView(APIView):
+    # Рейтинги заранее накоплены в LeaderboardScore, поэтому ответ — чтение первых limit строк индекса
 
-        if not longest:
-            return Response(data={}, status=status.HTTP_200_OK)
+    def leaderboard_query(self, request, board):
+        if board not in Board.values:
+            raise NotFound('Таблица лидеров не найдена')
+        query = LeaderboardQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        window = query.validated_data['window']
+        period = window_period(window, query.validated_data.get('date') or timezone.localdate())
+        return window, period, query.validated_data
 
-        total = athletes.filter(total_distance=max_values['total_run_value']).first()
-        fastest = athletes.filter(avg_speed=max_values['speed_avg_value']).first()
+    def get(self, request, board):
+        window, period, query = self.leaderboard_query(request, board)
+        return Response({
+            'board': board,
+            'window': window,
+            'period': period,
+            'results': top(board, window, period, query['limit'], query.get('coach')),
+        })
 
-        analytics_data = {
-            'longest_run_user': longest.id if longest else None,
-            'longest_run_value': max_values['longest_run_value'],
 
-            'total_run_user': total.id if total else None,
-            'total_run_value': max_values['total_run_value'],
 
-            'speed_avg_user': fastest.id if fastest else None,
-            'speed_avg_value': max_values['speed_avg_value']
-        }
+class LeaderboardRankAPIView(LeaderboardAPIView):
+    # Место атлета; rank и score равны null, если у атлета нет очков за период
 
-        return Response(data=analytics_data, status=status.HTTP_200_OK)
\ No newline at end of file
+    def get(self, request, board, athlete_id):
+        window, period, query = self.leaderboard_query(request, board)
+        get_object_or_404(User, id=athlete_id, is_staff=False)
+        rank = athlete_rank(board, window, period, athlete_id, query.get('coach'))
+        return Response({'board': board, 'window': window, 'period': period, **rank})
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,7 +48,12 @@ INSTALLED_APPS = [
     'app_run',
 ]
 
+# Only track and position responses are compressed (gzip with Django's BREACH padding, or brotli);
+# admin and other HTML pages with CSRF tokens are left as they are
+COMPRESSED_PATH_PREFIXES = ['/api/positions/', '/api/runs/', '/api/athletes/']
+
 MIDDLEWARE = [
+    'app_run.middleware.CompressionMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
 
     'django.middleware.security.SecurityMiddleware',
@@ -133,4 +139,63 @@ INTERNAL_IPS = [
 
 COMPANY_NAME = 'Маршрут Мечты'
 SLOGAN = 'Марафон — это не просто дистанция, это путь!'
-CONTACTS = 'город Москва, Проспект Пушкина, дом 3'
\ No newline at end of file
+CONTACTS = 'город Москва, Проспект Пушкина, дом 3'
+
+# Cache: CACHE_URL (redis://...) selects Redis or a compatible server, CACHE_DIR — the file cache,
+# otherwise the local memory cache of each process is used
+
+CACHE_URL = os.environ.get('CACHE_URL')
+CACHE_DIR = os.environ.get('CACHE_DIR')
+
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+elif CACHE_DIR:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_DIR,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+SIMPLIFIED_TRACK_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Response cache TTLs in seconds per endpoint; 0 or a missing endpoint disables caching
+
+RESPONSE_CACHE_TIMEOUTS = {
+    'company_details': 60 * 60,
+    'users': 60,
+    'users_suggest': 60,
+    'challenges': 5 * 60,
+    'challenges_summary': 60,
+    'collectible_items': 5 * 60,
+    'analytics': 60,
+}
+
+# Background imports
+
+IMPORT_WORKERS = 2
+
+# Packed GPS tracks: pack a run's positions into PackedTrack when it is stopped
+
+PACK_FINISHED_TRACKS = False
+
+# List endpoints of runs, positions and users are serialized from .values() rows, the JSON is the same
+
+FAST_LIST_SERIALIZERS = False
+
+# Live runs over Server-Sent Events: LIVE_BROKER_URL (redis://...) shares events between processes,
+# otherwise they are delivered inside the process. Idle streams get a heartbeat comment every LIVE_HEARTBEAT seconds
+
+LIVE_BROKER_URL = os.environ.get('LIVE_BROKER_URL')
+LIVE_HEARTBEAT = 15
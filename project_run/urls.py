@@ -21,7 +21,11 @@ from django.urls import path, include
 
 from app_run.views import (company_details, RunViewSet, UserViewSet, StopAPIView, StartAPIView, AthleteInfoAPIView,
                            ChallengesViewSet, PositionViewSet, CollectibleItemViewSet, CollectibleItemAPIView,
-                           SubscribeAPIView, ChallengesSummaryViewSet, RateCoachAPIView, AnalyticsAPIView)
+                           SubscribeAPIView, ChallengesSummaryViewSet, RateCoachAPIView, AnalyticsAPIView,
+                           ImportJobAPIView, RunExportAPIView, AthleteExportAPIView, LeaderboardAPIView,
+                           LeaderboardRankAPIView)
+from app_run.async_views import (AsyncPositionView, AsyncPositionBatchView, AsyncStartView, AsyncStopView,
+                                 LiveRunView, LiveCoachView)
 
 from debug_toolbar.toolbar import debug_toolbar_urls
 
@@ -39,10 +43,23 @@ urlpatterns = [
     path('', include(router.urls)),
     path('api/runs/<int:run_id>/start/', StartAPIView.as_view(), name='start_run'),
     path('api/runs/<int:run_id>/stop/', StopAPIView.as_view(), name='stop_run'),
+    path('api/runs/<int:run_id>/export/<str:export_format>/', RunExportAPIView.as_view(), name='export_run'),
+    path('api/athletes/<int:athlete_id>/export/<str:export_format>/', AthleteExportAPIView.as_view(),
+         name='export_athlete_runs'),
     path('api/athlete_info/<int:user_id>/', AthleteInfoAPIView.as_view(), name='athlete_info'),
     path('api/upload_file/', CollectibleItemAPIView.as_view(), name='upload_collectible_file'),
+    path('api/upload_file/<int:job_id>/', ImportJobAPIView.as_view(), name='upload_collectible_job'),
     path('api/subscribe_to_coach/<int:coach_id>/', SubscribeAPIView.as_view(), name='subscribe_to_coach'),
     path('api/rate_coach/<int:coach_id>/', RateCoachAPIView.as_view(), name='rate_coach'),
-    path('api/analytics_for_coach/<int:coach_id>/', AnalyticsAPIView.as_view(), name='analytics_for_coach')
+    path('api/analytics_for_coach/<int:coach_id>/', AnalyticsAPIView.as_view(), name='analytics_for_coach'),
+    path('api/leaderboards/<str:board>/', LeaderboardAPIView.as_view(), name='leaderboard'),
+    path('api/leaderboards/<str:board>/athletes/<int:athlete_id>/', LeaderboardRankAPIView.as_view(),
+         name='leaderboard_rank'),
+    path('api/async/positions/', AsyncPositionView.as_view(), name='async_positions'),
+    path('api/async/positions/batch/', AsyncPositionBatchView.as_view(), name='async_positions_batch'),
+    path('api/async/runs/<int:run_id>/start/', AsyncStartView.as_view(), name='async_start_run'),
+    path('api/async/runs/<int:run_id>/stop/', AsyncStopView.as_view(), name='async_stop_run'),
+    path('api/live/runs/<int:run_id>/', LiveRunView.as_view(), name='live_run'),
+    path('api/live/coaches/<int:coach_id>/', LiveCoachView.as_view(), name='live_coach'),
 ] + debug_toolbar_urls()
 